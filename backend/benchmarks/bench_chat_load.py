@@ -0,0 +1,444 @@
+"""
+Offline load test for /api/chat
+
+Runs api.app in-process under concurrent load with no network access:
+  - Gemini is replaced by a scripted pydantic-ai FunctionModel with configurable
+    latency and tool-call pattern,
+  - the MCP servers are stub stdio servers (benchmarks/stub_mcp_server.py) answering
+    like brave_search, memory and sequential_thinking, started through a generated
+    mcp_config.json exactly like the real ones,
+  - Firestore is replaced by an in-memory receipt collection with a query delay.
+
+Reports throughput, p50/p95/p99 latency, time per stage (from the /metrics
+histograms) and memory over time, so changes to the request path can be compared
+run to run.
+
+Run from the backend directory:
+    python benchmarks/bench_chat_load.py --requests 500 --concurrency 32
+    python benchmarks/bench_chat_load.py --model-latency 0.5 --tool-pattern "sequentialthinking;brave_web_search" --json out.json
+
+To drive the real GeminiModel (request building, HTTP, streaming parser) instead of the
+scripted one, start the local stand-in and point the run at it:
+    python benchmarks/gemini_stub_server.py --port 8765 --latency 0.3 &
+    python benchmarks/bench_chat_load.py --gemini-url http://127.0.0.1:8765/v1beta/models/
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+# Add the backend directory (and src/, like index.py does) to the Python path
+backend_dir = pathlib.Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(backend_dir / "src"))
+sys.path.insert(0, str(backend_dir))
+
+QUESTIONS = [
+    "How much did I spend on groceries this month?",
+    "What was my most expensive receipt?",
+    "Show me a chart of my spending by category",
+    "Where can I find cheaper coffee near me?",
+    "List my receipts from Panda",
+    "How does my restaurant spending compare to last month?",
+]
+
+CATEGORIES = ["Groceries", "Restaurants", "Fuel", "Pharmacy", "Electronics", "Coffee"]
+MERCHANTS = ["Panda", "Danube", "Tamimi", "Jarir", "Starbucks", "Al Baik", "Nahdi", "Aldrees"]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline load test for /api/chat")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--warmup", type=int, default=5, help="requests before measuring")
+    parser.add_argument("--model-latency", type=float, default=0.2, help="seconds per model call")
+    parser.add_argument("--flash-latency", type=float,
+                        help="seconds per model call on the flash tier (default: --model-latency)")
+    parser.add_argument("--tool-latency", type=float, default=0.1, help="seconds per MCP tool call")
+    parser.add_argument("--firestore-latency", type=float, default=0.05, help="seconds per receipt query")
+    parser.add_argument("--jitter", type=float, default=0.3, help="+/- fraction applied to every latency")
+    parser.add_argument("--tool-pattern", default="sequentialthinking,read_graph;brave_web_search",
+                        help="tool calls per model step: steps separated by ';', parallel calls by ','")
+    parser.add_argument("--receipts", type=int, default=150, help="receipts in the fake Firestore")
+    parser.add_argument("--context-ttl", type=float, default=60, help="receipt context cache TTL in seconds")
+    parser.add_argument("--sessions", type=int, default=0, help="distinct chat sessions (default: one per client)")
+    parser.add_argument("--use-cache", action="store_true", help="allow answer cache hits (off by default)")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between memory samples")
+    parser.add_argument("--gemini-url", help="use GeminiModel against this Gemini-compatible server "
+                        "(e.g. benchmarks/gemini_stub_server.py) instead of the scripted model")
+    parser.add_argument("--no-mcp", action="store_true", help="don't start the stub MCP servers")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args()
+
+
+def jittered(seconds: float, jitter: float) -> float:
+    return max(0.0, seconds * (1 + random.uniform(-jitter, jitter)))
+
+
+def write_mcp_config(directory: str, tool_latency: float, jitter: float) -> str:
+    """An mcp_config.json that starts one stub server per role."""
+    stub = str(backend_dir / "benchmarks" / "stub_mcp_server.py")
+    servers = {
+        name: {
+            "command": sys.executable,
+            "args": [stub, "--role", role, "--latency", str(tool_latency), "--jitter", str(jitter)],
+            "priority": "essential",
+        }
+        for name, role in [("brave-search", "brave_search"), ("memory", "memory"),
+                           ("sequential-thinking", "sequential_thinking")]
+    }
+    path = os.path.join(directory, "mcp_config.json")
+    with open(path, "w") as config_file:
+        json.dump({"mcpServers": servers}, config_file, indent=2)
+    return path
+
+
+class FakeDocument:
+    def __init__(self, doc_id: str, data: Dict[str, Any]) -> None:
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._data)
+
+
+class FakeQuery:
+    """The part of the Firestore query API fetch_receipt_context uses."""
+
+    def __init__(self, documents: List[FakeDocument], latency: float, jitter: float) -> None:
+        self.documents = documents
+        self.latency = latency
+        self.jitter = jitter
+        self._limit: Optional[int] = None
+
+    def order_by(self, field: str, direction: Any = None) -> "FakeQuery":
+        reverse = str(direction).upper().startswith("DESC")
+        documents = sorted(self.documents, key=lambda doc: doc.to_dict().get(field, ""), reverse=reverse)
+        return FakeQuery(documents, self.latency, self.jitter)
+
+    def where(self, field: str, op: str, value: Any) -> "FakeQuery":
+        documents = [doc for doc in self.documents if doc.to_dict().get(field) == value]
+        return FakeQuery(documents, self.latency, self.jitter)
+
+    def limit(self, count: int) -> "FakeQuery":
+        query = FakeQuery(self.documents, self.latency, self.jitter)
+        query._limit = count
+        return query
+
+    def get(self, timeout: Optional[float] = None) -> List[FakeDocument]:
+        # Runs in a worker thread, like the real blocking client
+        time.sleep(jittered(self.latency, self.jitter))
+        return self.documents[:self._limit] if self._limit is not None else list(self.documents)
+
+
+class FakeFirestore:
+    def __init__(self, receipts: int, latency: float, jitter: float) -> None:
+        rng = random.Random(42)
+        documents = []
+        for i in range(receipts):
+            items = [{"description": f"Item {j}", "price": round(rng.uniform(2, 80), 2)} for j in range(rng.randint(1, 8))]
+            documents.append(FakeDocument(f"receipt-{i:05d}", {
+                "merchant": rng.choice(MERCHANTS),
+                "category": rng.choice(CATEGORIES),
+                "total": round(sum(item["price"] for item in items), 2),
+                "currency": "SAR",
+                "createdTime": f"2025-{rng.randint(1, 4):02d}-{rng.randint(1, 28):02d}T12:00:00",
+                "items": items,
+            }))
+        self.query = FakeQuery(documents, latency, jitter)
+
+    def collection(self, name: str) -> FakeQuery:
+        return self.query
+
+
+TOOL_ARGS = {
+    "sequentialthinking": lambda question: {
+        "thought": f"Break down: {question}", "thoughtNumber": 1, "totalThoughts": 1, "nextThoughtNeeded": False},
+    "brave_web_search": lambda question: {"query": question, "count": 5},
+    "brave_local_search": lambda question: {"query": question, "count": 3},
+    "search_nodes": lambda question: {"query": question.split()[0]},
+    "read_graph": lambda question: {},
+    "create_entities": lambda question: {"entities": [{"name": "user", "entityType": "person", "observations": [question]}]},
+}
+
+
+def scripted_model(latency: float, jitter: float, pattern: List[List[str]]):
+    """A FunctionModel that calls the tools of each pattern step (if the agent has them), then answers."""
+    from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, ToolCallPart, UserPromptPart
+    from pydantic_ai.models.function import FunctionModel
+
+    async def reply(messages, info):
+        await asyncio.sleep(jittered(latency, jitter))
+        # Model steps taken so far in this turn (responses after the latest user prompt)
+        turn_start = max(i for i, message in enumerate(messages) if isinstance(message, ModelRequest)
+                         and any(isinstance(part, UserPromptPart) for part in message.parts))
+        step = sum(1 for message in messages[turn_start:] if isinstance(message, ModelResponse))
+        question = next(part.content for part in messages[turn_start].parts if isinstance(part, UserPromptPart))
+        available = {tool.name for tool in info.function_tools}
+        calls = [name for name in (pattern[step] if step < len(pattern) else []) if name in available]
+        if calls:
+            return ModelResponse(parts=[
+                ToolCallPart(tool_name=name, args=TOOL_ARGS.get(name, lambda q: {})(question), tool_call_id=f"call-{step}-{i}")
+                for i, name in enumerate(calls)
+            ])
+        rows = "".join(f"<tr><td>{merchant}</td><td>{random.randint(10, 500)} SAR</td></tr>" for merchant in MERCHANTS)
+        return ModelResponse(parts=[TextPart(content=(
+            f"```html\n<div class=\"mb-4 p-4 bg-indigo-50 rounded-lg\"><p>{question}</p>"
+            f"<table>{rows}</table></div>\n```"
+        ))])
+
+    return FunctionModel(reply)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def stage_totals(metrics) -> Dict[str, tuple]:
+    """(count, seconds) per pipeline stage, summed over label sets."""
+    stages = {
+        "admission_wait": metrics.ADMISSION_WAIT_SECONDS,
+        "receipt_context_fetch": metrics.RECEIPT_CONTEXT_FETCH_SECONDS,
+        "system_prompt": metrics.SYSTEM_PROMPT_SECONDS,
+        "llm_request": metrics.LLM_REQUEST_SECONDS,
+        "tool_call": metrics.TOOL_CALL_SECONDS,
+        "tool_step": metrics.TOOL_STEP_SECONDS,
+        "postprocess": metrics.POSTPROCESS_SECONDS,
+    }
+    totals = {}
+    for name, histogram in stages.items():
+        series = histogram.totals().values()
+        totals[name] = (sum(count for count, _ in series), sum(total for _, total in series))
+    return totals
+
+
+async def sample_memory(process, samples: List[Dict[str, Any]], state: Dict[str, Any], interval: float) -> None:
+    while True:
+        samples.append({
+            "t": round(time.perf_counter() - state["start"], 2),
+            "completed": state["completed"],
+            "rss_mb": round(process.memory_info().rss / 1024 / 1024, 1),
+            "py_blocks": sys.getallocatedblocks(),
+        })
+        await asyncio.sleep(interval)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    import psutil
+    import api
+    from src.services import direct_context, pydantic_mcp_agent
+    from src.services import metrics
+    from src.services.model_router import model_router
+    from src.services.prompt_cache import context_cache
+    from src.services.tool_cache import tool_cache
+    from src.services.tool_dispatch import tool_steps
+    from src.services.tool_output import output_stats
+    from src.services.tool_selection import tool_selector
+
+    # Swap in the stand-ins (the agent is built lazily, so this happens before it exists)
+    pattern = [step.split(",") for step in args.tool_pattern.split(";") if step] if args.tool_pattern else []
+    if not args.gemini_url:
+        def scripted_tier(model_name=None):
+            flash = model_name is not None and model_name == model_router.model_names.get("flash")
+            latency = args.flash_latency if flash and args.flash_latency is not None else args.model_latency
+            return pydantic_mcp_agent.instrument_model(
+                scripted_model(latency, args.jitter, pattern), model_name or "scripted")
+        pydantic_mcp_agent.get_model = scripted_tier
+    fake_db = FakeFirestore(args.receipts, args.firestore_latency, args.jitter)
+    direct_context.initialize_firebase = lambda: fake_db
+    direct_context._cache_ttl = args.context_ttl
+    pydantic_mcp_agent._receipt_cache_ttl = args.context_ttl
+
+    process = psutil.Process(os.getpid())
+    build_start = time.perf_counter()
+    agent = await api.get_or_create_agent()
+    build_seconds = time.perf_counter() - build_start
+    tool_names = sorted(getattr(agent, "_function_tools", {}))
+
+    transport = httpx.ASGITransport(app=api.app)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    samples: List[Dict[str, Any]] = []
+    state = {"start": time.perf_counter(), "completed": 0}
+    sessions = args.sessions or args.concurrency
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        async def send(index: int, record: bool) -> None:
+            payload = {
+                "message": QUESTIONS[index % len(QUESTIONS)],
+                "session_id": f"load-{index % sessions}",
+                "no_cache": not args.use_cache,
+            }
+            start = time.perf_counter()
+            response = await client.post("/api/chat", json=payload)
+            elapsed = time.perf_counter() - start
+            if not record:
+                return
+            body = response.json()
+            if response.status_code != 200:
+                status = str(response.status_code)
+            elif str(body.get("response", "")).startswith("Sorry, an error occurred"):
+                status = "error"
+            else:
+                status = "cached" if body.get("cached") else "partial" if body.get("partial") else "ok"
+            statuses[status] = statuses.get(status, 0) + 1
+            latencies.append(elapsed)
+            state["completed"] += 1
+
+        for index in range(args.warmup):
+            await send(index, record=False)
+
+        before = stage_totals(metrics)
+        rss_before = process.memory_info().rss
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(args.requests):
+            queue.put_nowait(index)
+
+        async def client_loop() -> None:
+            while not queue.empty():
+                await send(queue.get_nowait(), record=True)
+
+        state["start"] = time.perf_counter()
+        sampler = asyncio.create_task(sample_memory(process, samples, state, args.sample_interval))
+        await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+        duration = time.perf_counter() - state["start"]
+        sampler.cancel()
+        await sample_memory_once(process, samples, state)
+        after = stage_totals(metrics)
+
+    await api.shutdown_mcp_client()
+
+    stages = {}
+    for name in after:
+        count = after[name][0] - before[name][0]
+        seconds = after[name][1] - before[name][1]
+        stages[name] = {
+            "count": count,
+            "per_request": round(count / max(len(latencies), 1), 2),
+            "mean_ms": round(1000 * seconds / count, 2) if count else 0.0,
+        }
+    rss_growth = (process.memory_info().rss - rss_before) / 1024 / 1024
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "json"},
+        "agent_build_seconds": round(build_seconds, 2),
+        "agent_tools": tool_names,
+        "requests": len(latencies),
+        "statuses": statuses,
+        "duration_seconds": round(duration, 2),
+        "throughput_rps": round(len(latencies) / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "mean": round(1000 * statistics.mean(latencies), 1) if latencies else 0.0,
+            "p50": round(1000 * percentile(latencies, 50), 1),
+            "p95": round(1000 * percentile(latencies, 95), 1),
+            "p99": round(1000 * percentile(latencies, 99), 1),
+            "max": round(1000 * max(latencies), 1) if latencies else 0.0,
+        },
+        "stages": stages,
+        "prompt_cache": context_cache.stats(),
+        "tool_selection": tool_selector.stats(),
+        "tool_steps": tool_steps.stats(),
+        "tool_cache": tool_cache.stats(),
+        "tool_output": output_stats.stats(),
+        "model_router": model_router.stats(),
+        "memory": {
+            "rss_growth_mb": round(rss_growth, 1),
+            "rss_growth_mb_per_1k_requests": round(1000 * rss_growth / max(len(latencies), 1), 2),
+            "samples": samples,
+        },
+    }
+
+
+async def sample_memory_once(process, samples: List[Dict[str, Any]], state: Dict[str, Any]) -> None:
+    task = asyncio.create_task(sample_memory(process, samples, state, 3600))
+    await asyncio.sleep(0)
+    task.cancel()
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    latency = report["latency_ms"]
+    print(f"\nAgent built in {report['agent_build_seconds']}s with {len(report['agent_tools'])} tools"
+          f"{': ' + ', '.join(report['agent_tools']) if report['agent_tools'] else ''}")
+    if not report["agent_tools"]:
+        print("  (no tools registered on the agent: the model answers without calling any)")
+    print(f"{report['requests']} requests in {report['duration_seconds']}s "
+          f"-> {report['throughput_rps']} req/s   outcomes: {report['statuses']}")
+    print(f"latency ms   mean {latency['mean']}   p50 {latency['p50']}   p95 {latency['p95']}   "
+          f"p99 {latency['p99']}   max {latency['max']}")
+    print(f"\n{'stage':<24}{'count':>8}{'per req':>9}{'mean ms':>10}")
+    for name, stage in report["stages"].items():
+        print(f"{name:<24}{stage['count']:>8}{stage['per_request']:>9}{stage['mean_ms']:>10}")
+    prompt_cache = report["prompt_cache"]
+    if prompt_cache["hit"] + prompt_cache["miss"] + prompt_cache["bypass"]:
+        print(f"\nprompt prefix ~{prompt_cache['prefix_tokens']} tokens   context cache hits {prompt_cache['hit']}"
+              f"   misses {prompt_cache['miss']}   bypassed {prompt_cache['bypass']}   hit rate {prompt_cache['hit_rate']}")
+    selection = report["tool_selection"]
+    if selection["runs"]:
+        print(f"tool selection: {selection['runs_all']} runs offered all tools, {selection['runs_subset']} a subset, "
+              f"{selection['runs_none']} none   schema tokens withheld {selection['schema_tokens_withheld']} "
+              f"({selection['withheld_share']:.0%})   mandatory calls avoided {selection['mandatory_calls_avoided']}")
+    steps = report["tool_steps"]
+    if steps["parallel_steps"]:
+        print(f"tool steps: {steps['parallel_steps']} of {steps['steps']} ran several calls at once "
+              f"(up to {steps['max_calls_per_step']})   {steps['wall_seconds']}s vs {steps['serial_seconds']}s "
+              f"one by one -> {steps['speedup']}x")
+    tool_results = report["tool_cache"]
+    if tool_results["hit"] + tool_results["shared"] + tool_results["miss"]:
+        print(f"tool cache: {tool_results['hit']} hits, {tool_results['shared']} joined in flight, "
+              f"{tool_results['miss']} misses   hit rate {tool_results['hit_rate']}   "
+              f"{tool_results['entries']} entries ({tool_results['bytes']} bytes)")
+    output = report["tool_output"]
+    if output["bytes_raw"]:
+        print(f"tool output: {output['bytes_raw']} bytes returned, {output['bytes_shaped']} passed to the model "
+              f"({output['saved_share']:.0%} saved)")
+    router = report["model_router"]
+    if router["models"]:
+        print(f"model tiers: routes {router['routes']}   escalations {router['escalations']}")
+        for name, counts in router["models"].items():
+            print(f"  {name:<32}{counts['runs']:>6} runs   mean {counts['mean_seconds']}s   "
+                  f"${counts['cost_usd']:.4f}")
+    memory = report["memory"]
+    print(f"\n{'t (s)':>8}{'done':>8}{'rss MB':>9}{'py blocks':>12}")
+    for sample in memory["samples"]:
+        print(f"{sample['t']:>8}{sample['completed']:>8}{sample['rss_mb']:>9}{sample['py_blocks']:>12}")
+    print(f"RSS growth {memory['rss_growth_mb']} MB ({memory['rss_growth_mb_per_1k_requests']} MB per 1k requests)")
+
+
+def main() -> None:
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="finpal-load-")
+    # api reads its configuration at import time, so set it up first
+    os.environ["MCP_CONFIG_PATH"] = (os.path.join(workdir, "missing.json") if args.no_mcp
+                                     else write_mcp_config(workdir, args.tool_latency, args.jitter))
+    os.environ.setdefault("LLM_API_KEY", "offline-load-test")
+    os.environ["AGENT_WARMUP"] = "false"
+    os.environ["STATE_BACKEND"] = "memory"
+    os.environ["TRACE_EXPORTER"] = "none"
+    os.environ["LOG_LEVEL"] = args.log_level
+    if not args.use_cache:
+        os.environ["ANSWER_CACHE_TTL"] = "0"
+    if args.gemini_url:
+        os.environ["GEMINI_BASE_URL"] = args.gemini_url
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Microbenchmark for the chat response post-processor
+
+Compares services/response_processor.py with the str.replace / re.search cascade
+that used to live inline in chat(), on the kind of replies we actually send:
+multi-KB Chart.js HTML, receipt tables and tool-code replies.
+
+Run from the backend directory:
+    python benchmarks/bench_response_processor.py
+"""
+
+import pathlib
+import re
+import sys
+import timeit
+
+# Add the backend directory to the Python path to fix imports
+backend_dir = pathlib.Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(backend_dir))
+
+from src.services.response_processor import StreamProcessor, process_response
+
+
+def legacy_clean_response_text(response_text):
+    """The cleanup chat() used to run inline (without the print calls)."""
+    if response_text.startswith("```html"):
+        response_text = response_text.replace("```html", "", 1)
+        if response_text.endswith("```"):
+            response_text = response_text[:-3]
+    response_text = response_text.replace("```", "")
+    has_leading_tool_code = False
+    tool_command_patterns = [
+        r'^tool_code', r'^sequential_thinking\.think', r'^sequential_thinking\.run', r'^memory_tool\.',
+        r'^brave_search\.search_and_summarize', r'^print\(brave_search\.', r'^brave_search\.',
+        r'^google_maps\.', r'^yfinance\.'
+    ]
+    for pattern in tool_command_patterns:
+        if re.search(pattern, response_text.strip(), re.DOTALL):
+            has_leading_tool_code = True
+            break
+    if has_leading_tool_code and not response_text.strip().endswith(">"):
+        thinking_result_match = re.search(r'"result":\s*"(.+?)"', response_text, re.DOTALL)
+        if thinking_result_match:
+            extracted_content = thinking_result_match.group(1).replace('\\n', '\n').replace('\\"', '"')
+            response_text += f'\n\n<div class="p-4 bg-gray-50 rounded-lg"><p class="text-lg">{extracted_content}</p></div>'
+        else:
+            normal_text_match = re.search(r'\)\s*\n+([\s\S]+)', response_text)
+            if normal_text_match:
+                response_text += f'\n\n<div class="p-4 bg-gray-50 rounded-lg"><p class="text-lg">{normal_text_match.group(1).strip()}</p></div>'
+            else:
+                response_text += '\n\n<div class="p-4 bg-gray-50 rounded-lg"><p class="text-lg">I\'ve analyzed your question. Please check my thought process for details.</p></div>'
+        response_text = re.sub(r'\\n', '\n', response_text)
+        response_text = re.sub(r'\\"', '"', response_text)
+    return response_text.strip()
+
+
+def chart_response(datasets: int) -> str:
+    """A FORMAT 6 style reply with a Chart.js script, roughly 1 KB per dataset."""
+    data = ", ".join(str(i * 37 % 500) for i in range(60))
+    series = ",\n".join(
+        f"{{ label: 'Series {i}', data: [{data}], backgroundColor: 'rgba(75, 192, 192, 0.2)', borderWidth: 1 }}"
+        for i in range(datasets)
+    )
+    return (
+        "```html\n<div class=\"mb-4 p-4 bg-yellow-50 rounded-lg\">\n"
+        "<h3 class=\"mb-2 text-yellow-600 font-semibold\">📊 DATA VISUALIZATION</h3>\n"
+        "<canvas id=\"finpal-chart-1\"></canvas>\n<script data-chart=\"true\">\n"
+        f"new Chart(ctx, {{ type: 'bar', data: {{ labels: [...], datasets: [\n{series}\n] }} }});\n"
+        "</script>\n</div>\n```"
+    )
+
+
+def receipt_table_response(rows: int) -> str:
+    """A FORMAT 6 RECEIPT LIST reply."""
+    body = "\n".join(
+        f"<tr class=\"hover:bg-gray-50\"><td class=\"py-2 px-4 border-b\">Merchant {i}</td>"
+        f"<td class=\"py-2 px-4 border-b\">2025-04-{i % 28 + 1:02d}</td>"
+        f"<td class=\"py-2 px-4 border-b text-right\">{i * 13.5:.2f} SAR</td>"
+        f"<td class=\"py-2 px-4 border-b\">Food</td></tr>"
+        for i in range(rows)
+    )
+    return f"```html\n<div class=\"mb-4 p-4 bg-indigo-50 rounded-lg\"><table>{body}</table></div>\n```"
+
+
+def tool_code_response(size: int) -> str:
+    thought = "Looking at the receipts, " * (size // 25)
+    return f'tool_code\nsequential_thinking.think(thought="{thought}")\n{{"result": "You spent most on groceries"}}'
+
+
+CASES = {
+    "chart (10 datasets)": chart_response(10),
+    "chart (50 datasets)": chart_response(50),
+    "receipt table (150 rows)": receipt_table_response(150),
+    "tool code (20 KB)": tool_code_response(20_000),
+}
+
+
+def stream(text: str, chunk_size: int = 40) -> str:
+    processor = StreamProcessor()
+    out = [processor.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    out.append(processor.finish())
+    return "".join(out)
+
+
+def main(repeat: int = 200) -> None:
+    print(f"{'case':<28}{'size':>10}{'legacy us':>12}{'new us':>10}{'speedup':>9}{'stream us':>11}")
+    for name, text in CASES.items():
+        assert process_response(text) == legacy_clean_response_text(text), name
+        legacy = min(timeit.repeat(lambda: legacy_clean_response_text(text), number=repeat, repeat=3)) / repeat
+        new = min(timeit.repeat(lambda: process_response(text), number=repeat, repeat=3)) / repeat
+        streamed = min(timeit.repeat(lambda: stream(text), number=repeat // 10 or 1, repeat=3)) / (repeat // 10 or 1)
+        print(f"{name:<28}{len(text):>10}{legacy * 1e6:>12.1f}{new * 1e6:>10.1f}{legacy / new:>8.1f}x{streamed * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
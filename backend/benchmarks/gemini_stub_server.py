@@ -0,0 +1,276 @@
+"""
+Local Gemini-compatible stand-in server
+
+Speaks enough of the Gemini REST protocol (models/{model}:generateContent and
+:streamGenerateContent) for pydantic-ai's GeminiModel: text, functionCall and
+executableCode parts, streamed as the incremental JSON array Gemini sends. Replies
+come from a script (or the built-in one) with configurable latency and token rate,
+so the real agent loop, streaming and tool orchestration can be benchmarked
+reproducibly without network access.
+
+Point the backend at it with:
+    GEMINI_BASE_URL=http://127.0.0.1:8765/v1beta/models/ LLM_API_KEY=local
+
+Run from the backend directory:
+    python benchmarks/gemini_stub_server.py --port 8765 --latency 0.3 --tokens-per-second 80
+    python benchmarks/gemini_stub_server.py --script benchmarks/gemini_script.example.json
+
+Script format (JSON): a list of rules, the first whose "match" regex matches the
+latest user message is used (no "match" matches everything). "steps" are the model
+turns of one agent run, picked by how many model turns the conversation already has
+since that user message (the last step repeats). A step is either a list of parts
+in Gemini's JSON form, or a whole recorded generateContent response body.
+    [{"match": "coffee", "steps": [
+        [{"functionCall": {"name": "brave_web_search", "args": {"query": "coffee Riyadh"}}}],
+        [{"text": "<div>Coffee is cheapest at ...</div>"}]]}]
+A functionCall to a tool the request doesn't declare is dropped (the built-in script
+calls the first --tool-calls tools the agent actually has).
+
+cachedContents (create, delete, and requests that reference one) are supported the
+way Gemini does them, including its rule that a request using a cached content may
+not also send systemInstruction or tools. Errors come back in Gemini's envelope:
+{"error": {"code": 403, "message": "...", "status": "PERMISSION_DENIED"}}.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import uuid
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CHARS_PER_TOKEN = 4
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Local Gemini-compatible stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--script", help="JSON file with scripted or recorded replies")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first byte")
+    parser.add_argument("--tokens-per-second", type=float, default=100, help="output rate (0 = instant)")
+    parser.add_argument("--chunk-tokens", type=int, default=8, help="tokens per streamed chunk")
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- fraction applied to latencies")
+    parser.add_argument("--tool-calls", type=int, default=1,
+                        help="built-in script: parallel tool calls in the first turn (0 = answer right away)")
+    parser.add_argument("--executable-code", action="store_true",
+                        help="built-in script: start the answer with an executableCode part")
+    parser.add_argument("--answer-tokens", type=int, default=300, help="built-in script: answer length")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024,
+                        help="smallest cached content accepted (Gemini rejects smaller ones)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def user_text(content: Dict[str, Any]) -> Optional[str]:
+    """The typed text of a user turn (None for tool results)."""
+    if content.get("role") != "user":
+        return None
+    texts = [part["text"] for part in content.get("parts", []) if "text" in part]
+    return "\n".join(texts) if texts else None
+
+
+def declared_tools(body: Dict[str, Any]) -> List[str]:
+    tools = body.get("tools") or []
+    if isinstance(tools, dict):
+        tools = [tools]
+    return [declaration["name"] for tool in tools for declaration in tool.get("functionDeclarations", [])]
+
+
+def estimate_tokens(value: Any) -> int:
+    return max(1, len(json.dumps(value)) // CHARS_PER_TOKEN)
+
+
+# Google API status names of the HTTP codes the stand-in returns
+ERROR_STATUSES = {400: "INVALID_ARGUMENT", 403: "PERMISSION_DENIED", 404: "NOT_FOUND"}
+
+
+class GeminiError(Exception):
+    """An error the stand-in answers with, in Gemini's error envelope."""
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def response(self) -> JSONResponse:
+        return JSONResponse({"error": {"code": self.code, "message": self.message,
+                                       "status": ERROR_STATUSES.get(self.code, "UNKNOWN")}}, status_code=self.code)
+
+
+class StubGemini:
+    """Picks the reply for a request and paces it like a real model would."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.rules = self.load_script(args.script) if args.script else None
+        self.requests = 0
+        self.cached_contents: Dict[str, Dict[str, Any]] = {}
+        self.cache_creates = 0
+        self.cached_requests = 0
+
+    @staticmethod
+    def load_script(path: str) -> List[Dict[str, Any]]:
+        with open(path, "r") as script_file:
+            rules = json.load(script_file)
+        for rule in rules:
+            rule["pattern"] = re.compile(rule["match"], re.IGNORECASE) if rule.get("match") else None
+        return rules
+
+    def jittered(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + self.random.uniform(-self.args.jitter, self.args.jitter)))
+
+    def reply_parts(self, body: Dict[str, Any]) -> Any:
+        """Parts (or a whole recorded response) for this request."""
+        contents = body.get("contents", [])
+        question_index = max((i for i, content in enumerate(contents) if user_text(content) is not None), default=0)
+        question = user_text(contents[question_index]) if contents else ""
+        step = sum(1 for content in contents[question_index:] if content.get("role") == "model")
+        tools = declared_tools(body)
+
+        if self.rules is None:
+            return self.builtin_reply(question or "", step, tools)
+        for rule in self.rules:
+            if rule["pattern"] is None or rule["pattern"].search(question or ""):
+                steps = rule["steps"]
+                reply = steps[min(step, len(steps) - 1)]
+                if isinstance(reply, list):
+                    reply = [part for part in reply
+                             if "functionCall" not in part or part["functionCall"]["name"] in tools]
+                    reply = reply or [{"text": "<div>Done.</div>"}]
+                return reply
+        return [{"text": "<div>No scripted reply for this question.</div>"}]
+
+    def builtin_reply(self, question: str, step: int, tools: List[str]) -> List[Dict[str, Any]]:
+        if step == 0 and tools and self.args.tool_calls:
+            return [{"functionCall": {"name": name, "args": {}}} for name in tools[:self.args.tool_calls]]
+        words = ("Based on your receipts, your spending on groceries went up this month while "
+                 "restaurants went down. ").split()
+        answer_words = [words[i % len(words)] for i in range(self.args.answer_tokens * CHARS_PER_TOKEN // 6)]
+        parts = [{"text": f"<div class=\"p-4\"><p>{question}</p><p>{' '.join(answer_words)}</p></div>"}]
+        if self.args.executable_code:
+            parts.insert(0, {"executableCode": {"language": "PYTHON", "code": "print(sum([12.5, 40.0, 7.25]))"}})
+        return parts
+
+    def create_cached_content(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        tokens = estimate_tokens(body)
+        if tokens < self.args.cache_min_tokens:
+            raise GeminiError(400, (
+                f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.args.cache_min_tokens}"))
+        name = f"cachedContents/{uuid.uuid4().hex[:16]}"
+        self.cached_contents[name] = {**body, "tokens": tokens}
+        self.cache_creates += 1
+        return {"name": name, "model": body.get("model"), "displayName": body.get("displayName", ""),
+                "usageMetadata": {"totalTokenCount": tokens}}
+
+    def with_cached_content(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """The request with its cached content merged back in (errors like Gemini's)."""
+        name = body.get("cachedContent")
+        if not name:
+            return body
+        if any(field in body for field in ("systemInstruction", "tools", "toolConfig")):
+            raise GeminiError(400, (
+                "CachedContent can not be used with GenerateContent request setting system_instruction, tools or tool_config."))
+        cached = self.cached_contents.get(name)
+        if cached is None:
+            raise GeminiError(403, f"CachedContent not found (or permission denied): {name}")
+        self.cached_requests += 1
+        merged = {field: value for field, value in cached.items() if field in ("systemInstruction", "tools", "toolConfig")}
+        return {**merged, **body, "cachedTokens": cached["tokens"]}
+
+    def response(self, parts: List[Dict[str, Any]], body: Dict[str, Any], model: str) -> Dict[str, Any]:
+        usage = {
+            "promptTokenCount": estimate_tokens(body),
+            "candidatesTokenCount": estimate_tokens(parts),
+            "totalTokenCount": estimate_tokens(body) + estimate_tokens(parts),
+        }
+        if body.get("cachedTokens"):
+            usage["cachedContentTokenCount"] = body["cachedTokens"]
+        return {
+            "candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": usage,
+            "modelVersion": model,
+        }
+
+    def generation_seconds(self, tokens: int) -> float:
+        rate = self.args.tokens_per_second
+        return self.jittered(tokens / rate) if rate > 0 else 0.0
+
+    async def generate(self, body: Dict[str, Any], model: str) -> Dict[str, Any]:
+        self.requests += 1
+        reply = self.reply_parts(body)
+        await asyncio.sleep(self.jittered(self.args.latency) + self.generation_seconds(estimate_tokens(reply)))
+        # A recorded response body is sent back as it was
+        return reply if isinstance(reply, dict) else self.response(reply, body, model)
+
+    async def stream(self, body: Dict[str, Any], model: str):
+        """Yield the reply as Gemini's incremental JSON array, text split into token-sized chunks."""
+        self.requests += 1
+        reply = self.reply_parts(body)
+        if isinstance(reply, dict):
+            reply = reply["candidates"][0]["content"]["parts"]
+        chunks: List[List[Dict[str, Any]]] = []
+        chunk_chars = self.args.chunk_tokens * CHARS_PER_TOKEN
+        for part in reply:
+            if "text" in part:
+                text = part["text"]
+                chunks.extend([{"text": text[i:i + chunk_chars]}] for i in range(0, len(text), chunk_chars))
+            else:
+                chunks.append([part])
+
+        await asyncio.sleep(self.jittered(self.args.latency))
+        yield "["
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(self.generation_seconds(estimate_tokens(chunk)))
+                yield ",\r\n"
+            yield json.dumps(self.response(chunk, body, model))
+        yield "]"
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    stub = StubGemini(args)
+    app = FastAPI(title="Gemini stand-in")
+    app.state.stub = stub
+
+    @app.exception_handler(GeminiError)
+    async def gemini_error(request: Request, error: GeminiError):
+        return error.response()
+
+    @app.post("/v1beta/models/{model_method}")
+    async def model_method(model_method: str, request: Request):
+        model, _, method = model_method.partition(":")
+        body = stub.with_cached_content(await request.json())
+        if method == "generateContent":
+            return JSONResponse(await stub.generate(body, model))
+        if method == "streamGenerateContent":
+            return StreamingResponse(stub.stream(body, model), media_type="application/json")
+        raise GeminiError(404, f"Unsupported method {method!r}")
+
+    @app.post("/v1beta/cachedContents")
+    async def create_cached_content(request: Request):
+        return stub.create_cached_content(await request.json())
+
+    @app.delete("/v1beta/cachedContents/{cache_id}")
+    async def delete_cached_content(cache_id: str):
+        if stub.cached_contents.pop(f"cachedContents/{cache_id}", None) is None:
+            raise GeminiError(404, f"CachedContent not found: cachedContents/{cache_id}")
+        return {}
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": stub.requests, "cached_contents": len(stub.cached_contents),
+                "cache_creates": stub.cache_creates, "cached_requests": stub.cached_requests}
+
+    return app
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    uvicorn.run(create_app(arguments), host=arguments.host, port=arguments.port, log_level="warning")
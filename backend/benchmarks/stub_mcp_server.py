@@ -0,0 +1,95 @@
+"""
+Stub MCP stdio server for the load test
+
+Answers like one of the MCP servers FinPal uses (brave_search, memory or
+sequential_thinking) with canned data, after a configurable delay, so the agent's
+tool path can be exercised without network access or API keys.
+
+Run by bench_chat_load.py through a generated mcp_config.json:
+    python benchmarks/stub_mcp_server.py --role brave_search --latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from typing import Any, Dict, List
+
+from mcp.server.fastmcp import FastMCP
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--role", required=True, choices=["brave_search", "memory", "sequential_thinking"])
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per tool call")
+    parser.add_argument("--jitter", type=float, default=0.5, help="+/- fraction of the latency")
+    return parser.parse_args()
+
+
+args = parse_args()
+server = FastMCP(args.role, log_level="WARNING")
+
+
+async def simulate_work() -> None:
+    await asyncio.sleep(max(0.0, args.latency * (1 + random.uniform(-args.jitter, args.jitter))))
+
+
+if args.role == "brave_search":
+    @server.tool()
+    async def brave_web_search(query: str, count: int = 10) -> str:
+        """Search the web (canned results)."""
+        await simulate_work()
+        return "\n\n".join(
+            f"Title: {query} - result {i}\nDescription: Prices and offers for {query} in Riyadh, "
+            f"updated this week. Average price {20 + i * 3} SAR.\nURL: https://example.com/{i}"
+            for i in range(count)
+        )
+
+    @server.tool()
+    async def brave_local_search(query: str, count: int = 5) -> str:
+        """Search for local businesses (canned results)."""
+        await simulate_work()
+        return "\n\n".join(
+            f"Name: {query} store {i}\nAddress: King Fahd Rd {i}, Riyadh\nRating: {3 + i % 3}.{i % 10}"
+            for i in range(count)
+        )
+
+elif args.role == "memory":
+    graph: Dict[str, Dict[str, Any]] = {}
+
+    @server.tool()
+    async def create_entities(entities: List[Dict[str, Any]]) -> str:
+        """Remember entities."""
+        await simulate_work()
+        for entity in entities:
+            graph[entity.get("name", "")] = entity
+        return json.dumps(entities)
+
+    @server.tool()
+    async def search_nodes(query: str) -> str:
+        """Search remembered entities."""
+        await simulate_work()
+        return json.dumps([entity for name, entity in graph.items() if query.lower() in name.lower()])
+
+    @server.tool()
+    async def read_graph() -> str:
+        """Return everything remembered."""
+        await simulate_work()
+        return json.dumps({"entities": list(graph.values()), "relations": []})
+
+else:
+    @server.tool()
+    async def sequentialthinking(thought: str, thoughtNumber: int, totalThoughts: int,
+                                 nextThoughtNeeded: bool) -> str:
+        """Record one step of a chain of thought."""
+        await simulate_work()
+        return json.dumps({
+            "thoughtNumber": thoughtNumber,
+            "totalThoughts": totalThoughts,
+            "nextThoughtNeeded": nextThoughtNeeded,
+            "thoughtHistoryLength": thoughtNumber,
+        })
+
+
+if __name__ == "__main__":
+    server.run("stdio")
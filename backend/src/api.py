@@ -1,8 +1,10 @@
 # test 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 import uvicorn
+import asyncio
 import os
 import sys
 import pathlib
@@ -11,18 +13,28 @@ import json
 from dotenv import load_dotenv
 import time
 import re
-import traceback
 import uuid
+from contextlib import asynccontextmanager, nullcontext
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
 # Load environment variables
 load_dotenv()
 
+# Set up logging: records go through a queue to a background writer thread, so request
+# handlers never block on stdout (levels via LOG_LEVEL / LOG_LEVELS, see logging_config.py)
+try:
+    from src.services.logging_config import setup_logging, truncate
+    setup_logging()
+except ImportError:
+    logging.basicConfig(level=logging.INFO)
+
+    def truncate(text, limit=80):
+        return str(text)[:limit]
+logger = logging.getLogger(__name__)
+# Per-request messages that would flood the log under load are only written 1 in N times
+LOG_SAMPLE = {"sample_every": int(os.environ.get("LOG_SAMPLE_EVERY", 10))}
+
 # Try to import google.generativeai with proper error handling
 try:
     import google.generativeai as genai
@@ -53,10 +65,105 @@ sys.path.insert(0, str(services_dir))
 
 # Import our services
 try:
-    from src.services.pydantic_mcp_agent import get_pydantic_ai_agent
+    from src.services.pydantic_mcp_agent import (
+        get_pydantic_ai_agent,
+        get_receipt_fingerprint,
+        get_receipt_records,
+        RECEIPT_CONTEXT_LIMIT,
+        system_prompt_parts,
+    )
 except ImportError:
     logger.error("Failed to import pydantic_mcp_agent")
-    get_pydantic_ai_agent = None
+    get_pydantic_ai_agent = get_receipt_fingerprint = get_receipt_records = system_prompt_parts = None
+    RECEIPT_CONTEXT_LIMIT = None
+
+# Pydantic AI node and event types used by the streaming endpoint
+try:
+    from pydantic_ai import Agent
+    from pydantic_ai.messages import (
+        FunctionToolCallEvent,
+        FunctionToolResultEvent,
+        PartDeltaEvent,
+        ModelRequest,
+        ModelResponse,
+        PartStartEvent,
+        RetryPromptPart,
+        TextPart,
+        TextPartDelta,
+        UserPromptPart,
+    )
+except ImportError:
+    logger.error("Failed to import pydantic_ai, streaming chat will not work")
+    Agent = None
+
+try:
+    from src.services.conversation_store import ConversationStore, DEFAULT_SESSION_ID, SharedConversationStore
+except ImportError:
+    logger.error("Failed to import conversation_store")
+    ConversationStore = SharedConversationStore = None
+
+try:
+    from src.services.state_store import SqliteStateStore
+except ImportError:
+    logger.error("Failed to import state_store")
+    SqliteStateStore = None
+
+try:
+    from src.services.history_compactor import compact_history
+except ImportError:
+    logger.error("Failed to import history_compactor")
+    compact_history = None
+
+try:
+    from src.services.response_processor import StreamProcessor, process_response
+except ImportError:
+    logger.error("Failed to import response_processor")
+    StreamProcessor = process_response = None
+
+try:
+    from src.services.answer_cache import AnswerCache, SharedAnswerCache, make_cache_key
+except ImportError:
+    logger.error("Failed to import answer_cache")
+    AnswerCache = SharedAnswerCache = None
+
+try:
+    from src.services.single_flight import SingleFlight
+except ImportError:
+    logger.error("Failed to import single_flight")
+    SingleFlight = None
+
+try:
+    from src.services.admission import AdmissionController, AdmissionRejected
+except ImportError:
+    logger.error("Failed to import admission")
+    AdmissionController = None
+
+    class AdmissionRejected(Exception):
+        pass
+
+try:
+    from src.services.cancellation import run_scope
+except ImportError:
+    logger.error("Failed to import cancellation, tool calls won't be cancelled with their run")
+    run_scope = nullcontext
+
+try:
+    from src.services.deadline import deadline_scope
+except ImportError:
+    logger.error("Failed to import deadline, requests will run without a time budget")
+    deadline_scope = lambda seconds, answer_reserve=0: nullcontext()
+
+try:
+    from src.services import metrics
+except ImportError:
+    logger.error("Failed to import metrics, /metrics will be empty")
+    metrics = None
+
+try:
+    from src.services import tracing
+except ImportError:
+    logger.error("Failed to import tracing")
+    tracing = None
 
 try:
     from src.services.direct_context import fetch_receipt_context
@@ -64,8 +171,83 @@ except ImportError:
     logger.error("Failed to import direct_context")
     fetch_receipt_context = None
 
+try:
+    from src.services.intent_router import route as route_question
+except ImportError:
+    logger.error("Failed to import intent_router, every question will go to the agent")
+    route_question = None
+
+try:
+    from src.services.prompt_cache import context_cache
+except ImportError:
+    logger.error("Failed to import prompt_cache")
+    context_cache = None
+
+try:
+    from src.services.tool_selection import tool_selector
+except ImportError:
+    logger.error("Failed to import tool_selection")
+    tool_selector = None
+
+try:
+    from src.services.tool_cache import tool_cache
+except ImportError:
+    logger.error("Failed to import tool_cache")
+    tool_cache = None
+
+try:
+    from src.services.tool_output import output_stats
+except ImportError:
+    logger.error("Failed to import tool_output")
+    output_stats = None
+
+try:
+    from src.services.model_router import model_router
+except ImportError:
+    logger.error("Failed to import model_router")
+    model_router = None
+
+# Start building the agent (and its MCP servers) when the server starts, instead of on the
+# first request, and clean up on shutdown. Set AGENT_WARMUP=false to build it lazily again
+AGENT_WARMUP = os.environ.get("AGENT_WARMUP", "true").lower() not in ("0", "false", "no")
+
+@asynccontextmanager
+async def lifespan(app):
+    warmup_task = None
+    if AGENT_WARMUP:
+        logger.info("Warming up AI agent in the background")
+        warmup_task = asyncio.create_task(warm_up_agent())
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+        try:
+            await warmup_task
+        except (asyncio.CancelledError, Exception):
+            pass
+    await shutdown_mcp_client()
+    if tracing is not None:
+        tracing.get_exporter().shutdown()
+    if state_store is not None:
+        state_store.close()
+
+# Trace spans go nowhere unless TRACE_EXPORTER is set (TRACE_EXPORTER=jsonl writes TRACE_FILE)
+if tracing is not None:
+    tracing.configure_from_env()
+
+# Helper function: Open the root span of a request (continuing the caller's X-Trace-ID if sent)
+def start_request_trace(name, request, **attributes):
+    if tracing is None:
+        return nullcontext()
+    return tracing.start_trace(name, trace_id=request.headers.get("x-trace-id"), **attributes)
+
+# Helper function: Open a child span of the current request
+def trace_span(name, **attributes):
+    if tracing is None:
+        return nullcontext()
+    return tracing.span(name, **attributes)
+
 # Create a new FastAPI app (this is our web server)
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Allow requests from our frontend (CORS settings)
 # Without this, the browser would block requests from your frontend
@@ -81,27 +263,216 @@ app.add_middleware(
 # This makes responses faster and maintains conversation context
 global_mcp_client = None
 global_agent = None
-messages_history = []
-MAX_HISTORY_LENGTH = 20  # Maximum number of message pairs to keep in history
-
-# Function to limit message history size
-def limit_message_history():
-    global messages_history
-    # If message history is getting too long, trim it
-    # Keep only the most recent MAX_HISTORY_LENGTH messages
-    if len(messages_history) > MAX_HISTORY_LENGTH * 2:  # Each exchange has 2 messages (user & assistant)
-        print(f"Trimming message history from {len(messages_history)} to {MAX_HISTORY_LENGTH * 2} messages")
-        messages_history = messages_history[-MAX_HISTORY_LENGTH * 2:]
+# Token budget for the conversation history sent to Gemini (system prompt not included)
+# Older turns are folded into a summary and stale tool outputs stubbed to stay under it
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 8000))
+MAX_SESSION_MESSAGES = int(os.environ.get("MAX_SESSION_MESSAGES", 200))  # Hard safety cap only
+
+# Where conversation history and cached answers live: "memory" (this process only)
+# or "sqlite" (a file shared by every worker, needed when running with WORKERS > 1)
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory").lower()
+state_store = None
+if STATE_BACKEND == "sqlite" and SqliteStateStore is not None:
+    state_store = SqliteStateStore(os.environ.get("STATE_DB_PATH", "finpal_state.db"))
+elif STATE_BACKEND != "memory":
+    logger.warning("STATE_BACKEND=%s is not available, keeping state in memory", STATE_BACKEND)
+# The shared store evicts every STATE_EVICT_EVERY writes (eviction locks the SQLite file)
+STATE_EVICT_EVERY = int(os.environ.get("STATE_EVICT_EVERY", 50))
+
+# Helper function: Call the conversation store or answer cache without blocking the event loop
+# The shared stores wait on SQLite (up to its busy timeout), so they run in a worker thread
+async def call_store(fn, *args):
+    if state_store is None:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+# Conversation history is kept per session (see services/conversation_store.py)
+# so users don't share context, and only the new messages of each turn are added
+conversation_store = (SharedConversationStore if state_store is not None else ConversationStore)(
+    **({"store": state_store, "evict_every": STATE_EVICT_EVERY} if state_store is not None else {}),
+    max_sessions=int(os.environ.get("MAX_CHAT_SESSIONS", 1000)),
+    max_session_messages=MAX_SESSION_MESSAGES,
+    max_session_bytes=int(os.environ.get("MAX_SESSION_HISTORY_BYTES", 256 * 1024)),
+    max_total_bytes=int(os.environ.get("MAX_HISTORY_BYTES", 64 * 1024 * 1024)),
+)
+
+# Helper function: Get a session's history, compacted to fit the token budget
+def get_message_history(session_id):
+    history = conversation_store.get(session_id)
+    if compact_history is None or not history:
+        return history
+    try:
+        compacted, stats = compact_history(history, token_budget=HISTORY_TOKEN_BUDGET)
+        if stats["folded_turns"] or stats["stubbed_tool_returns"]:
+            # Keep the compacted version so the summary carries over to the next turn
+            conversation_store.replace(session_id, compacted)
+            logger.info("History compacted from ~%d to ~%d tokens", stats["tokens_before"], stats["tokens_after"], extra=LOG_SAMPLE)
+        return compacted
+    except Exception as compaction_error:
+        logger.warning("Could not compact message history: %s", compaction_error)
+        return history
+
+# Helper function: Save the new messages of an agent run to the session history
+def save_message_history(session_id, result):
+    try:
+        if hasattr(result, 'new_messages') and callable(result.new_messages):
+            conversation_store.append(session_id, result.new_messages())
+    except Exception as history_error:
+        logger.warning("Could not save message history: %s", history_error)
+
+# Cache of final answers, so a repeated question doesn't pay for another full agent run
+# Set ANSWER_CACHE_TTL=0 to turn it off
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 600))
+answer_cache = None
+if AnswerCache is not None and ANSWER_CACHE_TTL > 0:
+    answer_cache_size = int(os.environ.get("ANSWER_CACHE_SIZE", 500))
+    if state_store is not None:
+        answer_cache = SharedAnswerCache(state_store, max_entries=answer_cache_size, ttl_seconds=ANSWER_CACHE_TTL,
+                                         evict_every=STATE_EVICT_EVERY)
+    else:
+        answer_cache = AnswerCache(max_entries=answer_cache_size, ttl_seconds=ANSWER_CACHE_TTL)
+
+# Helper function: Build the answer cache key for a message (None = don't use the cache)
+# The key includes a fingerprint of the receipt context, so a new receipt means a new key
+# Turns with conversation history aren't cached: "and last month?" depends on what came before
+async def get_answer_cache_key(message, fingerprint=None, session_id=None):
+    if answer_cache is None or message.no_cache or get_receipt_fingerprint is None:
+        return None
+    if session_id is not None and await call_store(conversation_store.get, session_id):
+        return None
+    if fingerprint is None:
+        try:
+            # Fetching the receipt context can hit Firestore, keep it off the event loop
+            fingerprint = await asyncio.to_thread(get_receipt_fingerprint)
+        except Exception as fingerprint_error:
+            logger.warning("Could not fingerprint receipt context, skipping answer cache: %s", fingerprint_error)
+            return None
+    return make_cache_key(message.message, message.user_id or "anonymous", fingerprint)
+
+# Helper function: Add a cached or locally routed answer to the session history so follow-up questions have context
+def remember_cached_turn(agent, session_id, question, answer):
+    if Agent is None:
+        return
+    parts = [UserPromptPart(content=question)]
+    if not conversation_store.get(session_id):
+        # An empty history is how pydantic-ai knows it has to add the system prompt, so a
+        # history started here leads with the prompt parts it fills in on the next run
+        parts = (system_prompt_parts(agent) if system_prompt_parts is not None else []) + parts
+    conversation_store.append(session_id, [
+        ModelRequest(parts=parts),
+        ModelResponse(parts=[TextPart(content=answer)]),
+    ])
+
+# Plain receipt lookups ("list my receipts", "how much did I spend at Starbucks") are
+# answered straight from the receipt records, without an agent run. INTENT_ROUTER=false
+# sends every question to the agent
+INTENT_ROUTER = os.environ.get("INTENT_ROUTER", "true").lower() not in ("0", "false", "no")
+
+# Helper function: The locally routed answer to a message, or None if it needs the agent
+async def answer_locally(message):
+    if route_question is None or get_receipt_records is None or not INTENT_ROUTER or message.no_cache:
+        return None
+    with trace_span("intent_router") as route_span:
+        try:
+            # The records come with the receipt context, which can hit Firestore
+            records = await asyncio.to_thread(get_receipt_records)
+            # The records are only the latest RECEIPT_CONTEXT_LIMIT receipts
+            routed = (route_question(message.message, records, limit=RECEIPT_CONTEXT_LIMIT)
+                      if records is not None else None)
+        except Exception as route_error:
+            logger.warning("Intent router failed, using the agent: %s", route_error)
+            routed = None
+        intent = routed.intent if routed is not None else "llm"
+        if route_span is not None:
+            route_span.set_attribute("intent", intent)
+    if metrics is not None:
+        metrics.INTENT_ROUTES_TOTAL.inc(intent=intent)
+    return routed
+
+# Limit how many agent runs hit Gemini at once. Extra requests wait in a bounded queue,
+# and get a 429 (queue full) or 503 (waited too long) with Retry-After instead of piling up
+admission = AdmissionController(
+    max_concurrent=int(os.environ.get("MAX_CONCURRENT_AGENT_RUNS", 8)),
+    max_queue=int(os.environ.get("AGENT_QUEUE_SIZE", 32)),
+    queue_timeout=float(os.environ.get("AGENT_QUEUE_TIMEOUT", 30)),
+)
+
+# Helper function: Turn an admission rejection into a 429/503 response with Retry-After
+def admission_rejected_response(rejection):
+    return JSONResponse(
+        status_code=rejection.status_code,
+        content={"response": f"Sorry, {rejection.reason.lower()}.", "retry_after": rejection.retry_after},
+        headers={"Retry-After": str(rejection.retry_after)},
+    )
+
+# Only one request (or the startup warm-up) may build the agent, the others wait for it
+agent_lock = asyncio.Lock()
+# Warm-up progress for /api/ready (the MCP client is kept so we can report per-server status)
+warmup_state = {"status": "idle", "started_at": None, "seconds": None, "error": None}
+warmup_client = None
+
+# Helper function: Remember the MCP client being started so /api/ready can show its servers
+def track_warmup_client(client):
+    global warmup_client
+    warmup_client = client
 
 # Helper function: Get existing agent or create a new one if needed
 async def get_or_create_agent():
     global global_mcp_client, global_agent
-    if global_agent is None:
-        # This calls the function from pydantic_mcp_agent.py that sets up the AI
-        # It returns both the MCP client and the agent
-        global_mcp_client, global_agent = await get_pydantic_ai_agent()
+    if global_agent is not None:
+        return global_agent
+    async with agent_lock:
+        # Someone else may have built it while we waited for the lock
+        if global_agent is None:
+            start_time = time.time()
+            warmup_state.update(status="warming", started_at=datetime.now().isoformat(), error=None)
+            try:
+                # This calls the function from pydantic_mcp_agent.py that sets up the AI
+                # It returns both the MCP client and the agent
+                global_mcp_client, global_agent = await get_pydantic_ai_agent(on_client=track_warmup_client)
+            except BaseException as e:
+                warmup_state.update(status="failed", error=str(e) or type(e).__name__)
+                raise
+            warmup_state.update(status="ready", seconds=round(time.time() - start_time, 2))
+            logger.info("AI agent ready after %.2f seconds", warmup_state["seconds"])
     return global_agent
 
+# Helper function: Build the agent at startup so the first user doesn't pay for it
+async def warm_up_agent():
+    try:
+        await get_or_create_agent()
+    except Exception as e:
+        # Requests will retry the build, so just log it
+        logger.exception("Agent warm-up failed: %s", e)
+
+# Helper function: Shut down the MCP servers
+async def shutdown_mcp_client():
+    if global_mcp_client is not None:
+        try:
+            await global_mcp_client.cleanup()
+            logger.info("MCP client resources cleaned up")
+        except Exception as e:
+            logger.error("Error cleaning up MCP client: %s", e)
+
+# ENDPOINT: Liveness probe
+# Only says the process is up and serving, never touches the agent
+@app.get("/api/live")
+async def live():
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+# ENDPOINT: Readiness probe
+# 200 once the agent is built, 503 while it is still warming up (with per-server progress)
+@app.get("/api/ready")
+async def ready():
+    is_ready = global_agent is not None
+    client = global_mcp_client or warmup_client
+    body = {
+        "ready": is_ready,
+        "warmup": dict(warmup_state),
+        "servers": client.server_status() if client is not None and hasattr(client, "server_status") else [],
+    }
+    return JSONResponse(status_code=200 if is_ready else 503, content=body)
+
 # ENDPOINT 1: Health check
 # Frontend uses this to check if the backend is running
 @app.get("/api/health")
@@ -139,12 +510,12 @@ async def connect():
             "tools": [] if not hasattr(agent, 'tools') or not agent.tools else [{"name": tool.name} for tool in agent.tools]
         }
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR IN /api/connect: {str(e)}\n{error_details}")
+        logger.exception("Error in /api/connect")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ENDPOINT 3: Get available tools 
+# (with how often per-query tool selection held some of them back, the calls in flight per server,
+# and the bytes of tool output shaping kept from the model)
 @app.get("/api/tools")
 async def get_tools():
     try:
@@ -152,148 +523,480 @@ async def get_tools():
         tool_info = []
         if hasattr(agent, 'tools'):
             tool_info = [{"name": tool.name} for tool in agent.tools]
-        return {"tools": tool_info}
+        response = {"tools": tool_info}
+        if tool_selector is not None:
+            response["selection"] = tool_selector.stats()
+        if global_mcp_client is not None:
+            response["dispatch"] = global_mcp_client.dispatch_stats()
+        if output_stats is not None:
+            response["output"] = output_stats.stats()
+        return response
     except Exception as e:
         return {"error": str(e), "tools": []}
 
 # Define the expected format for chat messages coming from frontend
 class ChatMessage(BaseModel):
     message: str  # Each message will have a "message" field with the user's text
+    session_id: Optional[str] = None  # Which conversation this message belongs to
+    user_id: Optional[str] = None  # Who is asking (part of the answer cache key)
+    no_cache: bool = False  # Set to skip the answer cache and always run the agent
+    # Time budget for the answer (default CHAT_DEADLINE_SECONDS); only the server can turn it off
+    deadline_seconds: Optional[float] = Field(None, gt=0)
 
-# ENDPOINT 4: Process chat messages
-# This is the main endpoint that handles user messages
-@app.post("/api/chat")
-async def chat(message: ChatMessage):
-    global messages_history
+# Helper function: Work out which conversation a request belongs to
+# The body field wins, then the X-Session-ID header, then the shared default session
+def get_session_id(session_id: Optional[str], request: Request) -> str:
+    return session_id or request.headers.get("x-session-id") or DEFAULT_SESSION_ID
+
+# Helper function: Pull the response text out of an agent run result
+def extract_response_text(result):
+    # Get the response content from the result
+    # The AgentRunResult object from pydantic-ai has the response in data
+    response_text = ""
+
+    # Check the structure of the result to determine how to extract the response
+    if hasattr(result, 'data'):
+        response_text = result.data
+    elif hasattr(result, 'text'):
+        response_text = result.text
+    elif hasattr(result, 'content'):
+        response_text = result.content
+    elif hasattr(result, 'response'):
+        response_text = result.response
+    else:
+        # Fallback to string representation
+        logger.warning("Couldn't extract text directly. Result object: %r", result)
+        response_text = str(result)
+    return response_text
+
+# Helper function: Clean up the final response text before it goes to the frontend
+# (fence removal and tool-code handling live in services/response_processor.py)
+def clean_response_text(response_text):
+    start_time = time.perf_counter()
+    response_text = process_response(response_text)
+    if metrics is not None:
+        metrics.POSTPROCESS_SECONDS.observe(time.perf_counter() - start_time)
+    if isinstance(response_text, str):
+        # Log the final response length
+        logger.debug("Final response length: %d characters", len(response_text))
+    return response_text
+
+# Identical chat requests that arrive while the first is still running (retries,
+# double submits) share that run instead of starting another one
+chat_flights = SingleFlight()
+
+# Time budget of a chat request: context fetch, model calls and tool calls all share it.
+# The last DEADLINE_ANSWER_RESERVE_SECONDS are kept for the final answer, so tools that
+# would run into them are skipped or cut short. CHAT_DEADLINE_SECONDS=0 turns it off
+CHAT_DEADLINE_SECONDS = float(os.environ.get("CHAT_DEADLINE_SECONDS", 55))
+CHAT_MAX_DEADLINE_SECONDS = float(os.environ.get("CHAT_MAX_DEADLINE_SECONDS", 300))
+DEADLINE_ANSWER_RESERVE_SECONDS = float(os.environ.get("DEADLINE_ANSWER_RESERVE_SECONDS", 10))
+DEADLINE_EXCEEDED_RESPONSE = (
+    "Sorry, I ran out of time before I could finish answering. "
+    "Please try again, or ask a more specific question."
+)
+
+# Helper function: The deadline of a request (the client's, capped, or the default; None = no deadline)
+def get_deadline_seconds(message):
+    seconds = message.deadline_seconds or CHAT_DEADLINE_SECONDS
+    return min(seconds, CHAT_MAX_DEADLINE_SECONDS) if seconds > 0 else None
+
+# Helper function: Run one chat turn (cache lookup, agent run, history and cache updates)
+# With session_id=None the turn is stateless: no history is read or saved (used by batches)
+async def run_chat_turn(agent, session_id, message, fingerprint=None):
+    with deadline_scope(get_deadline_seconds(message), DEADLINE_ANSWER_RESERVE_SECONDS) as deadline:
+        # Repeated question with the same receipts? Answer from the cache
+        cache_key = await get_answer_cache_key(message, fingerprint, session_id)
+        cached_response = await call_store(answer_cache.get, cache_key) if cache_key else None
+        if cached_response is not None:
+            logger.info("Answer cache hit, skipping agent run", extra=LOG_SAMPLE)
+            if tracing is not None and tracing.current_span() is not None:
+                tracing.current_span().set_attribute("answer_cache", "hit")
+            if session_id is not None:
+                await call_store(remember_cached_turn, agent, session_id, message.message, cached_response)
+            return {"response": cached_response, "cached": True}
+    
+        # A plain lookup over the receipts? Answer it without the agent
+        routed = await answer_locally(message)
+        if routed is not None:
+            if session_id is not None:
+                await call_store(remember_cached_turn, agent, session_id, message.message, routed.html)
+            return {"response": routed.html, "routed": routed.intent}
     
-    try:
-        # Get our AI agent
-        agent = await get_or_create_agent()
-        
-        # Log the request
-        print(f"Processing chat request: {message.message}")
-        
         # Process the message with the AI agent
         # We pass message_history so the AI remembers previous conversation
         start_time = time.time()
-        result = await agent.run(message.message, message_history=messages_history)
+        with trace_span("admission.wait"):
+            await admission.acquire(timeout=deadline.remaining() if deadline is not None else None)
+        try:
+            with trace_span("agent.run") as run_span, run_scope() as scope:
+                history = await call_store(get_message_history, session_id) if session_id is not None else None
+                try:
+                    # Stop at the deadline even if the final model call is still going
+                    # On a flash or pro model depending on the question (see model_router.py)
+                    run = (model_router.run(agent, message.message, message_history=history)
+                           if model_router is not None else agent.run(message.message, message_history=history))
+                    result = await asyncio.wait_for(run, deadline.remaining() if deadline is not None else None)
+                except asyncio.TimeoutError:
+                    if scope is not None:
+                        scope.cancel()
+                    deadline.record("deadline_exceeded")
+                    if run_span is not None:
+                        run_span.set_attribute("deadline_exceeded", True)
+                    logger.warning("Agent run stopped at its %.0fs deadline", deadline.seconds)
+                    return {"response": DEADLINE_EXCEEDED_RESPONSE, "partial": True}
+        except asyncio.CancelledError:
+            logger.info("Agent run cancelled after %.2f seconds", time.time() - start_time)
+            record_cancelled_run()
+            raise
+        finally:
+            admission.release(time.time() - start_time)
         processing_time = time.time() - start_time
-        print(f"Agent processed message in {processing_time:.2f} seconds")
-        
-        # Safely save conversation history - handle case if all_messages() doesn't exist
+        logger.info("Agent processed message in %.2f seconds", processing_time)
+    
+        # Safely save conversation history - handle case if new_messages() doesn't exist
+        if session_id is not None:
+            await call_store(save_message_history, session_id, result)
+    
+        with trace_span("postprocess"):
+            response_text = clean_response_text(extract_response_text(result))
+        if deadline is not None and deadline.partial:
+            # Some tools were skipped or cut short: flag it, and don't cache the answer
+            logger.info("Answered with partial information: %s", deadline.events)
+            return {"response": response_text, "partial": True}
+        if cache_key and isinstance(response_text, str) and response_text:
+            await call_store(answer_cache.put, cache_key, response_text)
+    
+        return {"response": response_text}
+
+# Helper function: Record the total time and outcome of a chat request for /metrics
+def record_request(endpoint, start_time, outcome):
+    if metrics is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start_time, endpoint=endpoint)
+        metrics.REQUESTS_TOTAL.inc(endpoint=endpoint, outcome=outcome)
+
+def record_cancelled_run():
+    if metrics is not None:
+        metrics.AGENT_RUNS_CANCELLED_TOTAL.inc()
+
+# Stop working on a request once its client has gone away (closed tab, frontend timeout)
+# Set CANCEL_ON_DISCONNECT=false to always finish the run (the answer still gets cached)
+CANCEL_ON_DISCONNECT = os.environ.get("CANCEL_ON_DISCONNECT", "true").lower() not in ("0", "false", "no")
+
+class ClientDisconnected(Exception):
+    """The client went away before its response was ready."""
+
+# Helper function: Wait for the ASGI disconnect message (the request body has already been read)
+async def wait_for_disconnect(request):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+# Helper function: Await the work, but cancel it and raise ClientDisconnected if the client leaves first
+async def cancel_on_disconnect(request, work):
+    if not CANCEL_ON_DISCONNECT:
+        return await work
+    work_task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work_task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not work_task.done():
+            # Also reached when this handler itself is cancelled
+            work_task.cancel()
+            try:
+                await work_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            raise ClientDisconnected()
+    return work_task.result()
+
+# Helper function: Response for a client that is no longer listening (nginx's 499)
+def client_disconnected_response():
+    return JSONResponse(status_code=499, content={"detail": "Client closed request"})
+
+# ENDPOINT 4: Process chat messages
+# This is the main endpoint that handles user messages
+@app.post("/api/chat")
+async def chat(message: ChatMessage, request: Request, http_response: Response):
+    session_id = get_session_id(message.session_id, request)
+    request_start = time.perf_counter()
+    outcome = "error"
+    
+    with start_request_trace("chat", request, session_id=session_id) as root_span:
+        if root_span is not None:
+            # Lets whoever reports a slow answer point us at its trace
+            http_response.headers["X-Trace-ID"] = root_span.trace_id
         try:
-            if hasattr(result, 'all_messages') and callable(result.all_messages):
-                messages_history.extend(result.all_messages())
-                #todo remove if needed. Limit history size to prevent token accumulation
-                limit_message_history()
-        except Exception as history_error:
-            print(f"Warning: Could not save message history: {history_error}")
-        
-        # Get the response content from the result
-        # The AgentRunResult object from pydantic-ai has the response in data
-        response_text = ""
-        
-        # Check the structure of the result to determine how to extract the response
-        if hasattr(result, 'data'):
-            response_text = result.data
-        elif hasattr(result, 'text'):
-            response_text = result.text
-        elif hasattr(result, 'content'):
-            response_text = result.content
-        elif hasattr(result, 'response'):
-            response_text = result.response
-        else:
-            # Fallback to string representation
-            print(f"Couldn't extract text directly. Result object: {result}")
-            response_text = str(result)
-        
-        # Clean up the response to remove any markdown code fences
-        if isinstance(response_text, str):
-            # Remove markdown code fences if present
-            if response_text.startswith("```html"):
-                response_text = response_text.replace("```html", "", 1)
-                if response_text.endswith("```"):
-                    response_text = response_text[:-3]
-            
-            # Remove any other code fence markers
-            response_text = response_text.replace("```", "")
+            # Get our AI agent
+            agent = await get_or_create_agent()
             
-            # Check if there's tool command at the beginning
-            has_leading_tool_code = False
-            tool_command_patterns = [
-                r'^tool_code',
-                r'^sequential_thinking\.think',
-                r'^sequential_thinking\.run',
-                r'^memory_tool\.',
-                r'^brave_search\.search_and_summarize',
-                r'^print\(brave_search\.',
-                r'^brave_search\.',
-                r'^google_maps\.',
-                r'^yfinance\.'
-            ]
+            # Log the request
+            logger.info("Processing chat request (session %s): %s", session_id, truncate(message.message))
+            logger.debug("Full chat message: %s", message.message)
             
-            for pattern in tool_command_patterns:
-                if re.search(pattern, response_text.strip(), re.DOTALL):
-                    has_leading_tool_code = True
-                    break
+            # Same session sending the same message again while it's still running? Share that run
+            flight_key = "\x1f".join([session_id, message.user_id or "", message.message.strip()])
+            response = await cancel_on_disconnect(
+                request, chat_flights.do(flight_key, lambda: run_chat_turn(agent, session_id, message)))
+            outcome = ("cached" if response.get("cached") else "routed" if response.get("routed")
+                       else "partial" if response.get("partial") else "ok")
             
-            # If there's tool code and no HTML response yet, try to extract an actual answer
-            if has_leading_tool_code and not response_text.strip().endswith(">"):
-                print("Tool command detected, extracting answer and preserving thinking")
-                
-                # Try to extract the result from sequential thinking
-                thinking_result_match = re.search(r'"result":\s*"(.+?)"', response_text, re.DOTALL)
-                
-                # Format this nicely to have both thinking and content
-                if thinking_result_match:
-                    # Extract the actual content from the sequential thinking result
-                    extracted_content = thinking_result_match.group(1)
-                    extracted_content = extracted_content.replace('\\n', '\n').replace('\\"', '"')
-                    
-                    # Create a clear HTML response with the extracted content
-                    html_response = f'<div class="p-4 bg-gray-50 rounded-lg"><p class="text-lg">{extracted_content}</p></div>'
-                    
-                    # Return both thinking and content - frontend will handle the UI
-                    response_text = response_text + "\n\n" + html_response
-                else:
-                    # Try to find any human-readable text after the tool commands
-                    normal_text_match = re.search(r'\)\s*\n+([\s\S]+)', response_text)
-                    if normal_text_match:
-                        text_content = normal_text_match.group(1).strip()
-                        html_response = f'<div class="p-4 bg-gray-50 rounded-lg"><p class="text-lg">{text_content}</p></div>'
-                        response_text = response_text + "\n\n" + html_response
-                    else:
-                        # If we can't extract anything useful, add a generic response
-                        html_response = '<div class="p-4 bg-gray-50 rounded-lg"><p class="text-lg">I\'ve analyzed your question. Please check my thought process for details.</p></div>'
-                        response_text = response_text + "\n\n" + html_response
-                
-                # Clean up any Python escaping
-                response_text = re.sub(r'\\n', '\n', response_text)
-                response_text = re.sub(r'\\"', '"', response_text)
-            
-            # Trim whitespace
-            response_text = response_text.strip()
-            
-            # Log the final response length
-            print(f"Final response length: {len(response_text)} characters")
-        
-        # Return the AI's response to the frontend
-        return {"response": response_text}
-    except Exception as e:
-        import traceback
-        error_msg = f"Error: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)  # Log the error for debugging
-        return {"response": f"Sorry, an error occurred: {str(e)}"}
+            # Return the AI's response to the frontend
+            return dict(response)
+        except AdmissionRejected as rejection:
+            outcome = "rejected"
+            logger.warning("Chat request rejected (%d): %s", rejection.status_code, rejection.reason)
+            return admission_rejected_response(rejection)
+        except ClientDisconnected:
+            outcome = "cancelled"
+            logger.info("Client disconnected, chat request (session %s) cancelled", session_id)
+            return client_disconnected_response()
+        except Exception as e:
+            logger.exception("Error processing chat request: %s", e)
+            return {"response": f"Sorry, an error occurred: {str(e)}"}
+        finally:
+            if root_span is not None:
+                root_span.set_attribute("outcome", outcome)
+            record_request("chat", request_start, outcome)
+
+# Batch settings: how many questions run at once, and how many one batch may contain
+CHAT_BATCH_PARALLELISM = int(os.environ.get("CHAT_BATCH_PARALLELISM", 4))
+CHAT_BATCH_MAX_ITEMS = int(os.environ.get("CHAT_BATCH_MAX_ITEMS", 50))
+
+class BatchChatRequest(BaseModel):
+    messages: List[str]  # The questions to answer
+    user_id: Optional[str] = None
+    no_cache: bool = False
+    max_parallel: Optional[int] = None  # Lower the parallelism for this batch (capped by CHAT_BATCH_PARALLELISM)
+
+# ENDPOINT 4c: Answer a list of questions concurrently
+# Each question is a separate, stateless turn (no shared conversation history), results
+# come back in the same order with their own timings and errors
+@app.post("/api/chat/batch")
+async def chat_batch(batch: BatchChatRequest, request: Request, http_response: Response):
+    if len(batch.messages) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {CHAT_BATCH_MAX_ITEMS} messages")
+    
+    with start_request_trace("chat_batch", request, size=len(batch.messages)) as root_span:
+        if root_span is not None:
+            http_response.headers["X-Trace-ID"] = root_span.trace_id
+        request_start = time.perf_counter()
+        try:
+            return await cancel_on_disconnect(request, run_chat_batch(batch))
+        except ClientDisconnected:
+            logger.info("Client disconnected, chat batch cancelled")
+            record_request("chat_batch", request_start, "cancelled")
+            return client_disconnected_response()
+
+# Helper function: Answer every question of a batch, at most max_parallel at a time
+async def run_chat_batch(batch):
+    start_time = time.time()
+    request_start = time.perf_counter()
+    agent = await get_or_create_agent()
+    max_parallel = max(1, min(batch.max_parallel or CHAT_BATCH_PARALLELISM, CHAT_BATCH_PARALLELISM))
+    logger.info("Processing chat batch of %d messages, %d at a time", len(batch.messages), max_parallel)
+    
+    # Fetch the receipt context once up front: every run's system prompt then reads the
+    # cached copy instead of all of them hitting Firestore together, and the fingerprint
+    # is shared by every answer cache key
+    fingerprint = None
+    if get_receipt_fingerprint is not None:
+        try:
+            with trace_span("receipt_fingerprint"):
+                fingerprint = await asyncio.to_thread(get_receipt_fingerprint)
+        except Exception as fingerprint_error:
+            logger.warning("Could not fetch receipt context for batch: %s", fingerprint_error)
+    
+    semaphore = asyncio.Semaphore(max_parallel)
+    
+    async def run_item(index, text):
+        async with semaphore:
+            item_start = time.time()
+            item = {"index": index, "message": text}
+            try:
+                message = ChatMessage(message=text, user_id=batch.user_id, no_cache=batch.no_cache)
+                with trace_span("chat_batch.item", index=index):
+                    item.update(await run_chat_turn(agent, None, message, fingerprint))
+            except AdmissionRejected as rejection:
+                item.update(error=rejection.reason, status=rejection.status_code, retry_after=rejection.retry_after)
+            except Exception as e:
+                logger.exception("Error in batch item %d: %s", index, e)
+                item["error"] = str(e)
+            item["processing_time"] = round(time.time() - item_start, 2)
+            return item
+    
+    results = await asyncio.gather(*(run_item(i, text) for i, text in enumerate(batch.messages)))
+    total_time = time.time() - start_time
+    logger.info("Chat batch of %d messages finished in %.2f seconds", len(results), total_time)
+    record_request("chat_batch", request_start, "ok")
+    return {
+        "results": results,
+        "succeeded": sum(1 for item in results if "error" not in item),
+        "failed": sum(1 for item in results if "error" in item),
+        "max_parallel": max_parallel,
+        "total_time": round(total_time, 2),
+    }
+
+# Helper function: Format one server-sent event
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# ENDPOINT 4b: Stream chat messages
+# Same as /api/chat, but pushes text deltas and tool progress as server-sent events
+# instead of waiting for the whole agent turn to finish
+@app.post("/api/chat/stream")
+async def chat_stream(message: ChatMessage, request: Request):
+    session_id = get_session_id(message.session_id, request)
+    request_start = time.perf_counter()
+
+    # Over capacity? Say so before the stream starts, so the client gets a real 429
+    try:
+        admission.raise_if_full()
+    except AdmissionRejected as rejection:
+        logger.warning("Streaming chat request rejected (%d): %s", rejection.status_code, rejection.reason)
+        record_request("chat_stream", request_start, "rejected")
+        return admission_rejected_response(rejection)
+
+    async def event_stream():
+        outcome = "error"
+        # Tools share the request's deadline like in /api/chat; the stream itself isn't
+        # cut off, the client sees progress and can give up by disconnecting
+        with deadline_scope(get_deadline_seconds(message), DEADLINE_ANSWER_RESERVE_SECONDS) as deadline:
+            try:
+                agent = await get_or_create_agent()
+                logger.info("Processing streaming chat request (session %s): %s", session_id, truncate(message.message))
+                logger.debug("Full chat message: %s", message.message)
+
+                cache_key = await get_answer_cache_key(message, session_id=session_id)
+                cached_response = await call_store(answer_cache.get, cache_key) if cache_key else None
+                if cached_response is not None:
+                    logger.info("Answer cache hit, skipping agent run", extra=LOG_SAMPLE)
+                    await call_store(remember_cached_turn, agent, session_id, message.message, cached_response)
+                    yield sse_event("delta", {"text": cached_response})
+                    yield sse_event("done", {"response": cached_response, "cached": True, "processing_time": 0})
+                    outcome = "cached"
+                    return
+
+                routed = await answer_locally(message)
+                if routed is not None:
+                    await call_store(remember_cached_turn, agent, session_id, message.message, routed.html)
+                    yield sse_event("delta", {"text": routed.html})
+                    yield sse_event("done", {"response": routed.html, "routed": routed.intent, "processing_time": 0})
+                    outcome = "routed"
+                    return
+
+                # Wait for an agent slot (a queue timeout becomes an error event below)
+                with trace_span("admission.wait"):
+                    await admission.acquire(timeout=deadline.remaining() if deadline is not None else None)
+                start_time = time.time()
+                try:
+                    first_token_time = None
+                    cleaner = StreamProcessor()
+
+                    # Starlette cancels this generator when the client disconnects; the
+                    # scope makes sure the tool calls of the run are cancelled with it
+                    # Routed to a flash or pro model, but never escalated: the text is already sent
+                    route = model_router.route(message.message) if model_router is not None else None
+                    model = model_router.model(route.tier) if route is not None else None
+                    history = await call_store(get_message_history, session_id)
+                    with run_scope():
+                        async with agent.iter(message.message, message_history=history, model=model) as run:
+                            async for node in run:
+                                if Agent.is_model_request_node(node):
+                                    # Stream the model's text as it is generated
+                                    async with node.stream(run.ctx) as request_stream:
+                                        async for event in request_stream:
+                                            chunk = ""
+                                            if isinstance(event, PartStartEvent) and isinstance(event.part, TextPart):
+                                                chunk = event.part.content
+                                            elif isinstance(event, PartDeltaEvent) and isinstance(event.delta, TextPartDelta):
+                                                chunk = event.delta.content_delta
+                                            text = cleaner.feed(chunk) if chunk else ""
+                                            if text:
+                                                if first_token_time is None:
+                                                    first_token_time = time.time() - start_time
+                                                    logger.info("First token streamed after %.2f seconds", first_token_time, extra=LOG_SAMPLE)
+                                                yield sse_event("thinking" if cleaner.thinking else "delta", {"text": text})
+                                elif Agent.is_call_tools_node(node):
+                                    # Let the frontend know which tools are running
+                                    async with node.stream(run.ctx) as tools_stream:
+                                        async for event in tools_stream:
+                                            if isinstance(event, FunctionToolCallEvent):
+                                                yield sse_event("tool_call", {
+                                                    "tool": event.part.tool_name,
+                                                    "tool_call_id": event.call_id,
+                                                    "args": event.part.args_as_dict(),
+                                                })
+                                            elif isinstance(event, FunctionToolResultEvent):
+                                                yield sse_event("tool_result", {
+                                                    "tool": event.result.tool_name,
+                                                    "tool_call_id": event.tool_call_id,
+                                                    "status": "error" if isinstance(event.result, RetryPromptPart) else "ok",
+                                                })
+
+                            text = cleaner.finish()
+                            if text:
+                                yield sse_event("thinking" if cleaner.thinking else "delta", {"text": text})
+
+                            result = run.result
+
+                    processing_time = time.time() - start_time
+                    logger.info("Agent streamed message in %.2f seconds", processing_time)
+                    if route is not None:
+                        model_router.record(route.tier, processing_time, result)
+                finally:
+                    admission.release(time.time() - start_time)
+
+                await call_store(save_message_history, session_id, result)
+
+                # The final event carries the fully cleaned response (including any answer
+                # extracted from tool code), so the frontend can replace the streamed text with it
+                response_text = clean_response_text(extract_response_text(result))
+                if cache_key and isinstance(response_text, str) and response_text and not (deadline and deadline.partial):
+                    await call_store(answer_cache.put, cache_key, response_text)
+                done = {"response": response_text, "processing_time": round(processing_time, 2)}
+                if deadline is not None and deadline.partial:
+                    done["partial"] = True
+                yield sse_event("done", done)
+                outcome = "ok"
+            except AdmissionRejected as rejection:
+                outcome = "rejected"
+                logger.warning("Streaming chat request rejected (%d): %s", rejection.status_code, rejection.reason)
+                yield sse_event("error", {
+                    "response": f"Sorry, {rejection.reason.lower()}.",
+                    "status": rejection.status_code,
+                    "retry_after": rejection.retry_after,
+                })
+            except (asyncio.CancelledError, GeneratorExit):
+                outcome = "cancelled"
+                logger.info("Client disconnected, streaming chat request (session %s) cancelled", session_id)
+                record_cancelled_run()
+                raise
+            except Exception as e:
+                logger.exception("Error streaming chat response: %s", e)
+                yield sse_event("error", {"response": f"Sorry, an error occurred: {str(e)}"})
+            finally:
+                record_request("chat_stream", request_start, outcome)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # ENDPOINT: Reset conversation
 # This lets the frontend reset the conversation if needed
+class ResetRequest(BaseModel):
+    session_id: Optional[str] = None
+
 @app.post("/api/reset")
-async def reset_conversation():
-    global messages_history
-    
+async def reset_conversation(request: Request, reset: Optional[ResetRequest] = None):
     try:
-        old_length = len(messages_history)
-        messages_history = []
+        session_id = get_session_id(reset.session_id if reset else None, request)
+        old_length = await call_store(conversation_store.reset, session_id)
         return {
             "status": "success", 
             "message": f"Conversation reset. Cleared {old_length} messages from history."
@@ -301,6 +1004,95 @@ async def reset_conversation():
     except Exception as e:
         return {"status": "error", "message": f"Failed to reset conversation: {str(e)}"}
 
+# ENDPOINT: Answer cache hit/miss stats (and the Gemini context cache for the prompt prefix,
+# and the MCP tool result cache)
+@app.get("/api/cache/stats")
+async def cache_stats():
+    prompt_cache = context_cache.stats() if context_cache is not None else {"enabled": False}
+    tool_results = tool_cache.stats() if tool_cache is not None else {"enabled": False}
+    if answer_cache is None:
+        return {"enabled": False, "in_flight": chat_flights.stats(), "prompt_cache": prompt_cache,
+                "tool_cache": tool_results}
+    return {"enabled": True, **await call_store(answer_cache.stats), "in_flight": chat_flights.stats(), "prompt_cache": prompt_cache,
+            "tool_cache": tool_results}
+
+# ENDPOINT: Agent concurrency, queue depth and queue wait times
+@app.get("/api/admission/stats")
+async def admission_stats():
+    return admission.stats()
+
+# ENDPOINT: Model tiers: turns routed to flash and pro, escalations, latency and cost per model
+@app.get("/api/models/stats")
+async def model_stats():
+    if model_router is None:
+        return {"enabled": False}
+    return model_router.stats()
+
+# Copy the stats the services keep themselves into gauges, each time /metrics is scraped
+if metrics is not None:
+    admission_gauge = metrics.gauge("finpal_admission", "Agent admission control state", ["stat"])
+    answer_cache_gauge = metrics.gauge("finpal_answer_cache", "Answer cache counters and size", ["stat"])
+    in_flight_gauge = metrics.gauge("finpal_single_flight", "Coalesced chat requests", ["stat"])
+    history_gauge = metrics.gauge("finpal_history", "Conversation history memory use", ["stat"])
+    prompt_cache_gauge = metrics.gauge("finpal_prompt_cache", "Gemini context cache state", ["stat"])
+    tool_selection_gauge = metrics.gauge("finpal_tool_selection", "Per-query tool selection savings", ["stat"])
+    tool_dispatch_gauge = metrics.gauge("finpal_tool_dispatch", "MCP tool calls in flight per server", ["server", "stat"])
+    tool_output_gauge = metrics.gauge("finpal_tool_output", "MCP tool output bytes before and after shaping", ["stat"])
+    model_gauge = metrics.gauge("finpal_model", "Agent runs, latency, tokens and cost per model", ["model", "stat"])
+    tool_cache_gauge = metrics.gauge("finpal_tool_cache", "MCP tool result cache counters and size", ["stat"])
+
+    def collect_service_stats():
+        for name, value in admission.stats().items():
+            admission_gauge.set(value, stat=name)
+        if answer_cache is not None:
+            for name, value in answer_cache.stats().items():
+                if isinstance(value, (int, float)):
+                    answer_cache_gauge.set(value, stat=name)
+        for name, value in chat_flights.stats().items():
+            in_flight_gauge.set(value, stat=name)
+        for name, value in conversation_store.stats().items():
+            if isinstance(value, (int, float)):
+                history_gauge.set(value, stat=name)
+        if context_cache is not None:
+            for name, value in context_cache.stats().items():
+                if isinstance(value, (int, float)):
+                    prompt_cache_gauge.set(value, stat=name)
+        if tool_selector is not None:
+            for name, value in tool_selector.stats().items():
+                if isinstance(value, (int, float)):
+                    tool_selection_gauge.set(value, stat=name)
+        if global_mcp_client is not None:
+            for server, server_stats in global_mcp_client.dispatch_stats()["servers"].items():
+                for name, value in server_stats.items():
+                    tool_dispatch_gauge.set(value, server=server, stat=name)
+        if tool_cache is not None:
+            for name, value in tool_cache.stats().items():
+                tool_cache_gauge.set(value, stat=name)
+        if output_stats is not None:
+            for name, value in output_stats.stats().items():
+                if isinstance(value, (int, float)):
+                    tool_output_gauge.set(value, stat=name)
+        if model_router is not None:
+            for model, model_stats in model_router.stats()["models"].items():
+                for name, value in model_stats.items():
+                    if isinstance(value, (int, float)):
+                        model_gauge.set(value, model=model, stat=name)
+
+    metrics.REGISTRY.add_collector(collect_service_stats)
+
+# ENDPOINT: Prometheus metrics (per-stage latency histograms and service counters)
+@app.get("/metrics")
+async def prometheus_metrics():
+    if metrics is None:
+        return PlainTextResponse("")
+    # Rendering collects the store stats, which may wait on SQLite
+    return PlainTextResponse(await call_store(metrics.REGISTRY.render), media_type=metrics.CONTENT_TYPE)
+
+# ENDPOINT: Conversation history memory use
+@app.get("/api/history/stats")
+async def history_stats():
+    return await call_store(conversation_store.stats)
+
 # #todo comment extra (dont remove) function Define request model for direct chat
 # class DirectChatMessage(BaseModel):
 #     message: str
@@ -380,13 +1172,4 @@ async def reset_conversation():
 #         logger.error(f"Error in direct chat: {str(e)}")
 #         return {"response": f"Sorry, an error occurred: {str(e)}"}
 
-# Cleanup handler for when the server shuts down
-@app.on_event("shutdown")
-async def shutdown_event():
-    global global_mcp_client
-    if global_mcp_client is not None:
-        try:
-            await global_mcp_client.cleanup()
-            print("MCP client resources cleaned up")
-        except Exception as e:
-            print(f"Error cleaning up MCP client: {e}") 
\ No newline at end of file
+# Cleanup of the MCP servers on shutdown happens in lifespan() at the top of this file
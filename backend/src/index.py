@@ -50,6 +50,13 @@ print(f"📂 Parent directory: {parent_dir}")
 print(f"🔄 Python path: {sys.path}")
 print(f"{'='*60}\n")
 
+# Number of uvicorn worker processes. Each worker builds its own agent and MCP servers,
+# so conversation history and cached answers must live in the shared SQLite store
+WORKERS = int(os.environ.get("WORKERS", os.environ.get("WEB_CONCURRENCY", 1)))
+if WORKERS > 1 and os.environ.get("STATE_BACKEND", "memory").lower() == "memory":
+    os.environ["STATE_BACKEND"] = "sqlite"
+    print("🗄️ Multiple workers: keeping conversation state in SQLite (STATE_BACKEND=sqlite)")
+
 # import the api module - try both ways
 try:
     import api
@@ -71,7 +78,12 @@ if __name__ == "__main__":
     app_module = "src.api:app" if "src.api" in sys.modules else "api:app"
     print(f"Using app module: {app_module}")
     
-    uvicorn.run(app_module, host="0.0.0.0", port=PORT, reload=True)
+    if WORKERS > 1:
+        # reload only works with a single process
+        print(f"Starting {WORKERS} workers")
+        uvicorn.run(app_module, host="0.0.0.0", port=PORT, workers=WORKERS)
+    else:
+        uvicorn.run(app_module, host="0.0.0.0", port=PORT, reload=True)
 # NOTE: The old MCP command-line interface is still available:
 # To run it: python -m services.pydantic_mcp_agent
 
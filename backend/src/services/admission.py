@@ -0,0 +1,120 @@
+"""
+Admission Control for LLM-Bound Endpoints
+
+Limits how many agent runs happen at once. Requests over capacity wait in a bounded
+queue; when the queue is full, or a request waited too long, it is rejected right
+away with a Retry-After hint instead of piling onto Gemini's rate limits.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from src.services.metrics import ADMISSION_WAIT_SECONDS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't get an agent slot. Maps to an HTTP 429/503."""
+
+    def __init__(self, reason: str, status_code: int, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency limiter with a bounded wait queue."""
+
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 32, queue_timeout: float = 30.0) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._avg_run_seconds = 10.0  # moving average, used for Retry-After
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free (rough: queue length times average run time)."""
+        waves = (self.queued + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(waves * self._avg_run_seconds))
+
+    def raise_if_full(self) -> None:
+        """Reject right away if there is no slot and no room in the queue."""
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self.rejected_queue_full += 1
+            logger.warning(f"Admission queue full ({self.queued} waiting), rejecting request")
+            raise AdmissionRejected("Server is busy, please retry shortly", 429, self.retry_after())
+
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        """Take an agent slot, waiting at most queue_timeout (or ``timeout``, if shorter)."""
+        if not self._semaphore.locked():
+            # Free slot: take it now (doesn't yield, so nobody can grab it first)
+            await self._semaphore.acquire()
+            self._admit(0.0)
+            return
+        self.raise_if_full()
+        start = time.monotonic()
+        wait_limit = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=wait_limit)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            logger.warning(f"Request waited {wait_limit:.1f}s for an agent slot, rejecting")
+            raise AdmissionRejected("Timed out waiting for capacity, please retry", 503, self.retry_after())
+        finally:
+            self.queued -= 1
+        self._admit(time.monotonic() - start)
+
+    def _admit(self, waited: float) -> None:
+        ADMISSION_WAIT_SECONDS.observe(waited)
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.admitted += 1
+        self.active += 1
+
+    def release(self, run_seconds: float = 0.0) -> None:
+        self.active -= 1
+        if run_seconds:
+            self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * run_seconds
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold an agent slot for the duration of the block."""
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait_ms": round(1000 * self.total_wait_seconds / self.admitted, 2) if self.admitted else 0.0,
+            "max_wait_ms": round(1000 * self.max_wait_seconds, 2),
+        }
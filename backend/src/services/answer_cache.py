@@ -0,0 +1,140 @@
+"""
+Answer Cache for Chat Requests
+
+Remembers the final answer to a question so asking it again returns right away
+instead of paying for another multi-tool Gemini run. Entries are keyed on the
+normalized question, the user, and a fingerprint of the receipt context the model
+sees, so a new receipt gives a new key. Eviction is TTL plus LRU.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace ("What did I spend?" == "what did i spend")."""
+    question = _PUNCTUATION_RE.sub(" ", question.lower())
+    return _WHITESPACE_RE.sub(" ", question).strip()
+
+
+def make_cache_key(question: str, user_id: str, receipt_fingerprint: str) -> str:
+    """Cache key for a question asked by a user against a given receipt context."""
+    raw = "\x1f".join([normalize_question(question), user_id, receipt_fingerprint])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Bounded TTL + LRU cache of chat answers with hit/miss stats."""
+
+    def __init__(self, max_entries: int = 500, ttl_seconds: float = 600) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached answer, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, answer = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return answer
+
+    def put(self, key: str, answer: Any) -> None:
+        """Store an answer, evicting the least recently used entries if full."""
+        self._entries[key] = (time.time() + self.ttl_seconds, answer)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SharedAnswerCache:
+    """AnswerCache kept in a StateStore (see state_store.py), so every worker sees the same answers.
+
+    Hit/miss counters are per worker. Eviction runs every ``evict_every`` puts, so the
+    store can hold up to that many entries over ``max_entries`` in between.
+    """
+
+    NAMESPACE = "answers"
+
+    def __init__(self, store: Any, max_entries: int = 500, ttl_seconds: float = 600, evict_every: int = 50) -> None:
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = max(1, evict_every)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached answer, or None if missing or expired."""
+        raw = self.store.get(self.NAMESPACE, key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def put(self, key: str, answer: Any) -> None:
+        """Store an answer, evicting the least recently used entries every ``evict_every`` puts."""
+        self.store.set(self.NAMESPACE, key, json.dumps(answer).encode("utf-8"), ttl=self.ttl_seconds)
+        self._puts += 1
+        if self._puts >= self.evict_every:
+            self._puts = 0
+            self.evictions += self.store.evict(self.NAMESPACE, max_items=self.max_entries)
+
+    def clear(self) -> None:
+        self.store.clear(self.NAMESPACE)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.store.backend,
+            "entries": self.store.count(self.NAMESPACE),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
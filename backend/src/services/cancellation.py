@@ -0,0 +1,79 @@
+"""
+Cancelling Abandoned Agent Runs
+
+When a client disconnects, the request's agent run is cancelled. pydantic-ai runs each
+tool call in its own task and waits on them with asyncio.wait, which does not cancel
+them when the run itself is cancelled, so in-flight MCP calls would keep going.
+A RunScope fixes that: tool calls register their task with the scope of the run that
+started them (found through a contextvar, which the tool tasks inherit), and leaving
+the scope because of a cancellation cancels whatever is still registered.
+"""
+
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Set
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class RunScope:
+    """The tool call tasks started by one agent run."""
+
+    def __init__(self) -> None:
+        self.tasks: Set[asyncio.Task] = set()
+        self.cancelled = False
+
+    def cancel(self) -> int:
+        """Cancel every tool call still running. Returns how many were cancelled."""
+        self.cancelled = True
+        pending = [task for task in self.tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.info(f"Cancelled {len(pending)} in-flight tool calls")
+        return len(pending)
+
+
+_current_scope: ContextVar[Optional[RunScope]] = ContextVar("finpal_run_scope", default=None)
+
+
+def current_scope() -> Optional[RunScope]:
+    return _current_scope.get()
+
+
+@contextmanager
+def run_scope() -> Iterator[RunScope]:
+    """Wrap an agent run: if it is cancelled (or closed mid-stream), its tool calls are cancelled too."""
+    scope = RunScope()
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    except (asyncio.CancelledError, GeneratorExit):
+        scope.cancel()
+        raise
+    finally:
+        try:
+            _current_scope.reset(token)
+        except ValueError:
+            # Closed from another context (an async generator finalized elsewhere)
+            _current_scope.set(None)
+
+
+@contextmanager
+def track_current_task() -> Iterator[None]:
+    """Register the running task (a tool call) with the current run's scope, if any."""
+    scope = _current_scope.get()
+    task = asyncio.current_task()
+    if scope is None or task is None:
+        yield
+        return
+    if scope.cancelled:
+        raise asyncio.CancelledError()
+    scope.tasks.add(task)
+    try:
+        yield
+    finally:
+        scope.tasks.discard(task)
@@ -0,0 +1,302 @@
+"""
+Conversation Store for Chat Sessions
+
+Keeps the message history of each chat session separately, so users don't share
+(or corrupt) each other's context. Sessions are evicted least-recently-used first,
+and both a per-session and a global memory cap are enforced.
+
+ConversationStore keeps the messages in this process. SharedConversationStore keeps
+them serialized in a StateStore (see state_store.py) so several workers can serve the
+same session.
+"""
+
+import dataclasses
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+try:
+    from pydantic_ai.messages import ModelMessagesTypeAdapter
+except ImportError:
+    ModelMessagesTypeAdapter = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_ID = "default"
+
+
+def estimate_message_bytes(message: Any) -> int:
+    """Rough size of one message in bytes (its JSON form when pydantic-ai is available)."""
+    if ModelMessagesTypeAdapter is not None:
+        try:
+            return len(ModelMessagesTypeAdapter.dump_json([message]))
+        except Exception:
+            pass
+    return len(str(message).encode("utf-8"))
+
+
+def is_turn_start(message: Any) -> bool:
+    """True if the message is a request that carries a user prompt (the start of a turn)."""
+    if getattr(message, "kind", None) != "request":
+        return False
+    return any(getattr(part, "part_kind", None) == "user-prompt" for part in message.parts)
+
+
+def carry_system_prompt(dropped: List[Any], kept: List[Any]) -> List[Any]:
+    """Move the system prompt parts of dropped messages onto the first kept message.
+
+    pydantic-ai only adds the (dynamic) system prompt when the history is empty,
+    otherwise it re-evaluates the one already in the history - so it must survive trimming.
+    """
+    system_parts = [
+        part for message in dropped if getattr(message, "kind", None) == "request"
+        for part in message.parts if getattr(part, "part_kind", None) == "system-prompt"
+    ]
+    if not system_parts or not kept or getattr(kept[0], "kind", None) != "request":
+        return kept
+    first = dataclasses.replace(kept[0], parts=system_parts + list(kept[0].parts))
+    return [first] + kept[1:]
+
+
+class _Session:
+    """History of one chat session, with the size of each message cached."""
+
+    def __init__(self) -> None:
+        self.messages: List[Any] = []
+        self.sizes: List[int] = []
+        self.total_bytes = 0
+
+    def drop_oldest(self, count: int) -> None:
+        kept = carry_system_prompt(self.messages[:count], self.messages[count:])
+        self.set_messages(kept)
+
+    def set_messages(self, messages: List[Any]) -> None:
+        self.messages = list(messages)
+        self.sizes = [estimate_message_bytes(message) for message in self.messages]
+        self.total_bytes = sum(self.sizes)
+
+
+def count_to_trim(session: _Session, max_messages: int, max_bytes: int) -> int:
+    """How many of the oldest messages to drop so the session fits its caps.
+
+    Never cuts in the middle of a turn (e.g. keeping a tool return whose tool call
+    was dropped): moves forward to the next user prompt instead.
+    """
+    drop = 0
+    remaining_bytes = session.total_bytes
+    while drop < len(session.messages) and (
+        len(session.messages) - drop > max_messages or remaining_bytes > max_bytes
+    ):
+        remaining_bytes -= session.sizes[drop]
+        drop += 1
+
+    if drop and any(is_turn_start(message) for message in session.messages):
+        while drop < len(session.messages) and not is_turn_start(session.messages[drop]):
+            drop += 1
+    return drop
+
+
+class ConversationStore:
+    """Session-keyed message history with LRU eviction and memory caps.
+
+    Only the new messages of each turn are appended (``result.new_messages()``),
+    so a session grows by one turn per turn instead of re-adding its whole history.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_session_messages: int = 40,
+        max_session_bytes: int = 256 * 1024,
+        max_total_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.max_sessions = max_sessions
+        self.max_session_messages = max_session_messages
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._total_bytes = 0
+        self.evicted_sessions = 0
+
+    def get(self, session_id: str) -> List[Any]:
+        """Return a copy of the session's history and mark it as recently used."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return []
+        self._sessions.move_to_end(session_id)
+        return list(session.messages)
+
+    def append(self, session_id: str, new_messages: List[Any]) -> None:
+        """Add the new messages of a turn to the session, then enforce the caps."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session()
+        self._sessions.move_to_end(session_id)
+
+        for message in new_messages:
+            size = estimate_message_bytes(message)
+            session.messages.append(message)
+            session.sizes.append(size)
+            session.total_bytes += size
+            self._total_bytes += size
+
+        self._trim_session(session_id, session)
+        self._evict()
+
+    def replace(self, session_id: str, messages: List[Any]) -> None:
+        """Swap a session's history for a rewritten one (e.g. after compaction)."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session()
+        self._sessions.move_to_end(session_id)
+        old_bytes = session.total_bytes
+        session.set_messages(messages)
+        self._total_bytes += session.total_bytes - old_bytes
+        self._trim_session(session_id, session)
+        self._evict()
+
+    def reset(self, session_id: str) -> int:
+        """Forget a session's history. Returns how many messages were removed."""
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return 0
+        self._total_bytes -= session.total_bytes
+        return len(session.messages)
+
+    def clear(self) -> int:
+        """Forget every session. Returns how many messages were removed."""
+        removed = sum(len(session.messages) for session in self._sessions.values())
+        self._sessions.clear()
+        self._total_bytes = 0
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Current memory use of the store."""
+        return {
+            "sessions": len(self._sessions),
+            "messages": sum(len(session.messages) for session in self._sessions.values()),
+            "total_bytes": self._total_bytes,
+            "max_total_bytes": self.max_total_bytes,
+            "max_session_bytes": self.max_session_bytes,
+            "max_sessions": self.max_sessions,
+            "evicted_sessions": self.evicted_sessions,
+        }
+
+    def _trim_session(self, session_id: str, session: _Session) -> None:
+        before = len(session.messages)
+
+        # Drop the oldest messages until the session fits its caps
+        drop = count_to_trim(session, self.max_session_messages, self.max_session_bytes)
+        if drop:
+            old_bytes = session.total_bytes
+            session.drop_oldest(drop)
+            self._total_bytes -= old_bytes - session.total_bytes
+            logger.info(f"Trimmed session {session_id} history from {before} to {len(session.messages)} messages")
+
+    def _evict(self) -> None:
+        # Evict least recently used sessions until we are under the global caps
+        while self._sessions and (
+            len(self._sessions) > self.max_sessions or self._total_bytes > self.max_total_bytes
+        ):
+            session_id, session = self._sessions.popitem(last=False)
+            self._total_bytes -= session.total_bytes
+            self.evicted_sessions += 1
+            logger.info(f"Evicted conversation session {session_id} ({session.total_bytes} bytes)")
+
+
+class SharedConversationStore:
+    """ConversationStore with the history kept in a StateStore, for multi-worker deployments.
+
+    Each session is stored as one JSON value. Every call reads it back, so a session can
+    move between workers. Two workers updating the same session at the very same moment
+    can lose one update; the frontend sends one message per session at a time.
+
+    Eviction locks the whole store, so it runs every ``evict_every`` saves rather than on
+    each one: the caps can be overshot by that many sessions in between.
+    """
+
+    NAMESPACE = "conversations"
+
+    def __init__(
+        self,
+        store: Any,
+        max_sessions: int = 1000,
+        max_session_messages: int = 40,
+        max_session_bytes: int = 256 * 1024,
+        max_total_bytes: int = 64 * 1024 * 1024,
+        evict_every: int = 50,
+    ) -> None:
+        if ModelMessagesTypeAdapter is None:
+            raise RuntimeError("pydantic-ai is required to serialize conversation history")
+        self.store = store
+        self.max_sessions = max_sessions
+        self.max_session_messages = max_session_messages
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self.evict_every = max(1, evict_every)
+        self.evicted_sessions = 0  # by this worker
+        self._saves = 0
+
+    def _load(self, session_id: str, touch: bool = True) -> List[Any]:
+        raw = self.store.get(self.NAMESPACE, session_id, touch=touch)
+        if raw is None:
+            return []
+        try:
+            return list(ModelMessagesTypeAdapter.validate_json(raw))
+        except Exception as e:
+            logger.warning(f"Dropping unreadable history for session {session_id}: {e}")
+            self.store.delete(self.NAMESPACE, session_id)
+            return []
+
+    def _save(self, session_id: str, messages: List[Any]) -> None:
+        session = _Session()
+        session.set_messages(messages)
+        drop = count_to_trim(session, self.max_session_messages, self.max_session_bytes)
+        if drop:
+            before = len(session.messages)
+            session.drop_oldest(drop)
+            logger.info(f"Trimmed session {session_id} history from {before} to {len(session.messages)} messages")
+        self.store.set(self.NAMESPACE, session_id, ModelMessagesTypeAdapter.dump_json(session.messages))
+        self._saves += 1
+        if self._saves < self.evict_every:
+            return
+        self._saves = 0
+        evicted = self.store.evict(self.NAMESPACE, max_items=self.max_sessions, max_bytes=self.max_total_bytes)
+        if evicted:
+            self.evicted_sessions += evicted
+            logger.info(f"Evicted {evicted} conversation sessions")
+
+    def get(self, session_id: str) -> List[Any]:
+        """Return the session's history and mark it as recently used."""
+        return self._load(session_id)
+
+    def append(self, session_id: str, new_messages: List[Any]) -> None:
+        """Add the new messages of a turn to the session, then enforce the caps."""
+        self._save(session_id, self._load(session_id, touch=False) + list(new_messages))
+
+    def replace(self, session_id: str, messages: List[Any]) -> None:
+        """Swap a session's history for a rewritten one (e.g. after compaction)."""
+        self._save(session_id, list(messages))
+
+    def reset(self, session_id: str) -> int:
+        """Forget a session's history. Returns how many messages were removed."""
+        removed = len(self._load(session_id, touch=False))
+        self.store.delete(self.NAMESPACE, session_id)
+        return removed
+
+    def clear(self) -> int:
+        """Forget every session. Returns how many sessions were removed."""
+        return self.store.clear(self.NAMESPACE)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current size of the shared store (message counts would mean reading every session)."""
+        return {
+            "backend": self.store.backend,
+            "sessions": self.store.count(self.NAMESPACE),
+            "total_bytes": self.store.total_size(self.NAMESPACE),
+            "max_total_bytes": self.max_total_bytes,
+            "max_session_bytes": self.max_session_bytes,
+            "max_sessions": self.max_sessions,
+            "evicted_sessions": self.evicted_sessions,
+        }
@@ -0,0 +1,98 @@
+"""
+Per-Request Deadline Budgets
+
+Each chat request gets a deadline, kept in a contextvar so the receipt context fetch,
+the LLM calls and the MCP tool calls (all started from the request, some in worker
+threads or tool tasks) can see how much time is left. Tool calls only get the time up
+to the answer reserve, the last part of the budget kept for the final model call;
+once that is reached tools are skipped and the model is told to answer with what it
+already has.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from src.services.metrics import DEADLINE_EVENTS_TOTAL
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ANSWER_NOW_INSTRUCTION = (
+    "Time is almost up for this request. Do not call any more tools: answer now with the "
+    "information you already have, and say briefly if anything could not be checked."
+)
+
+
+class Deadline:
+    """Time budget of one request."""
+
+    def __init__(self, seconds: float, answer_reserve: float = 10.0, min_tool_seconds: float = 1.0) -> None:
+        self.seconds = seconds
+        self.answer_reserve = min(answer_reserve, seconds / 2)
+        self.min_tool_seconds = min_tool_seconds
+        self.expires_at = time.monotonic() + seconds
+        self.events: Dict[str, int] = {}
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: Optional[float] = None, share: float = 1.0) -> float:
+        """Timeout for a stage that may use ``share`` of the time left (at most ``cap``)."""
+        timeout = self.remaining() * share
+        return min(timeout, cap) if cap is not None else timeout
+
+    def tool_budget(self) -> float:
+        """Time tool calls may still use before the answer reserve."""
+        return max(0.0, self.remaining() - self.answer_reserve)
+
+    def allows_tool_call(self) -> bool:
+        return self.tool_budget() >= self.min_tool_seconds
+
+    def record(self, event: str) -> None:
+        """Count something the budget forced (a skipped tool, a forced answer, ...)."""
+        self.events[event] = self.events.get(event, 0) + 1
+        DEADLINE_EVENTS_TOTAL.inc(event=event)
+        logger.info(f"Deadline: {event} ({self.remaining():.1f}s of {self.seconds:.0f}s left)")
+
+    @property
+    def partial(self) -> bool:
+        """True if the answer was built without everything the agent wanted to do."""
+        return bool(self.events)
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("finpal_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float], answer_reserve: float = 10.0) -> Iterator[Optional[Deadline]]:
+    """Give the block a deadline (none if ``seconds`` is falsy)."""
+    deadline = Deadline(seconds, answer_reserve) if seconds else None
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        try:
+            _current_deadline.reset(token)
+        except ValueError:
+            # Closed from another context (an async generator finalized elsewhere)
+            _current_deadline.set(None)
+
+
+def skipped_tool_message(tool_name: str) -> str:
+    return (f"Tool {tool_name} was not run: this request is out of time. "
+            "Answer with the information you already have.")
+
+
+def timed_out_tool_message(tool_name: str, seconds: float) -> str:
+    return (f"Tool {tool_name} did not finish within {seconds:.0f} seconds and was stopped. "
+            "Answer with the information you already have.")
@@ -12,6 +12,14 @@ import tempfile
 import requests  # For timeout handling
 from typing import Dict, Any, List, Optional, Tuple
 
+try:
+    from src.services.tracing import span
+except ImportError:
+    from tracing import span
+
+# Needs the backend directory on the path (run this file as python -m src.services.direct_context)
+from src.services.receipt_summary import build_receipt_summary
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,9 +27,13 @@ logger = logging.getLogger(__name__)
 # Global variables for caching
 _db = None
 _context_cache = None
+_receipt_records = None  # the documents behind _context_cache, for answering lookups directly
 _last_refresh_time = 0
 _cache_ttl = 30 * 60  # 30 minutes in seconds
 
+# Size of the receipt summary put in the system prompt (0 = the old line-per-field dump)
+RECEIPT_SUMMARY_TOKENS = int(os.environ.get("RECEIPT_SUMMARY_TOKENS", 2000))
+
 # For local development
 LOCAL_SERVICE_ACCOUNT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), 
                                   "firebase-key.json")
@@ -163,7 +175,25 @@ def check_for_updates() -> bool:
         # On error, assume update needed
         return True
 
-def fetch_receipt_context(limit: int = 300, force_refresh: bool = False, user_id: str = None) -> str:
+def format_receipt_dump(receipts_docs) -> str:
+    """Simple text format of all receipts without processing (RECEIPT_SUMMARY_TOKENS=0)."""
+    context = "USER RECEIPT DATA:\n\n"
+    for doc in receipts_docs:
+        data = doc.to_dict()
+        context += f"Receipt ID: {doc.id}\n"
+        
+        # Add basic receipt fields without processing
+        for key, value in data.items():
+            if key == 'items' and isinstance(value, list):
+                context += f"Items: {[item.get('description', 'Unknown') for item in value]}\n"
+            elif not isinstance(value, (dict, list)):
+                context += f"{key}: {value}\n"
+        
+        context += "-" * 40 + "\n\n"
+    return context
+
+def fetch_receipt_context(limit: int = 300, force_refresh: bool = False, user_id: str = None,
+                          timeout: float = 60) -> str:
     """
     Fetches receipts from Firestore and formats them for context.
     Uses caching to avoid unnecessary database calls.
@@ -172,11 +202,12 @@ def fetch_receipt_context(limit: int = 300, force_refresh: bool = False, user_id
         limit: Maximum number of receipts to fetch
         force_refresh: Whether to force a refresh of the cache
         user_id: Optional user ID to filter receipts by
+        timeout: Seconds the Firestore query may take (the caller's deadline budget)
         
     Returns:
         Formatted receipt context string
     """
-    global _context_cache, _last_refresh_time
+    global _context_cache, _receipt_records, _last_refresh_time
     
     # Use cached version if available and not forcing refresh
     if not force_refresh and _context_cache is not None and time.time() - _last_refresh_time < _cache_ttl:
@@ -224,7 +255,9 @@ def fetch_receipt_context(limit: int = 300, force_refresh: bool = False, user_id
             query = query.limit(limit)
             
             # Execute query with timeout
-            receipts_docs = query.get(timeout=60)
+            with span("firestore.query", collection="receipts", limit=limit) as query_span:
+                receipts_docs = query.get(timeout=timeout)
+                query_span.set_attribute("documents", len(receipts_docs))
         except Exception as e:
             logger.error(f"Error querying receipts: {str(e)}")
             # If we have a cached version, return that on query error
@@ -233,24 +266,16 @@ def fetch_receipt_context(limit: int = 300, force_refresh: bool = False, user_id
                 return _context_cache
             return f"Error retrieving receipt data: {str(e)}"
 
-        # Simple text format of all receipts without processing
-        context = "USER RECEIPT DATA:\n\n"
-        
-        for doc in receipts_docs:
-            data = doc.to_dict()
-            context += f"Receipt ID: {doc.id}\n"
-            
-            # Add basic receipt fields without processing
-            for key, value in data.items():
-                if key == 'items' and isinstance(value, list):
-                    context += f"Items: {[item.get('description', 'Unknown') for item in value]}\n"
-                elif not isinstance(value, (dict, list)):
-                    context += f"{key}: {value}\n"
-            
-            context += "-" * 40 + "\n\n"
+        records = [doc.to_dict() for doc in receipts_docs]
+        if RECEIPT_SUMMARY_TOKENS > 0:
+            # Totals per category, merchant and month, and the latest receipts, within a token budget
+            context = build_receipt_summary(records, RECEIPT_SUMMARY_TOKENS)
+        else:
+            context = format_receipt_dump(receipts_docs)
         
         # Update cache and timestamp
         _context_cache = context
+        _receipt_records = records
         _last_refresh_time = time.time()
         
         logger.info(f"Retrieved and cached {len(receipts_docs)} receipts for context")
@@ -264,6 +289,10 @@ def fetch_receipt_context(limit: int = 300, force_refresh: bool = False, user_id
             return _context_cache
         return f"Error retrieving receipt data: {str(e)}"
 
+def get_cached_receipt_records() -> Optional[List[Dict[str, Any]]]:
+    """The receipt documents of the last successful fetch (None if there hasn't been one)."""
+    return _receipt_records
+
 # Simple test function
 if __name__ == "__main__":
     context = fetch_receipt_context(limit=5)
@@ -0,0 +1,189 @@
+"""
+History Compaction for Chat Sessions
+
+Keeps the conversation history sent to Gemini under a token budget instead of a
+fixed message count. Stale tool outputs (brave_search results, yfinance quotes, ...)
+are replaced by short stubs, and the oldest turns are folded into a running summary
+that travels with the system prompt.
+"""
+
+import dataclasses
+import logging
+import re
+from typing import Any, Dict, List, Tuple
+
+from pydantic_ai.messages import SystemPromptPart
+
+from .conversation_store import is_turn_start
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+SUMMARY_HEADER = "SUMMARY OF EARLIER CONVERSATION (older turns, oldest first):"
+STUB_PREFIX = "[Tool output removed from history"
+CHARS_PER_TOKEN = 4  # Rough average for Gemini tokenizers on English/HTML text
+
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about 4 characters per token)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def part_text(part: Any) -> str:
+    """The text of a message part as the model would see it."""
+    kind = getattr(part, "part_kind", None)
+    if kind == "tool-return":
+        return part.model_response_str()
+    if kind == "tool-call":
+        return part.tool_name + part.args_as_json_str()
+    if kind == "retry-prompt":
+        return part.model_response()
+    content = getattr(part, "content", "")
+    return content if isinstance(content, str) else str(content)
+
+
+def message_tokens(message: Any, include_system: bool = False) -> int:
+    """Estimated tokens of one message (system prompt parts excluded unless asked for)."""
+    return sum(
+        estimate_tokens(part_text(part)) for part in message.parts
+        if include_system or getattr(part, "part_kind", None) != "system-prompt"
+    )
+
+
+def _plain_text(text: str, limit: int) -> str:
+    # Strip HTML and collapse whitespace so the summary stays small
+    text = _WHITESPACE_RE.sub(" ", _HTML_TAG_RE.sub(" ", text)).strip()
+    return text if len(text) <= limit else text[:limit].rstrip() + "..."
+
+
+def _split_turns(messages: List[Any]) -> List[List[Any]]:
+    turns: List[List[Any]] = []
+    for message in messages:
+        if is_turn_start(message) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _take_system_parts(messages: List[Any]) -> Tuple[List[Any], List[str], List[Any]]:
+    """Pull the system prompt parts (and any earlier summary) out of the messages."""
+    system_parts: List[Any] = []
+    summary_lines: List[str] = []
+    rest: List[Any] = []
+    for message in messages:
+        if getattr(message, "kind", None) != "request":
+            rest.append(message)
+            continue
+        other_parts = []
+        for part in message.parts:
+            if getattr(part, "part_kind", None) != "system-prompt":
+                other_parts.append(part)
+            elif part.content.startswith(SUMMARY_HEADER):
+                summary_lines.extend(line for line in part.content.splitlines()[1:] if line.strip())
+            else:
+                system_parts.append(part)
+        if other_parts:
+            rest.append(dataclasses.replace(message, parts=other_parts))
+    return system_parts, summary_lines, rest
+
+
+def _summarize_turn(turn: List[Any]) -> str:
+    question, answer, tools = "", "", []
+    for message in turn:
+        for part in message.parts:
+            kind = getattr(part, "part_kind", None)
+            if kind == "user-prompt" and not question:
+                question = part_text(part)
+            elif kind == "tool-call" and part.tool_name not in tools:
+                tools.append(part.tool_name)
+            elif kind == "text":
+                answer = part.content  # the last text part is the final answer
+    line = f"- User: {_plain_text(question, 200)}"
+    if tools:
+        line += f" | Tools: {', '.join(tools)}"
+    return line + f" | FinPal: {_plain_text(answer, 300)}"
+
+
+def _stub_tool_returns(turn: List[Any], min_tokens: int) -> Tuple[List[Any], int]:
+    stubbed = 0
+    new_turn = []
+    for message in turn:
+        parts = list(message.parts)
+        for i, part in enumerate(parts):
+            if getattr(part, "part_kind", None) != "tool-return":
+                continue
+            content = part_text(part)
+            if content.startswith(STUB_PREFIX) or estimate_tokens(content) < min_tokens:
+                continue
+            stub = f"{STUB_PREFIX} to save tokens: {part.tool_name} returned ~{estimate_tokens(content)} tokens]"
+            parts[i] = dataclasses.replace(part, content=stub)
+            stubbed += 1
+        new_turn.append(dataclasses.replace(message, parts=parts) if parts != list(message.parts) else message)
+    return new_turn, stubbed
+
+
+def compact_history(
+    messages: List[Any],
+    token_budget: int,
+    keep_recent_turns: int = 2,
+    keep_tool_output_turns: int = 1,
+    min_stub_tokens: int = 64,
+) -> Tuple[List[Any], Dict[str, Any]]:
+    """Compact a session's history so the conversation part fits in ``token_budget`` tokens.
+
+    The system prompt is not counted (it is rebuilt every turn anyway) but is kept on the
+    first message so pydantic-ai re-evaluates it. Returns the new messages and stats.
+    """
+    if not messages:
+        return messages, {"tokens_before": 0, "tokens_after": 0, "folded_turns": 0, "stubbed_tool_returns": 0}
+
+    system_parts, summary_lines, rest = _take_system_parts(messages)
+    turns = _split_turns(rest)
+
+    def total_tokens() -> int:
+        summary = estimate_tokens("\n".join(summary_lines)) if summary_lines else 0
+        return summary + sum(message_tokens(message) for turn in turns for message in turn)
+
+    tokens_before = total_tokens()
+
+    # 1. Stale tool outputs are the cheapest thing to drop
+    stubbed = 0
+    for i in range(max(len(turns) - keep_tool_output_turns, 0)):
+        turns[i], count = _stub_tool_returns(turns[i], min_stub_tokens)
+        stubbed += count
+
+    # 2. Fold the oldest turns into the running summary until we fit the budget
+    folded = 0
+    while total_tokens() > token_budget and len(turns) > keep_recent_turns:
+        summary_lines.append(_summarize_turn(turns.pop(0)))
+        folded += 1
+
+    # 3. Still too big: stub the tool outputs of the recent turns as well
+    if total_tokens() > token_budget:
+        for i in range(len(turns)):
+            turns[i], count = _stub_tool_returns(turns[i], min_stub_tokens)
+            stubbed += count
+
+    # The summary itself gets at most a quarter of the budget, oldest lines go first
+    while len(summary_lines) > 1 and estimate_tokens("\n".join(summary_lines)) > token_budget // 4:
+        summary_lines.pop(0)
+
+    compacted = [message for turn in turns for message in turn]
+    head_parts = list(system_parts)
+    if summary_lines:
+        head_parts.append(SystemPromptPart(content=SUMMARY_HEADER + "\n" + "\n".join(summary_lines)))
+    if head_parts and compacted and getattr(compacted[0], "kind", None) == "request":
+        compacted[0] = dataclasses.replace(compacted[0], parts=head_parts + list(compacted[0].parts))
+
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": total_tokens(),
+        "folded_turns": folded,
+        "stubbed_tool_returns": stubbed,
+    }
+    if folded or stubbed:
+        logger.info(f"Compacted history: {stats}")
+    return compacted, stats
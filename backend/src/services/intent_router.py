@@ -0,0 +1,403 @@
+"""
+Local Intent Router for Receipt Lookups
+
+Many chat questions are plain lookups or aggregates over the user's receipts: "list my
+receipts", "how much did I spend at Starbucks this month", "what was my largest
+purchase". Those have one right answer in the receipt records, so they are answered
+here in milliseconds, rendered with the same HTML templates the system prompt gives
+the model (RECEIPT LISTING, DIRECT ANSWER, QUICK RESPONSE). Anything else (advice,
+comparisons, trends, charts, or a lookup whose merchant or category we can't pin down)
+returns None and goes to the agent as before.
+"""
+
+import html
+import logging
+import re
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+RECEIPT_LIST_MAX_ROWS = 100
+DEFAULT_CURRENCY = "SAR"
+
+_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d", "%d-%m-%Y", "%d.%m.%Y", "%m/%d/%Y",
+                 "%d %b %Y", "%d %B %Y", "%b %d, %Y", "%B %d, %Y", "%b %d %Y", "%B %d %Y")
+
+_PERIOD_RE = re.compile(
+    r"\s*\b(?:(?:in|during|for|from) )?(?P<period>today|yesterday|this week|last week|this month|"
+    r"last month|this year|last year|so far|all time|ever)\b")
+_TAIL_RE = re.compile(r"^(?P<preposition>at|from|on|for|in) (?:the )?(?P<entity>.+)$")
+
+# Question head for each intent; what follows must be filters (a period, a merchant, a category)
+_INTENTS = [
+    ("receipt_list", re.compile(
+        r"^(?:please )?(?:can you |could you )?(?:list|show(?: me)?|display|give me)(?: all| all of)? "
+        r"(?:my |the )?(?:receipts|transactions|purchases)\b")),
+    ("receipt_list", re.compile(r"^(?:my )?(?:receipts|receipt list|list of (?:my )?receipts)\b")),
+    ("total_spent", re.compile(
+        r"^(?:how much (?:did|have|do) i (?:spend|spent|pay|paid)|how much i (?:spent|spend)|how much money "
+        r"(?:did|have) i (?:spend|spent))\b")),
+    ("total_spent", re.compile(
+        r"^(?:what(?: is| was|s)? )?(?:my |the )?total (?:spent|spending|spend|expenses?|amount spent)\b")),
+    ("largest_transaction", re.compile(
+        r"^(?:what(?: is| was|s)? |show(?: me)? )?(?:my |the )?(?:largest|biggest|most expensive|highest) "
+        r"(?:single )?(?:transaction|purchase|receipt|expense|payment)\b")),
+    ("receipt_count", re.compile(
+        r"^how many (?:receipts|transactions|purchases)(?: do i have| have i (?:uploaded|scanned|made|got))?\b")),
+]
+# Words that follow a head but make it a different question ("... compared to", "... and why")
+_OPEN_ENDED_RE = re.compile(r"\b(?:why|should|compare|compared|versus|vs|trend|chart|graph|advice|recommend|"
+                            r"save|saving|budget|average|and|or|but|per|each|than)\b")
+
+
+class ReceiptRecord:
+    """The fields the router needs from one receipt, whichever schema it was saved with."""
+
+    def __init__(self, merchant: str, total: float, currency: str, category: str, day: Optional[date]) -> None:
+        self.merchant = merchant
+        self.total = total
+        self.currency = currency
+        self.category = category
+        self.day = day
+
+
+class RoutedAnswer:
+    def __init__(self, intent: str, html: str) -> None:
+        self.intent = intent
+        self.html = html
+
+
+def _value(value: Any) -> Any:
+    """Unwrap {"content": ..., "confidence": ...} fields written by the receipt extractor."""
+    if isinstance(value, dict):
+        return value.get("content", value.get("value"))
+    return value
+
+
+def parse_amount(value: Any) -> Optional[float]:
+    value = _value(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    text = re.sub(r"[^\d.,-]", "", value)
+    if "," in text and "." not in text and re.search(r",\d{2}$", text):
+        text = text.replace(",", ".")  # 12,50
+    try:
+        return float(text.replace(",", ""))
+    except ValueError:
+        return None
+
+
+def parse_day(value: Any) -> Optional[date]:
+    value = _value(value)
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, str) or not value.strip():
+        return None
+    text = value.strip()
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).date()
+    except ValueError:
+        pass
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_receipt(data: Dict[str, Any]) -> Optional[ReceiptRecord]:
+    """A ReceiptRecord from a Firestore receipt document, or None if it has no usable total."""
+    total = parse_amount(data.get("total"))
+    if total is None:
+        return None
+    vendor = data.get("vendor") if isinstance(data.get("vendor"), dict) else {}
+    merchant = _value(vendor.get("name")) or _value(data.get("merchantName")) or _value(data.get("merchant"))
+    currency = _value(data.get("currency")) or DEFAULT_CURRENCY
+    return ReceiptRecord(
+        merchant=str(merchant).strip() if merchant else "Unknown merchant",
+        total=total,
+        currency=str(currency).strip().upper() or DEFAULT_CURRENCY,
+        category=str(_value(data.get("category")) or "Other").strip() or "Other",
+        day=parse_day(data.get("date")) or parse_day(data.get("createdTime")),
+    )
+
+
+def normalize_question(question: str) -> str:
+    question = question.lower().replace("’", "'").replace("what's", "what is")
+    question = re.sub(r"[?!.,;:]", " ", question)
+    return re.sub(r"\s+", " ", question).strip()
+
+
+def period_range(period: str, today: date) -> Tuple[Optional[date], Optional[date], str]:
+    """(first day, last day, label) of a period phrase; None bounds are open."""
+    if period == "today":
+        return today, today, "today"
+    if period == "yesterday":
+        day = today - timedelta(days=1)
+        return day, day, "yesterday"
+    if period == "this week":
+        start = today - timedelta(days=today.weekday())
+        return start, today, "this week"
+    if period == "last week":
+        start = today - timedelta(days=today.weekday() + 7)
+        return start, start + timedelta(days=6), "last week"
+    if period == "this month":
+        return today.replace(day=1), today, f"in {today:%B %Y}"
+    if period == "last month":
+        end = today.replace(day=1) - timedelta(days=1)
+        return end.replace(day=1), end, f"in {end:%B %Y}"
+    if period == "this year":
+        return today.replace(month=1, day=1), today, f"in {today.year}"
+    if period == "last year":
+        return date(today.year - 1, 1, 1), date(today.year - 1, 12, 31), f"in {today.year - 1}"
+    return None, None, ""
+
+
+def contains_words(text: str, phrase: str) -> bool:
+    """Whether ``phrase`` appears in ``text`` as whole words ("panda" in "panda hyper", not "pan" in "panda")."""
+    return re.search(rf"(?<!\w){re.escape(phrase)}(?!\w)", text) is not None
+
+
+def match_entity(text: str, records: List[ReceiptRecord]) -> Optional[Tuple[str, str]]:
+    """("merchant" | "category", name) for a merchant or category named in the question.
+
+    An exact name wins. Otherwise the question and the name must contain one another as
+    whole words, and only one merchant or category may match (None lets the model decide).
+    """
+    text = text.strip()
+    candidates = []
+    for kind in ("merchant", "category"):
+        names = {getattr(record, kind) for record in records}
+        exact = [name for name in names if name.lower() == text]
+        if exact:
+            return kind, exact[0]
+        candidates += [(kind, name) for name in names if len(text) >= 3 and len(name) >= 3
+                       and (contains_words(name.lower(), text) or contains_words(text, name.lower()))]
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def match_intent(text: str) -> Optional[Tuple[str, "re.Match[str]"]]:
+    for intent, head in _INTENTS:
+        match = head.match(text)
+        if match:
+            return intent, match
+    return None
+
+
+def detect_intent(question: str) -> Optional[str]:
+    """The lookup intent a question starts like, even if it can't be answered locally."""
+    found = match_intent(normalize_question(question))
+    return found[0] if found is not None else None
+
+
+def route(question: str, receipts: Iterable[Dict[str, Any]], today: Optional[date] = None,
+          limit: Optional[int] = None) -> Optional[RoutedAnswer]:
+    """Answer ``question`` from the receipts if it is a plain lookup, else None (ask the model).
+
+    ``receipts`` are the latest ``limit`` receipts (None: all of them). When that may leave
+    some out, only periods the fetched receipts fully cover are answered here, and a
+    period is never answered over receipts whose date can't be read.
+    """
+    receipts = list(receipts)
+    text = normalize_question(question)
+    found = match_intent(text)
+    if found is None:
+        return None
+    intent, match = found
+    tail = text[match.end():]
+
+    today = today or date.today()
+    start = end = None
+    label = ""
+    period = _PERIOD_RE.search(tail)
+    if period:
+        start, end, label = period_range(period.group("period"), today)
+        tail = tail[:period.start()] + tail[period.end():]
+    tail = re.sub(r"\s+", " ", tail).strip()
+    if _OPEN_ENDED_RE.search(tail):
+        return None
+
+    records = [record for record in (normalize_receipt(data) for data in receipts) if record is not None]
+    scope = None
+    if tail:
+        filter_match = _TAIL_RE.match(tail)
+        scope = match_entity(filter_match.group("entity"), records) if filter_match else None
+        if scope is None:
+            # A merchant, category or item we can't find in the records: let the model handle it
+            return None
+
+    in_scope = [record for record in records if scope is None or getattr(record, scope[0]) == scope[1]]
+    if start is not None and any(record.day is None for record in in_scope):
+        return None  # Can't tell whether those receipts fall in the period
+    if limit is not None and len(receipts) >= limit:
+        # Older receipts weren't fetched: the answer would be short by them
+        days = [record.day for record in records if record.day is not None]
+        if start is None or not days or start <= min(days):
+            return None
+    selected = [record for record in in_scope if start is None or start <= record.day <= end]
+    if len({record.currency for record in selected}) > 1:
+        return None  # Adding up several currencies needs judgement
+    description = " ".join(part for part in (
+        f"at {scope[1]}" if scope and scope[0] == "merchant" else f"on {scope[1]}" if scope else "", label) if part)
+
+    renderer = {
+        "receipt_list": render_receipt_list,
+        "total_spent": render_total_spent,
+        "largest_transaction": render_largest_transaction,
+        "receipt_count": render_receipt_count,
+    }[intent]
+    logger.info("Answering %r locally as %s (%d receipts)", question[:80], intent, len(selected))
+    return RoutedAnswer(intent, renderer(selected, records, description))
+
+
+def money(amount: float, currency: str) -> str:
+    return f"{currency} {amount:,.2f}"
+
+
+def _day(record: ReceiptRecord) -> str:
+    return record.day.strftime("%d %b %Y") if record.day else "Unknown date"
+
+
+def _sorted_by_day(records: List[ReceiptRecord]) -> List[ReceiptRecord]:
+    return sorted(records, key=lambda record: record.day or date.min, reverse=True)
+
+
+def render_quick_response(text: str) -> str:
+    return f'<div class="p-4 bg-gray-50 rounded-lg">\n    <p class="text-lg">{text}</p>\n</div>'
+
+
+def render_no_receipts(description: str) -> str:
+    where = f" {html.escape(description)}" if description else ""
+    return render_quick_response(
+        f"I couldn't find any receipts{where}. Upload a receipt and I'll include it in your spending.")
+
+
+def render_direct_answer(answer: str, detail: str, insight: str) -> str:
+    return (
+        '<div class="mb-4 p-4 bg-gray-50 rounded-lg">\n'
+        '    <h3 class="mb-2 text-blue-600 font-semibold">💬 ANSWER</h3>\n'
+        f'    <p class="ml-5">{answer}</p>\n'
+        '    \n'
+        '    <div class="mt-3 ml-5 p-3 border-l-4 border-blue-400 bg-blue-50">\n'
+        f'        <p class="text-sm italic">{detail}</p>\n'
+        '    </div>\n'
+        '    \n'
+        '    <h3 class="mb-2 mt-4 text-blue-600 font-semibold">💡 RELATED INSIGHT</h3>\n'
+        f'    <p class="ml-5">{insight}</p>\n'
+        '</div>'
+    )
+
+
+def render_receipt_list(selected: List[ReceiptRecord], records: List[ReceiptRecord], description: str) -> str:
+    if not selected:
+        return render_no_receipts(description)
+    rows = _sorted_by_day(selected)
+    currency = rows[0].currency
+    total = sum(record.total for record in rows)
+    shown = rows[:RECEIPT_LIST_MAX_ROWS]
+    summary = f"{len(rows)} receipts{' ' + description if description else ''}, most recent first"
+    if len(rows) > len(shown):
+        summary += f" (showing the latest {len(shown)})"
+    category, count = Counter(record.category for record in rows).most_common(1)[0]
+    largest = max(rows, key=lambda record: record.total)
+    body = "\n".join(
+        '                <tr class="hover:bg-gray-50">\n'
+        f'                    <td class="py-2 px-4 border-b">{html.escape(record.merchant)}</td>\n'
+        f'                    <td class="py-2 px-4 border-b">{_day(record)}</td>\n'
+        f'                    <td class="py-2 px-4 border-b text-right">{money(record.total, record.currency)}</td>\n'
+        f'                    <td class="py-2 px-4 border-b">{html.escape(record.category)}</td>\n'
+        '                </tr>'
+        for record in shown
+    )
+    return (
+        '<div class="mb-4 p-4 bg-indigo-50 rounded-lg">\n'
+        '    <h3 class="mb-2 text-indigo-600 font-semibold">📋 RECEIPT LIST</h3>\n'
+        f'    <p class="ml-5">{html.escape(summary)}.</p>\n'
+        '    \n'
+        '    <div class="ml-5 mt-4 overflow-x-auto">\n'
+        '        <table class="min-w-full bg-white border rounded-lg">\n'
+        '            <thead class="bg-indigo-100">\n'
+        '                <tr>\n'
+        '                    <th class="py-2 px-4 border-b text-left">Merchant</th>\n'
+        '                    <th class="py-2 px-4 border-b text-left">Date</th>\n'
+        '                    <th class="py-2 px-4 border-b text-right">Amount</th>\n'
+        '                    <th class="py-2 px-4 border-b text-left">Category</th>\n'
+        '                </tr>\n'
+        '            </thead>\n'
+        '            <tbody>\n'
+        f'{body}\n'
+        '            </tbody>\n'
+        '            <tfoot class="bg-indigo-50">\n'
+        '                <tr>\n'
+        '                    <td class="py-2 px-4 border-t font-bold" colspan="2">Total</td>\n'
+        f'                    <td class="py-2 px-4 border-t text-right font-bold">{money(total, currency)}</td>\n'
+        '                    <td class="py-2 px-4 border-t"></td>\n'
+        '                </tr>\n'
+        '            </tfoot>\n'
+        '        </table>\n'
+        '    </div>\n'
+        '    \n'
+        '    <h3 class="mb-2 mt-4 text-indigo-600 font-semibold">💡 SUMMARY</h3>\n'
+        '    <ul class="ml-5 pl-5 list-disc">\n'
+        f'        <li>Total Receipts: {len(rows)}</li>\n'
+        f'        <li>Most Frequent Category: {html.escape(category)} ({100 * count / len(rows):.0f}%)</li>\n'
+        f'        <li>Largest Transaction: {html.escape(largest.merchant)} - {money(largest.total, largest.currency)} ({_day(largest)})</li>\n'
+        '    </ul>\n'
+        '</div>'
+    )
+
+
+def render_total_spent(selected: List[ReceiptRecord], records: List[ReceiptRecord], description: str) -> str:
+    if not selected:
+        return render_no_receipts(description)
+    currency = selected[0].currency
+    total = sum(record.total for record in selected)
+    where = html.escape(description)
+    answer = f"You spent <b>{money(total, currency)}</b>{' ' + where if where else ''}."
+    detail = f"Based on {len(selected)} receipt{'s' if len(selected) != 1 else ''}, " \
+             f"{money(total / len(selected), currency)} per receipt on average."
+    everything = sum(record.total for record in records if record.currency == currency)
+    if description and everything:
+        insight = f"That is {100 * total / everything:.0f}% of the {money(everything, currency)} across all your receipts."
+    else:
+        largest = max(selected, key=lambda record: record.total)
+        insight = f"Your largest single purchase was {money(largest.total, currency)} at {html.escape(largest.merchant)}."
+    return render_direct_answer(answer, detail, insight)
+
+
+def render_largest_transaction(selected: List[ReceiptRecord], records: List[ReceiptRecord], description: str) -> str:
+    if not selected:
+        return render_no_receipts(description)
+    ranked = sorted(selected, key=lambda record: record.total, reverse=True)
+    largest = ranked[0]
+    where = html.escape(description)
+    answer = (f"Your largest transaction{' ' + where if where else ''} was <b>{money(largest.total, largest.currency)}</b> "
+              f"at {html.escape(largest.merchant)} on {_day(largest)}.")
+    detail = f"Category: {html.escape(largest.category)}."
+    if len(ranked) > 1:
+        runner_up = ranked[1]
+        insight = (f"The next largest was {money(runner_up.total, runner_up.currency)} at "
+                   f"{html.escape(runner_up.merchant)}, out of {len(ranked)} receipts.")
+    else:
+        insight = "It is the only receipt in this period."
+    return render_direct_answer(answer, detail, insight)
+
+
+def render_receipt_count(selected: List[ReceiptRecord], records: List[ReceiptRecord], description: str) -> str:
+    if not selected:
+        return render_no_receipts(description)
+    where = html.escape(description)
+    answer = f"You have <b>{len(selected)}</b> receipt{'s' if len(selected) != 1 else ''}{' ' + where if where else ''}."
+    total = sum(record.total for record in selected)
+    detail = f"Together they add up to {money(total, selected[0].currency)}."
+    category, count = Counter(record.category for record in selected).most_common(1)[0]
+    insight = f"Most of them are {html.escape(category)} ({count} of {len(selected)})."
+    return render_direct_answer(answer, detail, insight)
@@ -0,0 +1,125 @@
+"""
+Logging Setup for the Backend
+
+Log records are put on an in-memory queue and written to stdout by a background
+thread, so a request handler never blocks on a console write. Levels can be set per
+module, chatty call sites can log only one record in N, and expensive arguments
+(JSON dumps of model responses) can be wrapped in lazy() so they are only built when
+the record is actually going to be written.
+
+Environment variables:
+    LOG_LEVEL   root level (default INFO)
+    LOG_LEVELS  per-module levels, e.g. "api=DEBUG,src.services.mcp_client=WARNING"
+    LOG_FORMAT  logging format string
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from typing import Any, Callable, Dict, Optional, TextIO
+
+DEFAULT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.Handler] = None
+
+
+class Lazy:
+    """Builds its string only when the log record is formatted."""
+
+    __slots__ = ("fn", "args", "kwargs")
+
+    def __init__(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self) -> str:
+        return str(self.fn(*self.args, **self.kwargs))
+
+
+def lazy(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Lazy:
+    """Pass as a %s argument: logger.debug("Response: %s", lazy(json.dumps, data, indent=2))"""
+    return Lazy(fn, *args, **kwargs)
+
+
+def truncate(text: Any, limit: int = 80) -> str:
+    """Shorten user text for INFO logs (full text belongs at DEBUG)."""
+    text = str(text)
+    return text if len(text) <= limit else text[:limit] + f"... ({len(text)} chars)"
+
+
+class SamplingFilter(logging.Filter):
+    """Passes 1 in N records from call sites that log with extra={"sample_every": N}."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._counts: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample_every", None)
+        if not every or every <= 1:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % every == 0
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Parse "module=LEVEL,other=LEVEL" (unknown levels are ignored)."""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        level_number = logging.getLevelName(level.strip().upper())
+        if name.strip() and isinstance(level_number, int):
+            levels[name.strip()] = level_number
+    return levels
+
+
+def setup_logging(level: Optional[str] = None, module_levels: Optional[str] = None,
+                  stream: Optional[TextIO] = None) -> logging.handlers.QueueListener:
+    """Route all logging through a queue and a background writer thread. Safe to call twice."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(logging.Formatter(os.environ.get("LOG_FORMAT", DEFAULT_FORMAT)))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    _queue_handler = queue_handler
+    root.setLevel((level or os.environ.get("LOG_LEVEL", "INFO")).upper())
+    for name, module_level in parse_levels(module_levels or os.environ.get("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """Write out everything still queued and stop the writer thread."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        # Anything logged after this (late atexit handlers) is written directly
+        root = logging.getLogger()
+        root.removeHandler(_queue_handler)
+        for handler in _listener.handlers:
+            root.addHandler(handler)
+        _listener = _queue_handler = None
@@ -2,9 +2,10 @@ from pydantic_ai import RunContext, Tool as PydanticTool
 from pydantic_ai.tools import ToolDefinition
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
-from mcp.types import Tool as MCPTool
-from contextlib import AsyncExitStack
-from typing import Any, List
+from mcp.types import CancelledNotification, CancelledNotificationParams, ClientNotification, JSONRPCRequest, Tool as MCPTool
+from contextlib import AsyncExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
 import asyncio
 import logging
 import shutil
@@ -12,16 +13,73 @@ import json
 import os
 import sys
 import pathlib
+import time
 
 # Add the backend directory to the Python path to fix imports
 current_dir = pathlib.Path(__file__).parent.resolve()
 backend_dir = current_dir.parent.parent
 sys.path.insert(0, str(backend_dir))
 
-# basic logging
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
-)
+from src.services.cancellation import track_current_task
+from src.services.deadline import current_deadline, skipped_tool_message, timed_out_tool_message
+from src.services.metrics import TOOL_CALL_SECONDS, TOOL_CALLS_TOTAL
+from src.services.tool_cache import make_tool_key, tool_cache, tool_ttl
+from src.services.tool_dispatch import DEFAULT_MAX_CONCURRENT_CALLS, ServerSlots, tool_steps
+from src.services.tool_output import OutputShape
+from src.services.tracing import span
+
+# module logger (levels and output are set up by logging_config.setup_logging)
+logger = logging.getLogger(__name__)
+
+
+class SentRequest:
+    """The JSON-RPC id of the tools/call request a task sent (None until it is on the wire)."""
+
+    def __init__(self) -> None:
+        self.id: Any = None
+
+
+_sent_request: ContextVar[Optional[SentRequest]] = ContextVar("mcp_sent_request", default=None)
+
+
+@contextmanager
+def sent_request() -> Iterator[SentRequest]:
+    """Record the id of the tools/call request this task sends inside the block."""
+    sent = SentRequest()
+    token = _sent_request.set(sent)
+    try:
+        yield sent
+    finally:
+        _sent_request.reset(token)
+
+
+class RequestIdTap:
+    """Wraps a session's write stream to see the id each tools/call request goes out with.
+
+    ClientSession sends from the calling task, so the id lands in that task's SentRequest:
+    the one a cancel notification has to name, even with other calls sharing the session.
+    """
+
+    def __init__(self, stream: Any) -> None:
+        self.stream = stream
+
+    async def send(self, message: Any) -> None:
+        sent = _sent_request.get()
+        request = getattr(getattr(message, "message", None), "root", None)
+        if sent is not None and isinstance(request, JSONRPCRequest) and request.method == "tools/call":
+            sent.id = request.id
+        await self.stream.send(message)
+
+    async def __aenter__(self) -> "RequestIdTap":
+        await self.stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> Any:
+        return await self.stream.__aexit__(*exc_info)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
 # the class or local excuter of all MCP servers
 class MCPClient:
     """Manages connections to one or more MCP servers based on mcp_config.json"""
@@ -58,43 +116,75 @@ class MCPClient:
             
             # Initialize if essential or has autostart=true
             if not (is_essential or server.config.get("autostart", False)):
-                logging.info(f"Skipping non-essential server: {server.name} - Priority: {server.config.get('priority', 'unknown')}, Autostart: {server.config.get('autostart', False)}")
+                logger.info(f"Skipping non-essential server: {server.name} - Priority: {server.config.get('priority', 'unknown')}, Autostart: {server.config.get('autostart', False)}")
+                server.status = "skipped"
                 continue
                 
+            started_at = time.monotonic()
             try:
-                logging.info(f"Initializing server: {server.name} - Priority: {server.config.get('priority', 'unknown')}, Autostart: {server.config.get('autostart', False)}")
+                logger.info(f"Initializing server: {server.name} - Priority: {server.config.get('priority', 'unknown')}, Autostart: {server.config.get('autostart', False)}")
+                server.status = "starting"
                 await server.initialize() # init server
-                logging.debug(f"Creating pydantic tools for server: {server.name}")
+                logger.debug(f"Creating pydantic tools for server: {server.name}")
                 tools = await server.create_pydantic_ai_tools() # create pydantic tools
-                logging.debug(f"Found {len(tools)} tools in server: {server.name}")
+                logger.debug(f"Found {len(tools)} tools in server: {server.name}")
                 for tool in tools:
-                    logging.debug(f"  - {tool.name}")
+                    logger.debug(f"  - {tool.name}")
                 self.tools += tools # add tools to list
+                server.tool_count = len(tools)
+                # initialize() doesn't raise, a server that failed to start just has no session
+                server.status = "ready" if server.session else "failed"
             except Exception as e:
-                logging.error(f"Failed to initialize server {server.name}: {e}")
-                logging.error(f"Error details: {type(e).__name__}: {e}")
+                server.status = "failed"
+                server.error = str(e)
+                logger.error(f"Failed to initialize server {server.name}: {e}")
+                logger.error(f"Error details: {type(e).__name__}: {e}")
                 import traceback
-                logging.error(f"Traceback: {traceback.format_exc()}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
                 # Continue with other servers instead of exiting early
                 # Just clean up the failed server
                 try:
                     await server.cleanup()
                 except Exception as cleanup_error:
-                    logging.error(f"Error cleaning up failed server {server.name}: {cleanup_error}")
+                    logger.error(f"Error cleaning up failed server {server.name}: {cleanup_error}")
+            finally:
+                server.startup_seconds = round(time.monotonic() - started_at, 3)
 
         # Only call cleanup_servers if we couldn't initialize any servers
         if not self.tools:
-            logging.warning("No tools were found from any servers")
+            logger.warning("No tools were found from any servers")
             
         return self.tools
 
+    def dispatch_stats(self) -> Dict[str, Any]:
+        """In-flight tool calls per server, and how much the calls of each model step overlapped."""
+        return {
+            "servers": {server.name: server.slots.stats() for server in self.servers},
+            "steps": tool_steps.stats(),
+        }
+
+    def server_status(self) -> List[Dict[str, Any]]:
+        """Startup progress of each configured server (for the readiness probe)."""
+        return [
+            {
+                "name": server.name,
+                "status": server.status,
+                "tools": server.tool_count,
+                "startup_seconds": server.startup_seconds,
+                "error": server.error,
+            }
+            for server in self.servers
+        ]
+
     async def cleanup_servers(self) -> None:
         """Clean up all servers properly."""
-        for server in self.servers:
+        # Newest first: each server's stdio connection holds a cancel scope nested in the
+        # previous one's, and anyio only allows leaving them in reverse order
+        for server in reversed(self.servers):
             try:
                 await server.cleanup()
             except (asyncio.CancelledError, Exception) as e:
-                logging.warning(f"Warning during cleanup of server {server.name}: {e}")
+                logger.warning(f"Warning during cleanup of server {server.name}: {e}")
                 # Don't propagate the CancelledError, as we're already cleaning up
 
     async def cleanup(self) -> None:
@@ -106,9 +196,9 @@ class MCPClient:
             try:
                 await self.exit_stack.aclose()
             except (asyncio.CancelledError, Exception) as e:
-                logging.warning(f"Warning during exit stack cleanup: {e}")
+                logger.warning(f"Warning during exit stack cleanup: {e}")
         except Exception as e:
-            logging.warning(f"Warning during final cleanup: {e}")
+            logger.warning(f"Warning during final cleanup: {e}")
 
 
 class MCPServer: #CLASS FOR EACH MCP SERVER
@@ -121,6 +211,14 @@ class MCPServer: #CLASS FOR EACH MCP SERVER
         self.session: ClientSession | None = None #Store Connection of client
         self._cleanup_lock: asyncio.Lock = asyncio.Lock() #CLEANUP LOCK
         self.exit_stack: AsyncExitStack = AsyncExitStack() #EXIT STACK
+        self.status: str = "pending" #pending, starting, ready, failed or skipped
+        self.error: str | None = None #why startup failed
+        self.tool_count: int = 0
+        self.startup_seconds: float | None = None
+        self.mcp_tools: List[MCPTool] = [] #the server's tools as listed (for tool selection)
+        self._pending_notifications: set[asyncio.Task] = set() #cancel notifications being sent
+        # calls in flight at once on this server's session (1 = one request at a time)
+        self.slots = ServerSlots(name, config.get("maxConcurrentCalls", DEFAULT_MAX_CONCURRENT_CALLS))
 
     async def initialize(self) -> None:
         """Initialize the server connection."""
@@ -137,8 +235,9 @@ class MCPServer: #CLASS FOR EACH MCP SERVER
             if self.config["command"] == "node":
                 module_path = self.config["args"][0]
                 if not os.path.exists(module_path):
-                    logging.warning(f"Module not found at {module_path} for server {self.name}")
-                    logging.warning(f"Skipping server {self.name}")
+                    self.error = f"Module not found at {module_path}"
+                    logger.warning(f"Module not found at {module_path} for server {self.name}")
+                    logger.warning(f"Skipping server {self.name}")
                     return
             
             #next is identifying the parameters of the server
@@ -150,7 +249,7 @@ class MCPServer: #CLASS FOR EACH MCP SERVER
                 else None,
             )
             
-            logging.debug(f"Starting MCP server: {self.name} with command: {command} {' '.join(self.config['args'])}")
+            logger.debug(f"Starting MCP server: {self.name} with command: {command} {' '.join(self.config['args'])}")
             
             #Make the connection to the server via stdio
             stdio_transport = await self.exit_stack.enter_async_context(
@@ -158,20 +257,21 @@ class MCPServer: #CLASS FOR EACH MCP SERVER
             )
             read, write = stdio_transport #read and write to the server
             
-            logging.debug(f"Server {self.name} stdio connection established, creating session")
+            logger.debug(f"Server {self.name} stdio connection established, creating session")
             session = await self.exit_stack.enter_async_context(
-                ClientSession(read, write)
+                ClientSession(read, RequestIdTap(write)) # the tap gives cancel notifications their request id
             )
             
-            logging.debug(f"Initializing session for server: {self.name}")
+            logger.debug(f"Initializing session for server: {self.name}")
             await session.initialize() # finally initialize the session
             self.session = session #store the *session*
-            logging.debug(f"Server {self.name} initialized successfully")
+            logger.debug(f"Server {self.name} initialized successfully")
         except Exception as e:
-            logging.error(f"Error initializing server {self.name}: {e}")
-            logging.error(f"Error type: {type(e).__name__}")
+            self.error = str(e)
+            logger.error(f"Error initializing server {self.name}: {e}")
+            logger.error(f"Error type: {type(e).__name__}")
             import traceback
-            logging.error(f"Traceback: {traceback.format_exc()}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
             await self.cleanup()
             # Instead of raising the exception, just return
             # This allows other servers to continue working
@@ -183,7 +283,7 @@ class MCPServer: #CLASS FOR EACH MCP SERVER
         try:
             # If session wasn't initialized properly, return empty list
             if not self.session:
-                logging.warning(f"Session for server {self.name} not initialized, skipping tool creation")
+                logger.warning(f"Session for server {self.name} not initialized, skipping tool creation")
                 return []
                 
             tools = (await self.session.list_tools()).tools #get list of tools
@@ -191,26 +291,84 @@ class MCPServer: #CLASS FOR EACH MCP SERVER
             # Filter tools based on allowedTools configuration
             allowed_tools = self.config.get("allowedTools", None)
             if allowed_tools is not None:
-                logging.info(f"Filtering tools for {self.name} based on allowedTools: {allowed_tools}")
+                logger.info(f"Filtering tools for {self.name} based on allowedTools: {allowed_tools}")
                 tools = [tool for tool in tools if tool.name in allowed_tools]
-                logging.info(f"Server {self.name} has {len(tools)} allowed tools out of available tools")
+                logger.info(f"Server {self.name} has {len(tools)} allowed tools out of available tools")
             else:
-                logging.info(f"No allowedTools specified for {self.name}, loading all {len(tools)} tools")
+                logger.info(f"No allowedTools specified for {self.name}, loading all {len(tools)} tools")
+            self.mcp_tools = tools
                 
             return [self.create_tool_instance(tool) for tool in tools] #convert each tool to a pydantic_ai Tool
         except Exception as e:
-            logging.error(f"Error listing tools for server {self.name}: {e}")
-            logging.error(f"Error type: {type(e).__name__}")
+            logger.error(f"Error listing tools for server {self.name}: {e}")
+            logger.error(f"Error type: {type(e).__name__}")
             import traceback
-            logging.error(f"Traceback: {traceback.format_exc()}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
             # Return empty list if we can't get tools
             return []
 
 # actual excute the tool
     def create_tool_instance(self, tool: MCPTool) -> PydanticTool:#we take mcp tool -> pydantic tool
         """Initialize a Pydantic AI Tool from an MCP Tool."""
-        async def execute_tool(**kwargs: Any) -> Any:
-            return await self.session.call_tool(tool.name, arguments=kwargs)
+        tool_steps.register(tool.name)
+        cache_ttl = tool_ttl(self.name, self.config, tool.name)
+        output_shape = OutputShape.from_config(self.config, tool.name)
+
+        # The calls of one model step run as parallel tasks; each waits for a slot on its
+        # server, then all of them share the server's session (see tool_dispatch.py).
+        # Results are shaped (see tool_output.py) before they are cached and reach the model.
+        # Results of tools with a cache TTL are reused, and identical calls in flight joined
+        async def execute_tool(ctx: RunContext, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            outcome = "error"
+            session = self.session
+            step = tool_steps.start(ctx)
+            deadline = current_deadline()
+
+            async def call_tool() -> Any:
+                # Runs once for all the callers sharing it, so it tells the server to stop
+                # itself, once none of them is waiting anymore
+                with sent_request() as sent:
+                    try:
+                        async with self.slots.slot():
+                            result = await session.call_tool(tool.name, arguments=kwargs)
+                        return output_shape.apply(self.name, tool.name, result)
+                    except asyncio.CancelledError:
+                        out_of_time = deadline is not None and not deadline.allows_tool_call()
+                        self._notify_cancelled(session, sent.id, tool.name,
+                                               "Request deadline reached" if out_of_time else "Client disconnected")
+                        raise
+
+            timeout = None
+            try:
+                if deadline is not None and not deadline.allows_tool_call():
+                    outcome = "skipped"
+                    deadline.record("tool_skipped")
+                    return skipped_tool_message(tool.name)
+                # Registered with the agent run, so a disconnected client cancels this call too
+                with track_current_task(), span("mcp.call_tool", server=self.name, tool=tool.name) as tool_span:
+                    # Only use the time the request's deadline leaves for tools
+                    timeout = deadline.tool_budget() if deadline is not None else None
+                    key = make_tool_key(self.name, tool.name, kwargs)
+                    result, source = await asyncio.wait_for(tool_cache.call(key, cache_ttl, call_tool), timeout)
+                    outcome = "error" if getattr(result, "isError", False) else "cached" if source == "hit" else "ok"
+                    tool_span.set_attribute("outcome", outcome)
+                    tool_span.set_attribute("cache", source)
+                return result
+            except asyncio.TimeoutError:
+                if deadline is None:
+                    raise
+                outcome = "timeout"
+                deadline.record("tool_timeout")
+                return timed_out_tool_message(tool.name, timeout)
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                TOOL_CALL_SECONDS.observe(elapsed, server=self.name, tool=tool.name)
+                TOOL_CALLS_TOTAL.inc(server=self.name, tool=tool.name, outcome=outcome)
+                tool_steps.finish(step, elapsed)
 
         async def prepare_tool(ctx: RunContext, tool_def: ToolDefinition) -> ToolDefinition | None:
             # Make sure the input schema has the proper format for pydantic-ai
@@ -239,10 +397,24 @@ class MCPServer: #CLASS FOR EACH MCP SERVER
             execute_tool,
             name=tool.name,
             description=tool.description or "",
-            takes_ctx=False,
+            takes_ctx=True,
             prepare=prepare_tool
         )
 
+    def _notify_cancelled(self, session: ClientSession, request_id: Any, tool_name: str,
+                          reason: str = "Client disconnected") -> None:
+        """Tell the server to stop working on a tool call nobody is waiting for anymore."""
+        if session is None or request_id is None:
+            return
+        notification = ClientNotification(CancelledNotification(
+            params=CancelledNotificationParams(requestId=request_id, reason=reason),
+        ))
+        # Sent from its own task: the task that made the call is being cancelled
+        task = asyncio.ensure_future(session.send_notification(notification))
+        self._pending_notifications.add(task)
+        task.add_done_callback(self._pending_notifications.discard)
+        logger.info(f"Cancelled tool call {tool_name} on server {self.name}: {reason}")
+
     #Clean up the server
     async def cleanup(self) -> None:
         """Clean up server resources."""
@@ -251,8 +423,8 @@ class MCPServer: #CLASS FOR EACH MCP SERVER
                 try:
                     await self.exit_stack.aclose()
                 except (asyncio.CancelledError, Exception) as e:
-                    logging.warning(f"Warning while closing exit stack for server {self.name}: {e}")
+                    logger.warning(f"Warning while closing exit stack for server {self.name}: {e}")
                 self.session = None
                 self.stdio_context = None
             except Exception as e:
-                logging.error(f"Error during cleanup of server {self.name}: {e}")  
\ No newline at end of file
+                logger.error(f"Error during cleanup of server {self.name}: {e}")  
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""
+Metrics for the Chat Pipeline
+
+A small in-process registry of counters, gauges and histograms, rendered in the
+Prometheus text format by the /metrics endpoint. Each stage of a chat turn (receipt
+context fetch, system prompt assembly, LLM round trips, MCP tool calls,
+post-processing, the whole request) records its latency here, so we can see where
+slow requests spend their time.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Latency buckets in seconds, from a cached lookup up to a long multi-tool Gemini run
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A value that only goes up (requests served, errors, ...)."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down (queue depth, cache entries, ...)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies) over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # per label set: bucket counts (not cumulative), sum, count
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe how long the block takes (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        """(count, sum) for each label set, e.g. to report means outside of Prometheus."""
+        with self._lock:
+            return {key: (series[2], series[1]) for key, series in self._series.items()}
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (bucket_counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Holds the metrics and renders them in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            # A module imported under two names (api / src.api) registers its metrics twice
+            if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                raise ValueError(f"Metric {metric.name} is already registered with a different type or labels")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """Run ``collector`` before each render, to copy stats kept elsewhere into gauges."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# Per-stage latency of a chat turn
+RECEIPT_CONTEXT_FETCH_SECONDS = histogram(
+    "finpal_receipt_context_fetch_seconds", "Time to fetch the receipt context from Firestore")
+SYSTEM_PROMPT_SECONDS = histogram(
+    "finpal_system_prompt_seconds", "Time to assemble the system prompt (including the receipt context)")
+LLM_REQUEST_SECONDS = histogram(
+    "finpal_llm_request_seconds", "Duration of one LLM round trip", ["model", "mode"])
+LLM_REQUESTS_TOTAL = counter(
+    "finpal_llm_requests_total", "LLM round trips by outcome", ["model", "mode", "outcome"])
+TOOL_CALL_SECONDS = histogram(
+    "finpal_tool_call_seconds", "Duration of one MCP tool call", ["server", "tool"])
+TOOL_CALLS_TOTAL = counter(
+    "finpal_tool_calls_total", "MCP tool calls by outcome", ["server", "tool", "outcome"])
+POSTPROCESS_SECONDS = histogram(
+    "finpal_postprocess_seconds", "Time to clean up the final response text",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+REQUEST_SECONDS = histogram(
+    "finpal_request_seconds", "Total time to answer a chat request", ["endpoint"])
+REQUESTS_TOTAL = counter(
+    "finpal_requests_total", "Chat requests by outcome", ["endpoint", "outcome"])
+ADMISSION_WAIT_SECONDS = histogram(
+    "finpal_admission_wait_seconds", "Time a request waited for an agent slot")
+AGENT_RUNS_CANCELLED_TOTAL = counter(
+    "finpal_agent_runs_cancelled_total", "Agent runs cancelled before finishing because the client went away")
+DEADLINE_EVENTS_TOTAL = counter(
+    "finpal_deadline_events_total", "Work cut short by request deadlines", ["event"])
+PROMPT_CACHE_EVENTS_TOTAL = counter(
+    "finpal_prompt_cache_events_total",
+    "Gemini context cache use: hit, miss, bypass, created, create_failed, invalidated", ["event"])
+PROMPT_PREFIX_TOKENS = histogram(
+    "finpal_prompt_prefix_tokens", "Tokens in the stable system prompt prefix sent (or referenced) per LLM call",
+    ["cached"], buckets=(512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072))
+INTENT_ROUTES_TOTAL = counter(
+    "finpal_intent_routes_total", "Chat questions by where they were answered (a local intent, or llm)", ["intent"])
+TOOL_SELECTIONS_TOTAL = counter(
+    "finpal_tool_selections_total", "Agent runs by the MCP tools offered to them: all, subset or none", ["mode"])
+TOOL_SCHEMA_TOKENS_TOTAL = counter(
+    "finpal_tool_schema_tokens_total",
+    "Estimated tool declaration tokens per agent run, offered to the model or withheld", ["offered"])
+TOOL_QUEUE_SECONDS = histogram(
+    "finpal_tool_queue_seconds", "Time an MCP tool call waited for one of its server's in-flight slots", ["server"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+TOOL_STEP_SECONDS = histogram(
+    "finpal_tool_step_seconds", "Wall time of the MCP tool calls of one model step, run concurrently")
+TOOL_STEP_SERIAL_SECONDS_TOTAL = counter(
+    "finpal_tool_step_serial_seconds_total", "Summed duration of the MCP tool calls of each model step")
+TOOL_CACHE_EVENTS_TOTAL = counter(
+    "finpal_tool_cache_events_total",
+    "MCP tool result cache use: hit, miss, shared, stored, evicted, expired, uncacheable", ["event"])
+TOOL_OUTPUT_BYTES_TOTAL = counter(
+    "finpal_tool_output_bytes_total",
+    "Bytes of MCP tool output as returned (raw) and as passed on to the model (shaped)", ["server", "stage"])
+MODEL_ROUTES_TOTAL = counter(
+    "finpal_model_routes_total", "Agent turns by the model tier picked for them, and why", ["tier", "reason"])
+MODEL_ESCALATIONS_TOTAL = counter(
+    "finpal_model_escalations_total", "Flash turns run again on pro, by what was wrong with the answer", ["reason"])
+MODEL_RUN_SECONDS = histogram(
+    "finpal_model_run_seconds", "Duration of one agent run (all its model and tool calls), by model", ["model"])
+MODEL_COST_USD_TOTAL = counter(
+    "finpal_model_cost_usd_total", "Estimated LLM spend in USD from token usage, by model", ["model"])
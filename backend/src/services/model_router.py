@@ -0,0 +1,218 @@
+"""
+Model Tiering for Agent Runs
+
+Every chat turn used to go to MODEL_CHOICE (a pro model), greetings and one-line lookups
+included. The router holds two tiers, "flash" (FAST_MODEL_CHOICE) and "pro" (MODEL_CHOICE),
+and picks one per turn from a cheap estimate of how hard the question is:
+
+- complex questions (long, or asking to compare, plan, forecast, advise ...) go to pro
+- questions needing tools from two or more servers (per tool_selection) go to pro
+- everything else, including receipt lookups the intent router couldn't answer itself, goes
+  to flash
+
+When a flash answer fails validation (empty, tool commands written as text instead of
+called, no HTML answer template), or the flash model itself misbehaves (UnexpectedModelBehavior),
+the turn is run again on pro. Other errors, tool failures included, are raised as they are:
+running the turn again would repeat its tool calls for nothing.
+Runs, latency, tokens and an estimated cost are kept per model. Prices are USD per million
+input/output tokens (MODEL_PRICES overrides the built-in list, as JSON).
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from pydantic_ai.exceptions import UnexpectedModelBehavior
+
+from src.services.deadline import current_deadline
+from src.services.intent_router import detect_intent
+from src.services.metrics import MODEL_COST_USD_TOTAL, MODEL_ESCALATIONS_TOTAL, MODEL_ROUTES_TOTAL, MODEL_RUN_SECONDS
+from src.services.response_processor import starts_with_tool_code
+from src.services.tool_selection import tool_selector
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# (input, output) USD per million tokens, by model name prefix (the longest match wins)
+DEFAULT_PRICES = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gemini-1.5-flash": (0.075, 0.30),
+}
+
+
+def load_prices() -> Dict[str, Tuple[float, float]]:
+    prices = dict(DEFAULT_PRICES)
+    raw = os.environ.get("MODEL_PRICES")
+    if raw:
+        try:
+            prices.update({name: (float(pair[0]), float(pair[1])) for name, pair in json.loads(raw).items()})
+        except (ValueError, TypeError, IndexError, AttributeError) as e:
+            logger.error('Ignoring MODEL_PRICES, expected {"model": [input, output]}: %s', e)
+    return prices
+
+
+def answer_problem(output: Any) -> Optional[str]:
+    """Why an answer isn't good enough to send (None if it is)."""
+    if not isinstance(output, str) or not output.strip():
+        return "empty"
+    text = output.strip().removeprefix("```html").strip()
+    if starts_with_tool_code(text):
+        return "tool_code"
+    if "<div" not in text:
+        return "unformatted"
+    return None
+
+
+class Route:
+    """The tier picked for one question, and why."""
+
+    def __init__(self, tier: str, reason: str) -> None:
+        self.tier = tier
+        self.reason = reason
+
+
+class ModelRouter:
+    """Picks a model tier per turn, escalates failed flash answers, and keeps per-model costs."""
+
+    def __init__(self, model_names: Dict[str, str], enabled: bool = True, escalate: bool = True,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None, selector: Any = None) -> None:
+        # Without a flash model everything goes to pro
+        self.model_names = {tier: name for tier, name in model_names.items() if name}
+        self.enabled = enabled and "flash" in self.model_names
+        self.escalate = escalate
+        self.prices = prices if prices is not None else load_prices()
+        self.selector = selector if selector is not None else tool_selector
+        self._build: Optional[Callable[[str], Any]] = None
+        self._models: Dict[str, Any] = {}
+        self.routes: Dict[str, int] = {}
+        self.escalations: Dict[str, int] = {}
+        self.models: Dict[str, Dict[str, float]] = {}
+
+    def configure(self, build: Callable[[str], Any]) -> None:
+        """Set how a model is built from its name (models are built on first use)."""
+        self._build = build
+        self._models = {}
+
+    def model(self, tier: str) -> Any:
+        """The model of a tier (None before configure(): the agent's own model is used)."""
+        if self._build is None:
+            return None
+        if tier not in self._models:
+            self._models[tier] = self._build(self.model_names[tier])
+        return self._models[tier]
+
+    def choose(self, question: str) -> Route:
+        if not self.enabled:
+            return Route("pro", "single_tier")
+        if self.selector.is_complex(question):
+            return Route("pro", "complex")
+        selection = self.selector.select(question)
+        if self.selector.enabled:
+            # Tools that are offered to every question don't say anything about this one
+            profiles = self.selector.profiles
+            servers = {profiles[name].server for name in selection.tools if profiles[name].select != "always"}
+            if len(servers) >= 2:
+                return Route("pro", "tools")
+        return Route("flash", "intent" if detect_intent(question) else "simple")
+
+    def cost(self, model_name: str, request_tokens: int, response_tokens: int) -> float:
+        prefix = max((name for name in self.prices if model_name.startswith(name)), key=len, default=None)
+        if prefix is None:
+            return 0.0
+        input_price, output_price = self.prices[prefix]
+        return (request_tokens * input_price + response_tokens * output_price) / 1_000_000
+
+    def record(self, tier: str, seconds: float, result: Any = None, failed: bool = False) -> None:
+        """Count one agent run on ``tier``'s model (``result`` for its token use)."""
+        model_name = self.model_names.get(tier, tier)
+        usage = result.usage() if result is not None and hasattr(result, "usage") else None
+        request_tokens = (usage.request_tokens or 0) if usage is not None else 0
+        response_tokens = (usage.response_tokens or 0) if usage is not None else 0
+        cost = self.cost(model_name, request_tokens, response_tokens)
+        counts = self.models.setdefault(model_name, {
+            "tier": tier, "runs": 0, "failed": 0, "seconds": 0.0,
+            "request_tokens": 0, "response_tokens": 0, "cost_usd": 0.0,
+        })
+        counts["runs"] += 1
+        counts["failed"] += failed
+        counts["seconds"] += seconds
+        counts["request_tokens"] += request_tokens
+        counts["response_tokens"] += response_tokens
+        counts["cost_usd"] += cost
+        MODEL_RUN_SECONDS.observe(seconds, model=model_name)
+        if cost:
+            MODEL_COST_USD_TOTAL.inc(cost, model=model_name)
+
+    def route(self, question: str) -> Route:
+        """Choose the tier for a turn and count it."""
+        route = self.choose(question)
+        self.routes[route.tier] = self.routes.get(route.tier, 0) + 1
+        MODEL_ROUTES_TOTAL.inc(tier=route.tier, reason=route.reason)
+        return route
+
+    async def run(self, agent: Any, question: str, **kwargs: Any) -> Any:
+        """``agent.run`` on the chosen tier's model, run again on pro if a flash answer fails validation."""
+        route = self.route(question)
+        tier = route.tier
+        while True:
+            start = time.perf_counter()
+            try:
+                result = await agent.run(question, model=self.model(tier), **kwargs)
+            except UnexpectedModelBehavior as e:
+                self.record(tier, time.perf_counter() - start, failed=True)
+                if not self._can_escalate(tier):
+                    raise
+                problem = "error"
+                logger.warning("%s run failed (%s), running it again on pro", self.model_names[tier], e)
+            except Exception:
+                self.record(tier, time.perf_counter() - start, failed=True)
+                raise
+            else:
+                problem = answer_problem(getattr(result, "output", None))
+                self.record(tier, time.perf_counter() - start, result, failed=problem is not None)
+                if problem is None or not self._can_escalate(tier):
+                    return result
+                logger.info("%s answer failed validation (%s), running it again on pro", self.model_names[tier], problem)
+            self.escalations[problem] = self.escalations.get(problem, 0) + 1
+            MODEL_ESCALATIONS_TOTAL.inc(reason=problem)
+            tier = "pro"
+
+    def _can_escalate(self, tier: str) -> bool:
+        if not self.escalate or tier == "pro":
+            return False
+        # Only if the request's deadline leaves time for another run
+        deadline = current_deadline()
+        return deadline is None or deadline.allows_tool_call()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "tiers": dict(self.model_names),
+            "routes": dict(self.routes),
+            "escalations": dict(self.escalations),
+            "models": {
+                name: {
+                    **{key: round(value, 6) if isinstance(value, float) else value for key, value in counts.items()},
+                    "mean_seconds": round(counts["seconds"] / counts["runs"], 3) if counts["runs"] else 0.0,
+                }
+                for name, counts in self.models.items()
+            },
+            "cost_usd": round(sum(counts["cost_usd"] for counts in self.models.values()), 6),
+        }
+
+
+model_router = ModelRouter(
+    {
+        "flash": os.environ.get("FAST_MODEL_CHOICE", "gemini-2.5-flash").replace("google-gla:", ""),
+        "pro": os.environ.get("MODEL_CHOICE", "gemini-2.5-pro-preview-03-25").replace("google-gla:", ""),
+    },
+    enabled=os.environ.get("MODEL_ROUTER", "true").lower() not in ("0", "false", "no"),
+    escalate=os.environ.get("MODEL_ESCALATION", "true").lower() not in ("0", "false", "no"),
+)
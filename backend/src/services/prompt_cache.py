@@ -0,0 +1,277 @@
+"""
+Gemini Context Caching for the Stable Prompt Prefix
+
+The system prompt is laid out as a stable prefix (the versioned FinPal instructions
+plus the receipt snapshot) followed by a small per-turn suffix. The prefix, together
+with the tool declarations, is registered once with Gemini's cachedContents API, and
+later calls reference the cached content instead of resending it. A changed receipt
+snapshot (or tool set) gives a different prefix and so a new cached content; the one
+it replaces is deleted.
+
+This works at the HTTP layer: ContextCacheTransport sits under the Gemini provider's
+httpx client and rewrites generateContent / streamGenerateContent bodies, so the
+pydantic-ai model code is left as it is. A prefix seen for the first time is sent in
+full while its cached content is created in the background; a call that fails because
+its cached content is gone is retried once uncached.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from src.services.metrics import PROMPT_CACHE_EVENTS_TOTAL, PROMPT_PREFIX_TOKENS
+from src.services.tracing import current_span
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Bump when the instruction text changes (shows up in the prompt and the cache display names)
+PROMPT_VERSION = "4"
+
+CHARS_PER_TOKEN = 4
+GENERATE_METHODS = (":generateContent", ":streamGenerateContent")
+# Request fields Gemini only accepts inside the cached content once one is referenced
+CACHED_FIELDS = ("systemInstruction", "tools", "toolConfig")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def model_name(request: httpx.Request) -> str:
+    """"gemini-2.5-pro" from .../models/gemini-2.5-pro:generateContent."""
+    return request.url.path.rsplit("/", 1)[-1].split(":", 1)[0]
+
+
+def key_group(model: str, body: Dict[str, Any]) -> str:
+    return json.dumps([model, body.get("tools"), body.get("toolConfig")], sort_keys=True)
+
+
+def cached_content_rejected(response: httpx.Response) -> bool:
+    """Whether a (read) error response says the cached content is gone, rather than the request being bad."""
+    if response.status_code in (403, 404):
+        return True
+    return response.status_code == 400 and "cachedcontent" in response.text.lower().replace(" ", "")
+
+
+class CachedPrefix:
+    """A prefix registered with the cachedContents API."""
+
+    def __init__(self, name: str, group: str, tokens: int, expires_at: float) -> None:
+        self.name = name
+        self.group = group  # model + tools: a new prefix in the same group replaces this one
+        self.tokens = tokens
+        self.expires_at = expires_at
+
+
+class ContextCache:
+    """Cached contents by prefix key, with hit/miss stats."""
+
+    def __init__(self, enabled: bool = True, ttl_seconds: int = 3600, max_entries: int = 8,
+                 min_tokens: int = 1024, retry_seconds: float = 300, refresh_margin: float = 60) -> None:
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+        self.retry_seconds = retry_seconds  # wait before trying again to cache a prefix Gemini refused
+        self.refresh_margin = refresh_margin  # stop using a cached content this close to its expiry
+        self._entries: "OrderedDict[str, CachedPrefix]" = OrderedDict()
+        self._failed: Dict[str, float] = {}  # key -> time to retry
+        self._creating: Dict[str, asyncio.Task] = {}
+        self.counts = {event: 0 for event in ("hit", "miss", "bypass", "created", "create_failed", "invalidated")}
+        self.last_prefix_tokens = 0
+
+    def record(self, event: str) -> None:
+        self.counts[event] += 1
+        PROMPT_CACHE_EVENTS_TOTAL.inc(event=event)
+
+    def lookup(self, key: str) -> Optional[CachedPrefix]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at - self.refresh_margin <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def should_create(self, key: str) -> bool:
+        return key not in self._creating and self._failed.get(key, 0) <= time.time()
+
+    def store(self, key: str, entry: CachedPrefix) -> list:
+        """Keep ``entry``; return the entries it replaces (same group, or over the size limit)."""
+        replaced = [self._entries.pop(other_key) for other_key, other in list(self._entries.items())
+                    if other.group == entry.group]
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            replaced.append(self._entries.popitem(last=False)[1])
+        return replaced
+
+    def invalidate(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self.record("invalidated")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counts["hit"] + self.counts["miss"]
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "creating": len(self._creating),
+            **self.counts,
+            "hit_rate": round(self.counts["hit"] / lookups, 4) if lookups else 0.0,
+            "prefix_tokens": self.last_prefix_tokens,
+            "prompt_version": PROMPT_VERSION,
+        }
+
+
+class ContextCacheTransport(httpx.AsyncBaseTransport):
+    """httpx transport for the Gemini client that swaps the stable prefix for a cached content."""
+
+    def __init__(self, cache: ContextCache, inner: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        self.cache = cache
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        prepared = self.prepare(request) if self.cache.enabled else None
+        if prepared is None:
+            return await self.inner.handle_async_request(request)
+
+        key, body, prefix_tokens = prepared
+        entry = self.cache.lookup(key)
+        self.cache.last_prefix_tokens = entry.tokens if entry else prefix_tokens
+        PROMPT_PREFIX_TOKENS.observe(self.cache.last_prefix_tokens, cached=str(entry is not None).lower())
+        active = current_span()
+        if active is not None:
+            active.set_attribute("prompt_cache", "hit" if entry else "miss")
+        if entry is None:
+            self.cache.record("miss")
+            if self.cache.should_create(key):
+                self.start_create(key, request, body)
+            return await self.inner.handle_async_request(request)
+
+        self.cache.record("hit")
+        response = await self.inner.handle_async_request(self.with_cached_content(request, body, entry))
+        if response.status_code in (400, 403, 404):
+            await response.aread()
+            if cached_content_rejected(response):
+                # Expired or deleted on Gemini's side: forget it and send the prompt in full
+                logger.warning("Cached content %s was rejected (%s), retrying without it", entry.name, response.status_code)
+                await response.aclose()
+                self.cache.invalidate(key)
+                return await self.inner.handle_async_request(request)
+        return response
+
+    def prepare(self, request: httpx.Request) -> Optional[Tuple[str, Dict[str, Any], int]]:
+        """(prefix key, request body, prefix tokens) for a cacheable generate call, else None."""
+        if request.method != "POST" or not request.url.path.endswith(GENERATE_METHODS):
+            return None
+        try:
+            body = json.loads(request.content)
+        except ValueError:
+            return None
+        parts = (body.get("systemInstruction") or {}).get("parts") or []
+        if "cachedContent" in body or not parts or "text" not in parts[0]:
+            return None
+        prefix_tokens = estimate_tokens(parts[0]["text"])
+        if prefix_tokens < self.cache.min_tokens:
+            self.cache.record("bypass")
+            return None
+        group = key_group(model_name(request), body)
+        key = hashlib.sha256(f"{group}\x1f{parts[0]['text']}".encode("utf-8")).hexdigest()
+        return key, body, prefix_tokens
+
+    @staticmethod
+    def with_cached_content(request: httpx.Request, body: Dict[str, Any], entry: CachedPrefix) -> httpx.Request:
+        """The request with the prefix and tools replaced by a reference to ``entry``."""
+        rewritten = {name: value for name, value in body.items() if name not in CACHED_FIELDS}
+        rewritten["cachedContent"] = entry.name
+        # The per-turn suffix can't stay in systemInstruction: lead the first user turn with it
+        suffix = body["systemInstruction"]["parts"][1:]
+        if suffix:
+            contents = list(rewritten.get("contents") or [])
+            if contents and contents[0].get("role") == "user":
+                contents[0] = {**contents[0], "parts": [*suffix, *contents[0].get("parts", [])]}
+            else:
+                contents.insert(0, {"role": "user", "parts": suffix})
+            rewritten["contents"] = contents
+        headers = [(name, value) for name, value in request.headers.multi_items() if name.lower() != "content-length"]
+        return httpx.Request(request.method, request.url, headers=headers, content=json.dumps(rewritten).encode("utf-8"),
+                             extensions=request.extensions)
+
+    def start_create(self, key: str, request: httpx.Request, body: Dict[str, Any]) -> None:
+        task = asyncio.create_task(self.create(key, request, body))
+        self.cache._creating[key] = task
+        task.add_done_callback(lambda _: self.cache._creating.pop(key, None))
+
+    async def create(self, key: str, request: httpx.Request, body: Dict[str, Any]) -> None:
+        """Register the prefix and tools of ``body`` as a cached content."""
+        model = model_name(request)
+        payload: Dict[str, Any] = {
+            "model": f"models/{model}",
+            "displayName": f"finpal-v{PROMPT_VERSION}-{key[:12]}",
+            "systemInstruction": {"parts": body["systemInstruction"]["parts"][:1]},
+            "ttl": f"{self.cache.ttl_seconds}s",
+        }
+        tools = body.get("tools")
+        if tools:
+            payload["tools"] = [tools] if isinstance(tools, dict) else tools
+        if body.get("toolConfig"):
+            payload["toolConfig"] = body["toolConfig"]
+        try:
+            response = await self.send("POST", request, "", payload)
+            data = json.loads(await response.aread())
+            if response.status_code != 200:
+                raise RuntimeError(f"{response.status_code}: {str(data)[:300]}")
+        except Exception as e:
+            self.cache._failed[key] = time.time() + self.cache.retry_seconds
+            self.cache.record("create_failed")
+            logger.warning("Could not cache the prompt prefix (retrying in %ss): %s", self.cache.retry_seconds, e)
+            return
+        tokens = (data.get("usageMetadata") or {}).get("totalTokenCount") or estimate_tokens(json.dumps(payload))
+        entry = CachedPrefix(data["name"], group=key_group(model, body), tokens=tokens,
+                             expires_at=time.time() + self.cache.ttl_seconds)
+        self.cache.record("created")
+        logger.info("Cached prompt prefix as %s (%s tokens)", entry.name, tokens)
+        for replaced in self.cache.store(key, entry):
+            try:
+                await (await self.send("DELETE", request, "/" + replaced.name.rsplit("/", 1)[-1])).aclose()
+            except Exception as e:
+                logger.debug("Could not delete cached content %s: %s", replaced.name, e)
+
+    async def send(self, method: str, request: httpx.Request, suffix: str, payload: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        """Call the cachedContents endpoint next to the models endpoint ``request`` went to."""
+        path = request.url.path.rsplit("/models/", 1)[0] + "/cachedContents" + suffix
+        headers = {name: value for name, value in request.headers.items()
+                   if name.lower() in ("x-goog-api-key", "authorization", "user-agent")}
+        content = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        if payload is not None:
+            headers["content-type"] = "application/json"
+        return await self.inner.handle_async_request(
+            httpx.Request(method, request.url.copy_with(path=path, query=None), headers=headers, content=content))
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+context_cache = ContextCache(
+    enabled=_env_flag("GEMINI_CONTEXT_CACHE", "true"),
+    ttl_seconds=int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", 3600)),
+    max_entries=int(os.environ.get("GEMINI_CONTEXT_CACHE_MAX_ENTRIES", 8)),
+    min_tokens=int(os.environ.get("GEMINI_CONTEXT_CACHE_MIN_TOKENS", 1024)),
+)
+
+
+def cached_http_client() -> httpx.AsyncClient:
+    """HTTP client for a Gemini provider that uses the context cache."""
+    return httpx.AsyncClient(transport=ContextCacheTransport(context_cache), timeout=httpx.Timeout(600, connect=5))
@@ -6,55 +6,77 @@ import asyncio
 import pathlib
 import sys
 import os
-import traceback
+import logging
 import psutil  # Add this import for memory monitoring
 from typing import TypedDict, Dict, Any, List
 import time
 import json
+import hashlib
+import dataclasses
+from contextlib import asynccontextmanager
+from datetime import datetime
 
 # Set up paths to make imports work
 current_dir = pathlib.Path(__file__).parent.resolve()
 backend_dir = current_dir.parent.parent
 sys.path.insert(0, str(backend_dir))
 
-print(f"Current directory: {current_dir}")
-print(f"Backend directory: {backend_dir}")
-print(f"Current sys.path: {sys.path}")
+from src.services.logging_config import lazy, setup_logging
+
+logger = logging.getLogger(__name__)
+
+logger.debug("Current directory: %s", current_dir)
+logger.debug("Backend directory: %s", backend_dir)
+logger.debug("Current sys.path: %s", sys.path)
 
 try:
-    from pydantic_ai import Agent
+    from pydantic_ai import Agent, RunContext
+    from pydantic_ai.messages import ModelRequest, SystemPromptPart, UserPromptPart
     from pydantic_ai.models.gemini import GeminiModel
     from pydantic_ai.providers.google_gla import GoogleGLAProvider
-    print("Successfully imported pydantic_ai modules")
+    import httpx
+    logger.debug("Successfully imported pydantic_ai modules")
 except ImportError as e:
-    print(f"Error importing pydantic_ai: {e}")
-    print("Error: Required packages not found. Please install with:")
-    print("pip install pydantic-ai python-dotenv rich")
+    logger.error("Error importing pydantic_ai: %s", e)
+    logger.error("Required packages not found. Please install with:")
+    logger.error("pip install pydantic-ai python-dotenv rich")
     sys.exit(1)
 
+from src.services.deadline import ANSWER_NOW_INSTRUCTION, current_deadline
+from src.services.prompt_cache import PROMPT_VERSION, cached_http_client, context_cache
+from src.services.metrics import (
+    LLM_REQUEST_SECONDS,
+    LLM_REQUESTS_TOTAL,
+    RECEIPT_CONTEXT_FETCH_SECONDS,
+    SYSTEM_PROMPT_SECONDS,
+)
+from src.services.model_router import model_router
+from src.services.tool_selection import prompt_text, tool_selector
+from src.services.tracing import span
+
 # Import the MCPClient
 MCPClient = None
 try:
     # First try the dot import (when running as module)
-    print("Trying dot import for MCPClient...")
+    logger.debug("Trying dot import for MCPClient...")
     from .mcp_client import MCPClient
-    print("Dot import successful")
+    logger.debug("Dot import successful")
 except (ImportError, ValueError) as e:
-    print(f"Dot import failed: {e}")
+    logger.debug("Dot import failed: %s", e)
     try:
         # Then try absolute import (when running as script)
-        print("Trying absolute import for MCPClient...")
+        logger.debug("Trying absolute import for MCPClient...")
         from services.mcp_client import MCPClient
-        print("Absolute import successful")
+        logger.debug("Absolute import successful")
     except (ImportError, ValueError) as e:
-        print(f"Absolute import failed: {e}")
+        logger.debug("Absolute import failed: %s", e)
         try:
-            print("Trying src.services.mcp_client import...")
+            logger.debug("Trying src.services.mcp_client import...")
             from src.services.mcp_client import MCPClient
-            print("src.services.mcp_client import successful")
+            logger.debug("src.services.mcp_client import successful")
         except (ImportError, ValueError) as e:
-            print(f"src.services.mcp_client import failed: {e}")
-            print("Warning: MCP client not found. Tools will not be available.")
+            logger.warning("src.services.mcp_client import failed: %s", e)
+            logger.warning("MCP client not found. Tools will not be available.")
 
 # Get the directory where the current script is located
 SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
@@ -74,34 +96,34 @@ def get_config_file_path():
     # Check if the MCP_CONFIG_PATH environment variable is set
     env_config_path = os.environ.get('MCP_CONFIG_PATH')
     if env_config_path and os.path.exists(env_config_path):
-        print(f"Using config path from environment variable: {env_config_path}")
+        logger.info("Using config path from environment variable: %s", env_config_path)
         return env_config_path
     
     # Check for local JSON file first - prioritize local over Render
     if os.path.exists(LOCAL_CONFIG_PATH):
-        print(f"Using local JSON config: {LOCAL_CONFIG_PATH}")
+        logger.info("Using local JSON config: %s", LOCAL_CONFIG_PATH)
         return LOCAL_CONFIG_PATH
     
     # Check for Render's secret file path as fallback
     if os.path.exists(RENDER_CONFIG_PATH):
-        print(f"Using Render config path: {RENDER_CONFIG_PATH}")
+        logger.info("Using Render config path: %s", RENDER_CONFIG_PATH)
         return RENDER_CONFIG_PATH
     
     # If JS file exists but JSON doesn't, log a warning
     if os.path.exists(LOCAL_CONFIG_JS_PATH):
-        print(f"Found JS config but no JSON config. Please run 'node generate-config.js' in the backend directory")
-        print(f"Defaulting to: {LOCAL_CONFIG_PATH}")
+        logger.info("Found JS config but no JSON config. Please run 'node generate-config.js' in the backend directory")
+        logger.info("Defaulting to: %s", LOCAL_CONFIG_PATH)
         return LOCAL_CONFIG_PATH
     
     # No config found - log warning and return the local path as default
-    print("WARNING: No configuration file found. Please create a mcp_config.json file")
+    logger.warning("No configuration file found. Please create a mcp_config.json file")
     return LOCAL_CONFIG_PATH
 
 # Set the config file path
 CONFIG_FILE = get_config_file_path()
 
-print(f"CONFIG_FILE path: {CONFIG_FILE}")
-print(f"CONFIG_FILE exists: {os.path.exists(CONFIG_FILE)}")
+logger.debug("CONFIG_FILE path: %s", CONFIG_FILE)
+logger.debug("CONFIG_FILE exists: %s", os.path.exists(CONFIG_FILE))
 
 # Load environment variables from both root and backend directory
 root_env_path = pathlib.Path(__file__).parent.parent.parent.parent / '.env'
@@ -148,20 +170,115 @@ def extract_text_from_gemini_part(part: Dict[str, Any]) -> str:
     # Default case if no recognizable content is found
     return ""
 
-def get_model():
-    # Use the proper model and explicitly pass the API key
-    model_name = os.getenv('MODEL_CHOICE', 'gemini-2.5-pro-preview-03-25').replace('google-gla:', '')
+# Longest the Firestore receipt query may take, and the share of a request's remaining
+# deadline it may use (the rest is for the model and tools)
+RECEIPT_QUERY_TIMEOUT = float(os.getenv("RECEIPT_QUERY_TIMEOUT", 60))
+RECEIPT_CONTEXT_DEADLINE_SHARE = float(os.getenv("RECEIPT_CONTEXT_DEADLINE_SHARE", 0.25))
+# Receipts fetched for the context. They are summarized (see receipt_summary.py), so more
+# receipts make the totals more complete without making the prompt longer
+RECEIPT_CONTEXT_LIMIT = int(os.getenv("RECEIPT_CONTEXT_LIMIT", 300))
+
+# Get the receipt context the system prompt injects, refreshing the cache when it expires
+def get_receipt_context():
+    global _cached_receipt_context, _last_receipt_refresh
+    
+    # Get current time for cache comparison
+    current_time = time.time()
+    
+    # Check if we have cached context and it's still valid
+    if _cached_receipt_context is None or (current_time - _last_receipt_refresh) > _receipt_cache_ttl:
+        timeout = RECEIPT_QUERY_TIMEOUT
+        deadline = current_deadline()
+        if deadline is not None:
+            timeout = deadline.timeout(cap=RECEIPT_QUERY_TIMEOUT, share=RECEIPT_CONTEXT_DEADLINE_SHARE)
+            if timeout < 1 and _cached_receipt_context is not None:
+                # No time for Firestore: an expired context beats none
+                deadline.record("stale_receipt_context")
+                return _cached_receipt_context
+        try:
+            # Import here to avoid circular imports
+            from src.services.direct_context import fetch_receipt_context
+            # Fetch receipt context and update cache
+            with RECEIPT_CONTEXT_FETCH_SECONDS.time(), span("fetch_receipt_context", limit=RECEIPT_CONTEXT_LIMIT,
+                                                             timeout=round(timeout, 1)):
+                _cached_receipt_context = fetch_receipt_context(limit=RECEIPT_CONTEXT_LIMIT, timeout=max(timeout, 1))
+            _last_receipt_refresh = current_time
+            logger.info("Successfully fetched receipt context (%s characters)", len(_cached_receipt_context))
+        except Exception as e:
+            logger.error("Error fetching receipt context: %s", e)
+            # If we have cache, use it even if expired on error
+            if _cached_receipt_context is None:
+                _cached_receipt_context = "No receipt data available."
+            else:
+                logger.warning("Using expired cached receipt context due to error")
+    else:
+        logger.debug("Using cached receipt context (%s characters)", len(_cached_receipt_context), extra={"sample_every": 50})
+    
+    return _cached_receipt_context
+
+# The receipt documents behind the receipt context, for answering plain lookups
+# (list, totals, largest purchase) without the model, see intent_router.py
+def get_receipt_records():
+    get_receipt_context()
+    from src.services.direct_context import get_cached_receipt_records
+    return get_cached_receipt_records()
+
+# System prompt parts for a history started without an agent run (a cached or locally
+# routed first answer). pydantic-ai only adds the system prompt to an empty history, and
+# fills in parts with a dynamic_ref on every run, so placeholders naming the FinPal
+# prompts are enough (agents without them get none)
+def system_prompt_parts(agent):
+    return [SystemPromptPart(content="", dynamic_ref=ref) for ref in getattr(agent, "system_prompt_refs", ())]
+
+# Fingerprint of the receipt context the model currently sees
+# (changes as soon as a refreshed context contains a new or edited receipt)
+def get_receipt_fingerprint():
+    return hashlib.sha256(get_receipt_context().encode("utf-8")).hexdigest()
+
+# When a request's deadline leaves no time for more tools, take them away for this model
+# call and tell the model to answer with what it has (the history itself isn't changed)
+def answer_now_if_out_of_time(messages, model_request_parameters):
+    deadline = current_deadline()
+    if deadline is None or deadline.allows_tool_call() or not model_request_parameters.function_tools:
+        return messages, model_request_parameters
+    deadline.record("answer_forced")
+    if messages and isinstance(messages[-1], ModelRequest):
+        last = messages[-1]
+        messages = [*messages[:-1], dataclasses.replace(last, parts=[*last.parts, UserPromptPart(content=ANSWER_NOW_INSTRUCTION)])]
+    return messages, dataclasses.replace(model_request_parameters, function_tools=[])
+
+# Gemini provider for a Gemini-compatible server at another address (the local stand-in
+# in benchmarks/gemini_stub_server.py), with its own HTTP client so the shared one keeps
+# pointing at Google
+class LocalGeminiProvider(GoogleGLAProvider):
+    def __init__(self, base_url, api_key=None, http_client=None):
+        self._base_url = base_url.rstrip('/') + '/'
+        super().__init__(api_key=api_key or 'local', http_client=http_client or httpx.AsyncClient(timeout=600))
+
+    @property
+    def base_url(self):
+        return self._base_url
+
+def get_model(model_name=None):
+    # Use the proper model (MODEL_CHOICE unless the model router asks for another tier's)
+    # and explicitly pass the API key
+    model_name = (model_name or os.getenv('MODEL_CHOICE', 'gemini-2.5-pro-preview-03-25')).replace('google-gla:', '')
     api_key = os.getenv('LLM_API_KEY') or os.getenv('GEMINI_API_KEY')
+    base_url = os.getenv('GEMINI_BASE_URL')
+    # With context caching on, the stable prompt prefix is sent once and referenced after that
+    http_client = cached_http_client() if context_cache.enabled else None
     
-    if not api_key:
-        print("ERROR: No API key found for the AI model!")
-        print("Please set LLM_API_KEY or GEMINI_API_KEY in your .env file")
-        
-    # Explicitly pass the API key rather than relying on environment detection
-    model = GeminiModel(
-        model_name,
-        provider=GoogleGLAProvider(api_key=api_key)
-    )
+    if base_url:
+        logger.info("Using Gemini-compatible server at %s", base_url)
+        provider = LocalGeminiProvider(base_url, api_key=api_key, http_client=http_client)
+    else:
+        if not api_key:
+            logger.error("No API key found for the AI model!")
+            logger.error("Please set LLM_API_KEY or GEMINI_API_KEY in your .env file")
+        # Explicitly pass the API key rather than relying on environment detection
+        provider = GoogleGLAProvider(api_key=api_key, http_client=http_client)
+    
+    model = GeminiModel(model_name, provider=provider)
     
     # Monkey patch the _process_response method to handle executableCode
     original_process_response = model._process_response
@@ -171,11 +288,11 @@ def get_model():
             # Try the original method first
             return original_process_response(response_data, **kwargs)
         except Exception as e:
-            print(f"Error in original _process_response: {e}")
-            print(f"Response data structure: {json.dumps(response_data, indent=2)[:500]}...")
+            logger.error("Error in original _process_response: %s", e)
+            logger.debug("Response data structure: %s...", lazy(lambda: json.dumps(response_data, indent=2)[:500]))
             # If there's a validation error related to missing text field, try to extract text from executableCode
             if "text.text Field required" in str(e):
-                print("Attempting to fix missing text field by extracting from executableCode")
+                logger.info("Attempting to fix missing text field by extracting from executableCode")
                 try:
                     # Access the candidates in the response data
                     if "candidates" in response_data and len(response_data["candidates"]) > 0:
@@ -183,18 +300,18 @@ def get_model():
                         if "content" in candidate and "parts" in candidate["content"]:
                             # Process each part in the response
                             for i, part in enumerate(candidate["content"]["parts"]):
-                                print(f"Processing part {i}: {json.dumps(part, indent=2)[:200]}...")
+                                logger.debug("Processing part %s: %s...", i, lazy(lambda: json.dumps(part, indent=2)[:200]))
                                 # If part has executableCode but no text, add a text field
                                 if "executableCode" in part and "text" not in part:
                                     code_part = part["executableCode"]
                                     code = code_part.get("code", "")
                                     lang = code_part.get("lang", "")
-                                    print(f"Adding text field with code of length {len(code)} and lang {lang}")
+                                    logger.debug("Adding text field with code of length %s and lang %s", len(code), lang)
                                     part["text"] = f"```{lang}\n{code}\n```"
                     # Try processing again with modified data
                     return original_process_response(response_data, **kwargs)
                 except Exception as fix_error:
-                    print(f"Error fixing response: {fix_error}")
+                    logger.error("Error fixing response: %s", fix_error)
                     # If our fix fails, re-raise the original error
                     raise e
             # Re-raise the original exception for other errors
@@ -203,15 +320,60 @@ def get_model():
     # Apply the monkey patch
     model._process_response = patched_process_response.__get__(model, type(model))
     
+    return instrument_model(model, model_name)
+
+# Time every LLM round trip (plain and streamed) for /metrics and apply the request's
+# deadline to it. Works for any pydantic-ai model (the load test wraps its fake one)
+def instrument_model(model, model_name):
+    original_request = model.request
+    original_request_stream = model.request_stream
+    
+    async def timed_request(self, messages, model_settings, model_request_parameters):
+        start = time.perf_counter()
+        outcome = "error"
+        messages, model_request_parameters = answer_now_if_out_of_time(messages, model_request_parameters)
+        try:
+            with span("llm.request", model=model_name, mode="request"):
+                response = await original_request(messages, model_settings, model_request_parameters)
+            outcome = "ok"
+            return response
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, model=model_name, mode="request")
+            LLM_REQUESTS_TOTAL.inc(model=model_name, mode="request", outcome=outcome)
+    
+    @asynccontextmanager
+    async def timed_request_stream(self, messages, model_settings, model_request_parameters):
+        start = time.perf_counter()
+        outcome = "error"
+        messages, model_request_parameters = answer_now_if_out_of_time(messages, model_request_parameters)
+        try:
+            with span("llm.request", model=model_name, mode="stream"):
+                async with original_request_stream(messages, model_settings, model_request_parameters) as streamed_response:
+                    yield streamed_response
+            outcome = "ok"
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            raise
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, model=model_name, mode="stream")
+            LLM_REQUESTS_TOTAL.inc(model=model_name, mode="stream", outcome=outcome)
+    
+    model.request = timed_request.__get__(model, type(model))
+    model.request_stream = timed_request_stream.__get__(model, type(model))
     return model
 
 
 
 # IMPORTANT: The function that gets the agent for other files to use
-async def get_pydantic_ai_agent():
+async def get_pydantic_ai_agent(on_client=None):
     """
     Create and return a Pydantic AI agent with all MCP tools.
     This is the main function used by the API to get an agent instance.
+    on_client, if given, is called with the MCPClient before its servers start,
+    so the caller can report startup progress.
     """
     global CONFIG_FILE  # Add this line to fix the UnboundLocalError
     
@@ -219,88 +381,93 @@ async def get_pydantic_ai_agent():
     try:
         process = psutil.Process(os.getpid())
         memory_info = process.memory_info()
-        print(f"Current memory usage: {memory_info.rss / 1024 / 1024:.2f} MB")
-        print(f"Available system memory: {psutil.virtual_memory().available / 1024 / 1024:.2f} MB")
+        logger.info("Current memory usage: %.2f MB", memory_info.rss / 1024 / 1024)
+        logger.info("Available system memory: %.2f MB", psutil.virtual_memory().available / 1024 / 1024)
     except ImportError:
-        print("psutil not available for memory monitoring")
+        logger.info("psutil not available for memory monitoring")
     except Exception as e:
-        print(f"Error checking memory: {e}")
+        logger.error("Error checking memory: %s", e)
+    
+    # Simple turns get a flash model, hard ones the pro model (see model_router.py)
+    model_router.configure(get_model)
     
     if MCPClient is None:
-        print("Warning: Using AI agent without MCP tools (MCPClient is None)")
+        logger.warning("Using AI agent without MCP tools (MCPClient is None)")
         return None, Agent(model=get_model())
     
     try:
         # Initialize MCP client with all tools from config
-        print("Creating MCPClient instance...")
+        logger.info("Creating MCPClient instance...")
         client = MCPClient()
+        if on_client is not None:
+            on_client(client)
         
         # Check if config file exists (should be already verified but check again)
         if not os.path.exists(CONFIG_FILE):
-            print(f"Warning: Config file not found at {CONFIG_FILE}")
-            print("Using AI agent without tools")
+            logger.warning("Config file not found at %s", CONFIG_FILE)
+            logger.warning("Using AI agent without tools")
             return None, Agent(model=get_model())
         
-        print("Loading servers from config...")
+        logger.info("Loading servers from config...")
         try:
             client.load_servers(str(CONFIG_FILE))
-            print(f"Loaded {len(client.servers)} server configurations")
+            logger.info("Loaded %s server configurations", len(client.servers))
             
             # Debug: Print actual config loaded
-            print(f"\nConfig loaded from {CONFIG_FILE}:")
-            try:
-                with open(CONFIG_FILE, 'r') as f:
-                    config_content = f.read()
-                    print(config_content[:500] + "..." if len(config_content) > 500 else config_content)
-            except Exception as e:
-                print(f"Error reading config for debug: {e}")
+            # The raw config can contain API keys, so it is only dumped at DEBUG
+            if logger.isEnabledFor(logging.DEBUG):
+                try:
+                    with open(CONFIG_FILE, 'r') as f:
+                        config_content = f.read()
+                    logger.debug("Config loaded from %s:\n%s", CONFIG_FILE,
+                                 config_content[:500] + "..." if len(config_content) > 500 else config_content)
+                except Exception as e:
+                    logger.error("Error reading config for debug: %s", e)
             
             # Print server details    
             for server in client.servers:
-                print(f"  - Server: {server.name}, Priority: {server.config.get('priority', 'unknown')}, Autostart: {server.config.get('autostart', False)}")
+                logger.debug("  - Server: %s, Priority: %s, Autostart: %s", server.name, server.config.get('priority', 'unknown'), server.config.get('autostart', False))
         except Exception as e:
-            print(f"Error loading servers from config: {e}")
-            print(f"Stack trace: {traceback.format_exc()}")
-            print("Using AI agent without tools")
+            logger.error("Error loading servers from config: %s", e, exc_info=True)
+            logger.warning("Using AI agent without tools")
             return None, Agent(model=get_model())
         
         try:
-            print("Starting MCP client and loading essential tools...")
+            logger.info("Starting MCP client and loading essential tools...")
             # Start the client with exception handling for individual servers
             tools = []
             try:
                 tools = await client.start()
-                print(f"Client started successfully, found {len(tools)} tools")
+                logger.info("Client started successfully, found %s tools", len(tools))
                 if tools:
-                    print("Tools available:")
+                    logger.debug("Tools available:")
                     for tool in tools:
-                        print(f"  - {tool.name}")
+                        logger.debug("  - %s", tool.name)
                 else:
-                    print("No tools were loaded")
+                    logger.warning("No tools were loaded")
             except Exception as e:
-                print(f"Error during MCP client startup: {e}")
-                print(f"Stack trace: {traceback.format_exc()}")
-                print("Will attempt to continue with any tools that did initialize")
+                logger.error("Error during MCP client startup: %s", e, exc_info=True)
+                logger.info("Will attempt to continue with any tools that did initialize")
             
             # Modified: Even if tools is empty, we'll log but continue
             if not tools:
-                print("No tools were found by the MCP client!")
-                print("Check that your MCP servers are properly configured.")
-                print("Using AI agent without tools")
+                logger.warning("No tools were found by the MCP client!")
+                logger.info("Check that your MCP servers are properly configured.")
+                logger.warning("Using AI agent without tools")
                 return client, Agent(model=get_model())
             else:
                 # Check memory again
                 try:
                     process = psutil.Process(os.getpid())
                     memory_info = process.memory_info()
-                    print(f"Memory usage after tool loading: {memory_info.rss / 1024 / 1024:.2f} MB")
+                    logger.info("Memory usage after tool loading: %.2f MB", memory_info.rss / 1024 / 1024)
                 except ImportError:
                     pass
                 except Exception as e:
-                    print(f"Error checking memory: {e}")
+                    logger.error("Error checking memory: %s", e)
                 
                 # Clean tool schemas to remove $schema fields - Gemini doesn't like them
-                print("Cleaning tool schemas...")
+                logger.debug("Cleaning tool schemas...")
                 for tool in tools:
                     if hasattr(tool, 'parameters') and isinstance(tool.parameters, dict):
                         if '$schema' in tool.parameters:
@@ -317,49 +484,47 @@ async def get_pydantic_ai_agent():
                 
                 # Debug: Print tools that are available
                 for tool in tools:
-                    print(f"Tool available: {tool.name} - {tool.description}")
+                    logger.debug("Tool available: %s - %s", tool.name, tool.description)
                 
-                print(f"Loaded {len(tools)} MCP tools: {', '.join(t.name for t in tools) if tools else 'none'}")
+                logger.info("Loaded %s MCP tools: %s", len(tools), ', '.join(t.name for t in tools) if tools else 'none')
                 
-                # Create basic agent first
-                agent = Agent(model=get_model())
+                # Register the tools with the agent (assigning agent.tools alone doesn't let the
+                # model see them). Each run is only offered the tools its question needs, see
+                # tool_selection.py
+                tool_selector.configure(client)
+                registered = {}
+                for tool in tools:
+                    if tool.name in registered:
+                        logger.warning("Skipping duplicate tool name %s", tool.name)
+                        continue
+                    registered[tool.name] = tool
+                agent = Agent(model=get_model(), tools=tool_selector.apply(list(registered.values())))
                 
-                # Then manually set the tools attribute
-                # This is a workaround for potential issues in the Pydantic-AI library
+                # Kept for /api/tools and the health check
                 agent.tools = tools
                 
-                # Add FinPal system prompt as a dynamic decorator
+                # Add FinPal system prompt as a dynamic decorator. It comes in two parts: a
+                # stable prefix (instructions + receipt snapshot) that Gemini's context cache
+                # can hold (see prompt_cache.py), then a small part that changes every turn
                 @agent.system_prompt(dynamic=True)
                 def finpal_system_prompt():
-                    global _cached_receipt_context, _last_receipt_refresh
-                    
-                    # Get current time for cache comparison
-                    current_time = time.time()
-                    
-                    # Check if we have cached context and it's still valid
-                    if _cached_receipt_context is None or (current_time - _last_receipt_refresh) > _receipt_cache_ttl:
-                        try:
-                            # Import here to avoid circular imports
-                            from src.services.direct_context import fetch_receipt_context
-                            # Fetch receipt context and update cache
-                            _cached_receipt_context = fetch_receipt_context(limit=150) 
-                            _last_receipt_refresh = current_time
-                            print(f"Successfully fetched receipt context ({len(_cached_receipt_context)} characters)")
-                        except Exception as e:
-                            print(f"Error fetching receipt context: {e}")
-                            # If we have cache, use it even if expired on error
-                            if _cached_receipt_context is None:
-                                _cached_receipt_context = "No receipt data available."
-                            else:
-                                print("Using expired cached receipt context due to error")
-                    else:
-                        print(f"Using cached receipt context ({len(_cached_receipt_context)} characters)")
-                    
-                    # Use the cached context
-                    receipt_context = _cached_receipt_context
+                    with SYSTEM_PROMPT_SECONDS.time(), span("system_prompt"):
+                        return build_finpal_system_prompt()
+                
+                @agent.system_prompt(dynamic=True)
+                def finpal_turn_prompt(ctx: RunContext) -> str:
+                    return build_finpal_turn_prompt(prompt_text(ctx.prompt), ctx)
+                
+                # So a history started without a run can still get the prompts (system_prompt_parts)
+                agent.system_prompt_refs = (finpal_system_prompt.__qualname__, finpal_turn_prompt.__qualname__)
+                
+                def build_finpal_system_prompt():
+                    # Use the cached context (refreshed every _receipt_cache_ttl seconds)
+                    receipt_context = get_receipt_context()
+                    snapshot = hashlib.sha256(receipt_context.encode("utf-8")).hexdigest()[:12]
                     
                     # todo apply formating even if mcp servers arent setup, skip usage of servers if empty.
-                    base_prompt = """
+                    base_prompt = f"FINPAL INSTRUCTIONS v{PROMPT_VERSION}\n" + """
 You are FinPal, a Saudi-focused financial assistant providing personalized insights based on receipt analysis and financial data.
 
 DYNAMIC TOOL SELECTION:
@@ -368,6 +533,7 @@ MANDATORY TOOL USAGE:
 IMPORTANT: You MUST use at least these two tools for EVERY query:
 1. sequential_thinking - Use this tool first to break down the user's request and analyze how to approach it
 2. memory - Use this to recall context from previous interactions 
+When the CURRENT TURN section lists the tools offered for this query, this rule only applies to the tools it lists. If it says no tools are offered, answer directly from the receipt context.
 
 You must ALWAYS include both your thinking process AND a clear response in your answers. Never put all useful information only in the thinking part.
 
@@ -677,6 +843,7 @@ IMPORTANT:
 - Adapt content within the chosen format to best answer the query
 - Keep responses concise (100-300 words total depending on complexity)
 - ALWAYS check available receipt context before responding
+- The receipt context is a summary: quote its precomputed totals (by category, merchant and month) instead of adding up receipts, and remember that only the most recent receipts are listed one by one
 - For insufficient data, use FORMAT 5 and ask clarifying questions
 - When asked for charts or visualizations, ALWAYS use FORMAT 6
 
@@ -700,34 +867,39 @@ Remember to:
 - Respond directly to what the user is asking about
 """
                     # Add receipt context to the prompt - this is essential!
-                    return base_prompt + f"\n\nUSER RECEIPT CONTEXT:\n{receipt_context}"
+                    # Nothing that changes per turn goes in here, or the prefix can't be cached
+                    return base_prompt + f"\n\nUSER RECEIPT CONTEXT (snapshot {snapshot}):\n{receipt_context}"
+                
+                def build_finpal_turn_prompt(question, run=None):
+                    # Which tools this run gets (also what lets a simple query skip the mandatory ones)
+                    selection = tool_selector.select(question)
+                    tool_selector.record(selection, run)
+                    note = tool_selector.turn_note(selection)
+                    turn_prompt = f"CURRENT TURN:\nToday is {datetime.now().strftime('%A, %d %B %Y')}."
+                    return turn_prompt + f"\n{note}" if note else turn_prompt
                 
-                print("Added FinPal system prompt with HTML formatting, tool sequencing, and conversational guidance")
+                logger.info("Added FinPal system prompt with HTML formatting, tool sequencing, and conversational guidance")
                 
                 # Verify tools were correctly set
-                print(f"Agent created with {len(agent.tools) if hasattr(agent, 'tools') else 0} tools")
+                logger.info("Agent created with %s tools", len(agent.tools) if hasattr(agent, 'tools') else 0)
                 return client, agent
                 
         except asyncio.CancelledError as e:
-            print(f"MCP client initialization was cancelled: {e}")
-            print(f"Stack trace: {traceback.format_exc()}")
-            print("Falling back to AI agent without tools")
+            logger.warning("MCP client initialization was cancelled: %s", e, exc_info=True)
+            logger.warning("Falling back to AI agent without tools")
             return None, Agent(model=get_model())
         except Exception as e:
-            print(f"Error starting MCP client: {e}")
-            print(f"Stack trace: {traceback.format_exc()}")
-            print("Falling back to AI agent without tools")
+            logger.error("Error starting MCP client: %s", e, exc_info=True)
+            logger.warning("Falling back to AI agent without tools")
             return None, Agent(model=get_model())
         
     except asyncio.CancelledError as e:
-        print(f"MCP client initialization was cancelled: {e}")
-        print(f"Stack trace: {traceback.format_exc()}")
-        print("Falling back to AI agent without tools")
+        logger.warning("MCP client initialization was cancelled: %s", e, exc_info=True)
+        logger.warning("Falling back to AI agent without tools")
         return None, Agent(model=get_model())
     except Exception as e:
-        print(f"Error initializing MCP client: {e}")
-        print(f"Stack trace: {traceback.format_exc()}")
-        print("Falling back to AI agent without tools")
+        logger.error("Error initializing MCP client: %s", e, exc_info=True)
+        logger.warning("Falling back to AI agent without tools")
         return None, Agent(model=get_model())
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -737,6 +909,7 @@ Remember to:
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 async def main():
+    setup_logging()
     print("=== Pydantic AI MCP CLI Chat ===")
     print("Type 'exit' to quit the chat")
     
@@ -0,0 +1,153 @@
+"""
+Compact Receipt Summary for the System Prompt
+
+The system prompt used to carry a line-per-field dump of every fetched receipt, IDs
+included, and the model added the numbers up itself on every turn. This builds a
+summary instead: totals per category, per merchant and per month, the largest
+transactions and the most recent receipts, one pipe-separated row each. Totals are
+precomputed so the model can quote them.
+
+The summary is kept within a token budget (RECEIPT_SUMMARY_TOKENS in direct_context.py). Sections are filled
+in order of how often questions need them, and each stops at its row cap or when the
+budget runs out. Recent receipts with their items come last, so raw rows only get in
+when the budget leaves room for them.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from src.services.history_compactor import estimate_tokens
+from src.services.intent_router import ReceiptRecord, money, normalize_receipt
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = 2000
+
+# Most rows per section (the token budget may cut them shorter)
+MAX_CATEGORIES = 30
+MAX_MONTHS = 24
+MAX_MERCHANTS = 25
+MAX_LARGEST = 10
+MAX_ITEMS_PER_RECEIPT = 8
+NOTE_TOKENS = 10  # room kept for a section's "(+N more not shown)"
+
+
+def format_totals(totals: Dict[str, float]) -> str:
+    """"SAR 1,234.50", or one amount per currency when the receipts mix them."""
+    return " + ".join(money(amount, currency) for currency, amount in sorted(totals.items()))
+
+
+def _day(record: ReceiptRecord) -> str:
+    return record.day.isoformat() if record.day else "unknown"
+
+
+def _items(data: Dict[str, Any]) -> str:
+    items = data.get("items")
+    if not isinstance(items, list):
+        return ""
+    names = [str(item.get("description") or "").strip() for item in items if isinstance(item, dict)]
+    names = [name for name in names if name]
+    more = len(names) - MAX_ITEMS_PER_RECEIPT
+    return ", ".join(names[:MAX_ITEMS_PER_RECEIPT]) + (f" (+{more} more)" if more > 0 else "")
+
+
+class _Group:
+    def __init__(self) -> None:
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.count = 0
+        self.last_day: Optional[date] = None
+
+    def add(self, record: ReceiptRecord) -> None:
+        self.totals[record.currency] += record.total
+        self.count += 1
+        if record.day and (self.last_day is None or record.day > self.last_day):
+            self.last_day = record.day
+
+    @property
+    def amount(self) -> float:
+        return sum(self.totals.values())
+
+
+def group_by(records: List[ReceiptRecord], key) -> Dict[str, _Group]:
+    groups: Dict[str, _Group] = defaultdict(_Group)
+    for record in records:
+        groups[key(record)].add(record)
+    return groups
+
+
+def build_receipt_summary(receipts: Iterable[Dict[str, Any]], token_budget: int = DEFAULT_TOKEN_BUDGET) -> str:
+    """The receipt context for the system prompt, at most about ``token_budget`` tokens."""
+    pairs: List[Tuple[ReceiptRecord, Dict[str, Any]]] = []
+    for data in receipts:
+        record = normalize_receipt(data)
+        if record is not None:
+            pairs.append((record, data))
+    if not pairs:
+        return "USER RECEIPT SUMMARY:\nNo receipts yet."
+    records = [record for record, _ in pairs]
+    overall = group_by(records, lambda record: "all")["all"]
+    days = sorted(record.day for record in records if record.day)
+    span_text = f", {days[0].isoformat()} to {days[-1].isoformat()}" if days else ""
+
+    lines = [
+        f"USER RECEIPT SUMMARY ({len(records)} receipts{span_text}, total spent {format_totals(overall.totals)})",
+        "Totals below are precomputed from all these receipts: quote them instead of adding up receipts.",
+    ]
+    used = estimate_tokens("\n".join(lines))
+
+    by_category = group_by(records, lambda record: record.category)
+    by_month = group_by([record for record in records if record.day], lambda record: record.day.strftime("%Y-%m"))
+    by_merchant = group_by(records, lambda record: record.merchant)
+    largest = sorted(records, key=lambda record: record.total, reverse=True)
+    recent = sorted(pairs, key=lambda pair: pair[0].day or date.min, reverse=True)
+
+    sections = [
+        ("SPENDING BY CATEGORY", "category | total | receipts | share", MAX_CATEGORIES, [
+            f"{name} | {format_totals(group.totals)} | {group.count} | {group.amount / overall.amount:.0%}"
+            if overall.amount else f"{name} | {format_totals(group.totals)} | {group.count} | -"
+            for name, group in sorted(by_category.items(), key=lambda item: item[1].amount, reverse=True)
+        ]),
+        ("SPENDING BY MONTH", "month | total | receipts", MAX_MONTHS, [
+            f"{month} | {format_totals(group.totals)} | {group.count}"
+            for month, group in sorted(by_month.items(), reverse=True)
+        ]),
+        ("SPENDING BY MERCHANT", "merchant | total | receipts | last visit", MAX_MERCHANTS, [
+            f"{name} | {format_totals(group.totals)} | {group.count} | "
+            f"{group.last_day.isoformat() if group.last_day else 'unknown'}"
+            for name, group in sorted(by_merchant.items(), key=lambda item: item[1].amount, reverse=True)
+        ]),
+        ("LARGEST TRANSACTIONS", "date | merchant | category | total", MAX_LARGEST, [
+            f"{_day(record)} | {record.merchant} | {record.category} | {money(record.total, record.currency)}"
+            for record in largest[:MAX_LARGEST]
+        ]),
+        ("RECENT RECEIPTS", "date | merchant | category | total | items", len(recent), [
+            f"{_day(record)} | {record.merchant} | {record.category} | {money(record.total, record.currency)}"
+            f" | {_items(data)}".rstrip(" |")
+            for record, data in recent
+        ]),
+    ]
+    for title, header, cap, rows in sections:
+        section = ["", f"{title} ({header})"]
+        section_tokens = estimate_tokens("\n".join(section))
+        if used + section_tokens >= token_budget:
+            break
+        used += section_tokens
+        shown = 0
+        for row in rows[:cap]:
+            row_tokens = estimate_tokens(row) + 1
+            if used + row_tokens + NOTE_TOKENS > token_budget:
+                break
+            section.append(row)
+            used += row_tokens
+            shown += 1
+        if shown == 0:
+            used -= section_tokens
+            break
+        if shown < len(rows):
+            section.append(f"(+{len(rows) - shown} more not shown)")
+            used += estimate_tokens(section[-1]) + 1
+        lines.extend(section)
+    return "\n".join(lines)
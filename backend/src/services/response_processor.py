@@ -0,0 +1,156 @@
+"""
+Response Post-Processing for Chat Output
+
+Cleans up the model's reply before it goes to the frontend: removes markdown code
+fences and, when the model wrote tool commands as plain text instead of calling the
+tool, pulls a readable answer out of them. All patterns are compiled once, the tool
+command check is a single anchored match, and the same rules are available for
+complete strings (process_response) and streamed chunks (StreamProcessor).
+"""
+
+import logging
+import re
+from typing import Optional
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+FENCE = "```"
+HTML_FENCE = "```html"
+
+# Tool command prefixes the model sometimes writes as text instead of calling the tool
+TOOL_CODE_PREFIXES = (
+    "tool_code",
+    "sequential_thinking.think",
+    "sequential_thinking.run",
+    "memory_tool.",
+    "brave_search.",
+    "print(brave_search.",
+    "google_maps.",
+    "yfinance.",
+)
+
+# One alternation instead of a loop of re.search calls (brave_search.search_and_summarize
+# is covered by brave_search.)
+TOOL_CODE_RE = re.compile("|".join(re.escape(prefix) for prefix in TOOL_CODE_PREFIXES))
+THINKING_RESULT_RE = re.compile(r'"result":\s*"(.+?)"', re.DOTALL)
+TRAILING_TEXT_RE = re.compile(r'\)\s*\n+([\s\S]+)')
+
+ANSWER_TEMPLATE = '<div class="p-4 bg-gray-50 rounded-lg"><p class="text-lg">{}</p></div>'
+FALLBACK_ANSWER = ANSWER_TEMPLATE.format("I've analyzed your question. Please check my thought process for details.")
+
+
+def _unescape(text: str) -> str:
+    if "\\" not in text:
+        return text  # nothing escaped, skip two full scans
+    return text.replace('\\n', '\n').replace('\\"', '"')
+
+
+def strip_fences(text: str) -> str:
+    """Remove a leading ```html (and its closing fence) and every other code fence marker."""
+    if text.startswith(HTML_FENCE):
+        text = text[len(HTML_FENCE):]
+        if text.endswith(FENCE):
+            text = text[:-len(FENCE)]
+    if FENCE in text:
+        text = text.replace(FENCE, "")
+    return text
+
+
+def starts_with_tool_code(text: str) -> bool:
+    """True if the (already stripped) text starts with a tool command."""
+    return TOOL_CODE_RE.match(text) is not None
+
+
+def extract_tool_code_answer(text: str) -> str:
+    """Build an HTML answer from a reply that starts with tool commands.
+
+    Prefers the "result" of a sequential_thinking call, then any text after the
+    last tool call, then a generic message.
+    """
+    thinking_result = THINKING_RESULT_RE.search(text)
+    if thinking_result:
+        return ANSWER_TEMPLATE.format(_unescape(thinking_result.group(1)))
+    trailing_text = TRAILING_TEXT_RE.search(text)
+    if trailing_text:
+        return ANSWER_TEMPLATE.format(trailing_text.group(1).strip())
+    return FALLBACK_ANSWER
+
+
+def process_response(response_text):
+    """Clean up a complete model reply. Non-string replies are returned unchanged."""
+    if not isinstance(response_text, str):
+        return response_text
+
+    text = strip_fences(response_text)
+    stripped = text.strip()
+
+    # If there's tool code and no HTML response yet, add an actual answer after it
+    # (the frontend shows the tool code as the thinking part)
+    if starts_with_tool_code(stripped) and not stripped.endswith(">"):
+        logger.info("Tool command detected, extracting answer and preserving thinking")
+        text = _unescape(text + "\n\n" + extract_tool_code_answer(text))
+        stripped = text.strip()
+
+    return stripped
+
+
+class StreamProcessor:
+    """Applies the process_response fence and tool-code rules to text deltas as they arrive.
+
+    Holds back just enough text to make a decision (a leading ```html, a fence split
+    across two chunks, or a tool command prefix) so the first token still goes out
+    right away. The answer extracted from tool code is only known at the end, so
+    callers send process_response() of the full text as the final message.
+    """
+
+    def __init__(self) -> None:
+        self.raw = ""  # text not yet checked for code fences
+        self.pending = ""  # fence-free text waiting for the tool-code decision
+        self.started = False  # have we checked for a leading ```html yet
+        self.emitted = False  # has any text gone out yet (to trim leading whitespace)
+        self.thinking: Optional[bool] = None  # None until we know whether the reply starts with tool code
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk of model output, returns the cleaned text that can be sent now."""
+        self.raw += chunk
+        if not self.started:
+            # Wait until we can tell whether the reply starts with ```html
+            if len(self.raw) < len(HTML_FENCE) and HTML_FENCE.startswith(self.raw):
+                return ""
+            if self.raw.startswith(HTML_FENCE):
+                self.raw = self.raw[len(HTML_FENCE):]
+            self.started = True
+
+        # Keep trailing backticks back, they may be the start of a fence in the next chunk
+        keep = len(self.raw) - len(self.raw.rstrip("`"))
+        ready, self.raw = self.raw[:len(self.raw) - keep], self.raw[len(self.raw) - keep:]
+        self.pending += ready.replace(FENCE, "")
+        return self._drain()
+
+    def finish(self) -> str:
+        """Flush whatever is still held back at the end of the stream."""
+        self.started = True
+        self.pending += self.raw.replace(FENCE, "")
+        self.raw = ""
+        return self._drain(final=True)
+
+    def _drain(self, final: bool = False) -> str:
+        if self.thinking is None:
+            stripped = self.pending.lstrip()
+            if not stripped:
+                if final:
+                    self.thinking = False
+                return ""
+            if starts_with_tool_code(stripped):
+                self.thinking = True
+            elif not final and any(prefix.startswith(stripped) for prefix in TOOL_CODE_PREFIXES):
+                return ""  # could still turn into a tool command, wait for more text
+            else:
+                self.thinking = False
+
+        text, self.pending = self.pending, ""
+        if not self.emitted:
+            text = text.lstrip()
+            self.emitted = bool(text)
+        return text
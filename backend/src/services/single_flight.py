@@ -0,0 +1,69 @@
+"""
+Single-Flight Request Coalescing
+
+When the same work is requested again while it is still running (a frontend retry,
+a double-submitted chat message), the later callers wait for the call that is
+already in flight instead of starting their own. When every caller waiting for a
+call has gone away (cancelled, e.g. because the client disconnected), the call
+itself is cancelled.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight task."""
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}  # callers waiting on each call
+        self.started = 0  # calls that actually ran
+        self.shared = 0  # calls that joined one already in flight
+        self.cancelled = 0  # calls cancelled because all their callers went away
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run ``fn()`` unless a call with this key is already running, then share its result."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.started += 1
+        else:
+            self.shared += 1
+            logger.info(f"Joining in-flight call for {key[:80]!r}")
+        # Shield so one caller going away doesn't cancel the work the others wait for,
+        # but cancel it once the last caller is gone
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel()
+                self.cancelled += 1
+                logger.info(f"Cancelled in-flight call for {key[:80]!r}, no callers left")
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def is_running(self, key: str) -> bool:
+        return key in self._calls
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "shared": self.shared,
+            "cancelled": self.cancelled,
+        }
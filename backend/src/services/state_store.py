@@ -0,0 +1,248 @@
+"""
+Shared State Store
+
+A small key-value interface for state that has to be visible to every uvicorn worker:
+conversation history and cached answers. Values are bytes, grouped by namespace, with
+an optional TTL and least-recently-used eviction. MemoryStateStore keeps everything in
+the process (single worker, tests); SqliteStateStore keeps it in a SQLite file that all
+workers on the box open, so a session can land on any worker.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class StateStore(ABC):
+    """Namespaced bytes store with TTLs and LRU eviction."""
+
+    backend = ""
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, touch: bool = True) -> Optional[bytes]:
+        """Return the value (None if missing or expired); ``touch`` marks it recently used."""
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        """Store a value, expiring after ``ttl`` seconds if given."""
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> bool:
+        """Remove a value. Returns whether it existed."""
+
+    @abstractmethod
+    def clear(self, namespace: str) -> int:
+        """Remove every value in the namespace. Returns how many were removed."""
+
+    @abstractmethod
+    def count(self, namespace: str) -> int:
+        """Number of live values in the namespace."""
+
+    @abstractmethod
+    def total_size(self, namespace: str) -> int:
+        """Total bytes of the live values in the namespace."""
+
+    @abstractmethod
+    def evict(self, namespace: str, max_items: Optional[int] = None, max_bytes: Optional[int] = None) -> int:
+        """Drop expired values, then least recently used ones until under the caps. Returns how many were dropped."""
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """In-process implementation (only shared within one worker)."""
+
+    backend = "memory"
+
+    def __init__(self) -> None:
+        # namespace -> key -> (value, expires_at), ordered from least to most recently used
+        self._data: Dict[str, "OrderedDict[str, Tuple[bytes, Optional[float]]]"] = {}
+        self._lock = threading.Lock()
+
+    def _namespace(self, namespace: str) -> "OrderedDict[str, Tuple[bytes, Optional[float]]]":
+        return self._data.setdefault(namespace, OrderedDict())
+
+    def get(self, namespace: str, key: str, touch: bool = True) -> Optional[bytes]:
+        with self._lock:
+            entries = self._namespace(namespace)
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del entries[key]
+                return None
+            if touch:
+                entries.move_to_end(key)
+            return value
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            entries = self._namespace(namespace)
+            entries[key] = (value, time.time() + ttl if ttl else None)
+            entries.move_to_end(key)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._namespace(namespace).pop(key, None) is not None
+
+    def clear(self, namespace: str) -> int:
+        with self._lock:
+            removed = len(self._namespace(namespace))
+            self._data[namespace] = OrderedDict()
+            return removed
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            self._purge_expired(namespace)
+            return len(self._namespace(namespace))
+
+    def total_size(self, namespace: str) -> int:
+        with self._lock:
+            self._purge_expired(namespace)
+            return sum(len(value) for value, _ in self._namespace(namespace).values())
+
+    def evict(self, namespace: str, max_items: Optional[int] = None, max_bytes: Optional[int] = None) -> int:
+        with self._lock:
+            dropped = self._purge_expired(namespace)
+            entries = self._namespace(namespace)
+            total = sum(len(value) for value, _ in entries.values())
+            while entries and (
+                (max_items is not None and len(entries) > max_items)
+                or (max_bytes is not None and total > max_bytes)
+            ):
+                _, (value, _) = entries.popitem(last=False)
+                total -= len(value)
+                dropped += 1
+            return dropped
+
+    def _purge_expired(self, namespace: str) -> int:
+        now = time.time()
+        entries = self._namespace(namespace)
+        expired = [key for key, (_, expires_at) in entries.items() if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del entries[key]
+        return len(expired)
+
+
+class SqliteStateStore(StateStore):
+    """SQLite implementation, shared by every worker process that opens the same file.
+
+    Uses WAL mode so readers don't block the writer, and a busy timeout so workers
+    wait briefly for each other instead of failing.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 5.0) -> None:
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL, updated_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS state_lru ON state (namespace, updated_at)")
+        logger.info(f"Opened shared state store at {path}")
+
+    def get(self, namespace: str, key: str, touch: bool = True) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+                return None
+            if touch:
+                self._conn.execute(
+                    "UPDATE state SET updated_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+                )
+            return bytes(value)
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (namespace, key, value, size, expires_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, len(value), now + ttl if ttl else None, now),
+            )
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+            return cursor.rowcount > 0
+
+    def clear(self, namespace: str) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM state WHERE namespace = ?", (namespace,)).rowcount
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, time.time()),
+            ).fetchone()[0]
+
+    def total_size(self, namespace: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM state"
+                " WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, time.time()),
+            ).fetchone()[0]
+
+    def evict(self, namespace: str, max_items: Optional[int] = None, max_bytes: Optional[int] = None) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                dropped = self._conn.execute(
+                    "DELETE FROM state WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                    (namespace, time.time()),
+                ).rowcount
+                count, total = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM state WHERE namespace = ?", (namespace,)
+                ).fetchone()
+                over_items = max_items is not None and count > max_items
+                over_bytes = max_bytes is not None and total > max_bytes
+                if over_items or over_bytes:
+                    victims = []
+                    rows = self._conn.execute(
+                        "SELECT key, size FROM state WHERE namespace = ? ORDER BY updated_at", (namespace,)
+                    )
+                    for key, size in rows:
+                        if not ((max_items is not None and count > max_items)
+                                or (max_bytes is not None and total > max_bytes)):
+                            break
+                        victims.append((namespace, key))
+                        count -= 1
+                        total -= size
+                    self._conn.executemany("DELETE FROM state WHERE namespace = ? AND key = ?", victims)
+                    dropped += len(victims)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return dropped
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
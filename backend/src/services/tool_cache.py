@@ -0,0 +1,167 @@
+"""
+TTL Cache for MCP Tool Results
+
+The same brave_search query or yfinance ticker is often fetched again within seconds,
+by another user or later in the same agent run. Results are cached by server, tool
+and canonicalized arguments for a TTL set per tool, and identical calls already in
+flight are joined instead of sent again. The cache is shared by everyone on the
+worker, so only give a TTL to tools whose result doesn't depend on who asks.
+
+TTLs come from mcp_config.json, per server ("cacheTtl") or per tool ("toolOptions":
+{"get_stock_info": {"cacheTtl": 60}}), falling back to DEFAULT_TTLS. 0 means never
+cache (memory reads and writes, sequential_thinking). Errors are never cached.
+Eviction is TTL plus LRU, bounded by entry count and by total result size.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from src.services.metrics import TOOL_CACHE_EVENTS_TOTAL
+from src.services.single_flight import SingleFlight
+from src.services.tool_selection import normalize_name
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds, by server name without punctuation (servers not listed are never cached)
+DEFAULT_TTLS = {
+    "bravesearch": 3600,
+    "googlemaps": 3600,
+    "yfinance": 60,
+    "memory": 0,
+    "sequentialthinking": 0,
+}
+
+
+def tool_ttl(server: str, server_config: Dict[str, Any], tool: str) -> float:
+    """Cache TTL of one tool: its toolOptions entry, then its server's entry, then the default."""
+    options = (server_config.get("toolOptions") or {}).get(tool, {})
+    if "cacheTtl" in options:
+        return float(options["cacheTtl"])
+    if "cacheTtl" in server_config:
+        return float(server_config["cacheTtl"])
+    return float(DEFAULT_TTLS.get(normalize_name(server), 0))
+
+
+def canonical_arguments(value: Any) -> Any:
+    """Arguments with the differences that don't change a result removed (None values, spacing, 5.0 vs 5)."""
+    if isinstance(value, dict):
+        return {key: canonical_arguments(item) for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [canonical_arguments(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def make_tool_key(server: str, tool: str, arguments: Dict[str, Any]) -> str:
+    raw = json.dumps([server, tool, canonical_arguments(arguments or {})], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def result_size(result: Any) -> int:
+    """Approximate size of a result in bytes (what it costs to keep it)."""
+    dump = getattr(result, "model_dump_json", None)
+    return len(dump()) if callable(dump) else len(str(result))
+
+
+class ToolResultCache:
+    """Bounded TTL + LRU cache of tool results, with in-flight deduplication."""
+
+    def __init__(self, enabled: bool = True, max_entries: int = 1000, max_bytes: int = 16 * 1024 * 1024) -> None:
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self.flights = SingleFlight()
+        self.counts = {event: 0 for event in ("hit", "miss", "shared", "stored", "evicted", "expired", "uncacheable")}
+
+    def record(self, event: str) -> None:
+        self.counts[event] += 1
+        TOOL_CACHE_EVENTS_TOTAL.inc(event=event)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result, size = entry
+        if expires_at <= time.time():
+            self._drop(key)
+            self.record("expired")
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: Any, ttl: float) -> None:
+        size = result_size(result)
+        if size > self.max_bytes:
+            self.record("uncacheable")
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.time() + ttl, result, size)
+        self._bytes += size
+        self.record("stored")
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.record("evicted")
+
+    def _drop(self, key: str) -> None:
+        self._bytes -= self._entries.pop(key)[2]
+
+    async def call(self, key: str, ttl: float, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """The result for ``key``: cached, shared with an identical call in flight, or from ``fn()``.
+
+        Returns the result and where it came from ("hit", "shared", "miss" or "bypass").
+        """
+        if not self.enabled or ttl <= 0:
+            return await fn(), "bypass"
+        result = self.get(key)
+        if result is not None:
+            self.record("hit")
+            return result, "hit"
+
+        joining = self.flights.is_running(key)
+        result = await self.flights.do(key, fn)
+        if joining:
+            # Whoever started the call stores its result
+            self.record("shared")
+            return result, "shared"
+        self.record("miss")
+        if getattr(result, "isError", False):
+            self.record("uncacheable")
+        else:
+            self.put(key, result, ttl)
+        return result, "miss"
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counts["hit"] + self.counts["shared"] + self.counts["miss"]
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            **self.counts,
+            "hit_rate": round((self.counts["hit"] + self.counts["shared"]) / lookups, 4) if lookups else 0.0,
+            "in_flight": self.flights.stats()["in_flight"],
+        }
+
+
+tool_cache = ToolResultCache(
+    enabled=os.environ.get("TOOL_CACHE", "true").lower() not in ("0", "false", "no"),
+    max_entries=int(os.environ.get("TOOL_CACHE_MAX_ENTRIES", 1000)),
+    max_bytes=int(os.environ.get("TOOL_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+)
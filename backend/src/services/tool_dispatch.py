@@ -0,0 +1,154 @@
+"""
+Concurrent MCP Tool Dispatch
+
+pydantic-ai runs the tool calls of one model step as parallel tasks, and an MCP
+ClientSession can have many requests in flight on its single stdio connection
+(responses are matched back by request id). So when Gemini asks for brave_search,
+yfinance and google_maps in one step, the calls overlap across servers, and two calls
+to the same server are pipelined on its session. This module makes that explicit and
+measurable:
+
+- ServerSlots caps the calls in flight per server ("maxConcurrentCalls" in the server's
+  mcp_config.json entry, default MCP_MAX_CONCURRENT_CALLS). Set it to 1 for a server
+  that can only work on one request at a time; further calls then wait for a slot.
+- ToolSteps groups the calls of one model step and records the step's wall time next to
+  the sum of its calls' durations, so /metrics shows what the overlap saves. A step of
+  three tools should take about as long as its slowest one.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+from src.services.metrics import TOOL_QUEUE_SECONDS, TOOL_STEP_SECONDS, TOOL_STEP_SERIAL_SECONDS_TOTAL
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT_CALLS = int(os.environ.get("MCP_MAX_CONCURRENT_CALLS", 4))
+
+
+class ServerSlots:
+    """In-flight limit and counters for the tool calls of one MCP server."""
+
+    def __init__(self, server: str, limit: int = DEFAULT_MAX_CONCURRENT_CALLS) -> None:
+        self.server = server
+        self.limit = max(1, int(limit))
+        self._semaphore = asyncio.Semaphore(self.limit)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.queued_calls = 0  # calls that had to wait for a slot
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - start
+        TOOL_QUEUE_SECONDS.observe(waited, server=self.server)
+        if waited > 0.001:
+            self.queued_calls += 1
+        self.calls += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "queued_calls": self.queued_calls,
+        }
+
+
+class _Step:
+    def __init__(self, expected: int) -> None:
+        self.expected = expected
+        self.finished = 0
+        self.started_at = time.perf_counter()
+        self.serial_seconds = 0.0
+
+
+class ToolSteps:
+    """Wall time vs. summed call time of each model step's MCP tool calls."""
+
+    def __init__(self, max_open: int = 1024) -> None:
+        self.max_open = max_open
+        self.tool_names: Set[str] = set()  # calls to other tools never reach us, so aren't waited for
+        self._open: "OrderedDict[Tuple[int, int], _Step]" = OrderedDict()
+        self.steps = 0
+        self.parallel_steps = 0
+        self.max_calls = 0
+        self.wall_seconds = 0.0
+        self.serial_seconds = 0.0
+
+    def register(self, tool_name: str) -> None:
+        self.tool_names.add(tool_name)
+
+    def start(self, ctx: Any) -> Optional[Tuple[int, int]]:
+        """Note a call starting; returns its step's key (None when there is no run context)."""
+        messages = getattr(ctx, "messages", None)
+        if not messages:
+            return None
+        # The calls of one step share the run's message list and its step number
+        key = (id(messages), ctx.run_step)
+        if key not in self._open:
+            last = messages[-1]
+            expected = sum(1 for part in getattr(last, "parts", [])
+                           if getattr(part, "part_kind", None) == "tool-call" and part.tool_name in self.tool_names)
+            self._open[key] = _Step(max(expected, 1))
+            while len(self._open) > self.max_open:
+                # Steps whose run was cancelled halfway never finish
+                self._open.popitem(last=False)
+        return key
+
+    def finish(self, key: Optional[Tuple[int, int]], seconds: float) -> None:
+        step = self._open.get(key) if key is not None else None
+        if step is None:
+            return
+        step.finished += 1
+        step.serial_seconds += seconds
+        if step.finished < step.expected:
+            return
+        del self._open[key]
+        wall = time.perf_counter() - step.started_at
+        self.steps += 1
+        self.parallel_steps += step.finished > 1
+        self.max_calls = max(self.max_calls, step.finished)
+        self.wall_seconds += wall
+        self.serial_seconds += step.serial_seconds
+        TOOL_STEP_SECONDS.observe(wall)
+        TOOL_STEP_SERIAL_SECONDS_TOTAL.inc(step.serial_seconds)
+        if step.finished > 1:
+            logger.debug("Tool step of %d calls took %.3fs (%.3fs if run one by one)",
+                         step.finished, wall, step.serial_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "steps": self.steps,
+            "parallel_steps": self.parallel_steps,
+            "max_calls_per_step": self.max_calls,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "serial_seconds": round(self.serial_seconds, 3),
+            # How many times faster the steps ran than their calls one after another
+            "speedup": round(self.serial_seconds / self.wall_seconds, 2) if self.wall_seconds else 0.0,
+        }
+
+
+tool_steps = ToolSteps()
@@ -0,0 +1,162 @@
+"""
+MCP Tool Output Shaping
+
+A brave_search or yfinance result goes back to the model as-is, and some are tens of KB
+of JSON. It then rides along in every later model call of the turn, and in the history
+of later turns. Each tool's output is shaped before the model sees it:
+
+- "fields": keep only these keys of the JSON result, or of each item of its lists
+  ({"quotes": [...]}, or a list itself), dotted for nested keys ("quote.price")
+- "topK": keep the first k items of a JSON list (or of each list in a JSON object), or
+  the first k blank-line separated blocks of a text result (brave_web_search's format)
+- "maxBytes" / "maxTokens": cut whatever is left to this size, with a note saying so
+
+Set in a tool's "toolOptions" entry in mcp_config.json, or on the server entry for all
+its tools. Every tool is capped at TOOL_OUTPUT_MAX_TOKENS (default 2000, 0 for no cap)
+unless configured otherwise. JSON that is shaped is re-serialized compactly, which on
+its own saves the pretty-printing. Error results are passed through untouched.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from src.services.history_compactor import CHARS_PER_TOKEN
+from src.services.metrics import TOOL_OUTPUT_BYTES_TOTAL
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TOKENS = int(os.environ.get("TOOL_OUTPUT_MAX_TOKENS", 2000))
+
+
+def project(value: Any, fields: List[str]) -> Any:
+    """Keep only the given (dotted) keys of a dict, or of each dict in a list."""
+    if isinstance(value, list):
+        return [project(item, fields) for item in value]
+    if not isinstance(value, dict):
+        return value
+    wanted: Dict[str, List[str]] = {}
+    for path in fields:
+        head, _, rest = path.partition(".")
+        wanted.setdefault(head, []).append(rest)
+    return {key: value[key] if "" in rests else project(value[key], rests)
+            for key, rests in wanted.items() if key in value}
+
+
+def project_records(value: Any, fields: List[str]) -> Any:
+    """Project the result itself, or when none of the fields are its keys, the items of its lists."""
+    if isinstance(value, dict) and not any(path.partition(".")[0] in value for path in fields):
+        return {key: project(item, fields) if isinstance(item, list) else item for key, item in value.items()}
+    return project(value, fields)
+
+
+def top_k(value: Any, k: int) -> Any:
+    """The first k items of a list, or of each list directly inside a dict."""
+    if isinstance(value, list):
+        return value[:k]
+    if isinstance(value, dict):
+        return {key: item[:k] if isinstance(item, list) else item for key, item in value.items()}
+    return value
+
+
+def cut_to_bytes(text: str, max_bytes: int) -> str:
+    raw = text.encode("utf-8")
+    if len(raw) <= max_bytes:
+        return text
+    kept = raw[:max_bytes].decode("utf-8", errors="ignore")
+    return f"{kept}\n[... {len(raw) - len(kept.encode('utf-8'))} more bytes of this result were cut]"
+
+
+class OutputShape:
+    """How one tool's text output is cut down before it reaches the model."""
+
+    def __init__(self, fields: Optional[List[str]] = None, top_k: Optional[int] = None,
+                 max_bytes: Optional[int] = None) -> None:
+        self.fields = fields or None
+        self.top_k = top_k
+        self.max_bytes = max_bytes or None
+
+    @classmethod
+    def from_config(cls, server_config: Dict[str, Any], tool: str) -> "OutputShape":
+        """The shape set for ``tool`` in its toolOptions entry, then on its server's entry."""
+        options = {**server_config, **(server_config.get("toolOptions") or {}).get(tool, {})}
+        if "maxBytes" in options:
+            max_bytes = int(options["maxBytes"])
+        else:
+            max_bytes = int(options.get("maxTokens", DEFAULT_MAX_TOKENS)) * CHARS_PER_TOKEN
+        top = options.get("topK")
+        return cls(options.get("fields"), int(top) if top is not None else None, max_bytes)
+
+    def shape_text(self, text: str) -> str:
+        if self.fields or self.top_k is not None:
+            try:
+                value = json.loads(text)
+            except ValueError:
+                if self.top_k is not None:
+                    blocks = text.split("\n\n")
+                    text = "\n\n".join(blocks[:self.top_k])
+            else:
+                if self.top_k is not None:
+                    value = top_k(value, self.top_k)
+                if self.fields:
+                    value = project_records(value, self.fields)
+                text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        if self.max_bytes:
+            text = cut_to_bytes(text, self.max_bytes)
+        return text
+
+    def apply(self, server: str, tool: str, result: Any) -> Any:
+        """``result`` with its text content shaped (the bytes saved are recorded in output_stats)."""
+        content = getattr(result, "content", None)
+        if not content or getattr(result, "isError", False):
+            return result
+        raw_bytes = shaped_bytes = 0
+        shaped = []
+        for item in content:
+            text = getattr(item, "text", None)
+            if not isinstance(text, str):
+                shaped.append(item)
+                continue
+            new_text = self.shape_text(text)
+            raw_bytes += len(text.encode("utf-8"))
+            shaped_bytes += len(new_text.encode("utf-8"))
+            shaped.append(item if new_text == text else item.model_copy(update={"text": new_text}))
+        output_stats.record(server, tool, raw_bytes, shaped_bytes)
+        if shaped_bytes == raw_bytes:
+            return result
+        return result.model_copy(update={"content": shaped})
+
+
+class OutputStats:
+    """Bytes of tool output received vs. passed on to the model, per tool."""
+
+    def __init__(self) -> None:
+        self.tools: Dict[str, Dict[str, int]] = {}
+
+    def record(self, server: str, tool: str, raw_bytes: int, shaped_bytes: int) -> None:
+        counts = self.tools.setdefault(tool, {"calls": 0, "shaped": 0, "bytes_raw": 0, "bytes_shaped": 0})
+        counts["calls"] += 1
+        counts["shaped"] += shaped_bytes != raw_bytes
+        counts["bytes_raw"] += raw_bytes
+        counts["bytes_shaped"] += shaped_bytes
+        TOOL_OUTPUT_BYTES_TOTAL.inc(raw_bytes, server=server, stage="raw")
+        TOOL_OUTPUT_BYTES_TOTAL.inc(shaped_bytes, server=server, stage="shaped")
+        if shaped_bytes < raw_bytes:
+            logger.debug(f"Shaped {tool} output from {raw_bytes} to {shaped_bytes} bytes")
+
+    def stats(self) -> Dict[str, Any]:
+        raw = sum(counts["bytes_raw"] for counts in self.tools.values())
+        shaped = sum(counts["bytes_shaped"] for counts in self.tools.values())
+        return {
+            "bytes_raw": raw,
+            "bytes_shaped": shaped,
+            "bytes_saved": raw - shaped,
+            "saved_share": round((raw - shaped) / raw, 4) if raw else 0.0,
+            "tools": {tool: {**counts, "bytes_saved": counts["bytes_raw"] - counts["bytes_shaped"]}
+                      for tool, counts in self.tools.items()},
+        }
+
+
+output_stats = OutputStats()
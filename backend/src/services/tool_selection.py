@@ -0,0 +1,263 @@
+"""
+Per-Query Tool Selection
+
+Each agent run is offered only the MCP tools that look relevant to its question,
+instead of every loaded tool's schema. A cheap local classifier matches the question
+against keywords per tool (from the server's entry in mcp_config.json, or built-in
+defaults for the servers FinPal uses) and flags complex questions, which also get the
+reasoning tools. Greetings and plain receipt questions get no tools at all, which saves
+the schema tokens on every model call of the run and the tool round trips the
+"mandatory" sequential_thinking / memory calls used to cost.
+
+Per-server settings in mcp_config.json (tool-level entries in "toolOptions" win):
+    "brave-search": {..., "select": "auto", "keywords": ["news", "price"],
+                     "toolOptions": {"brave_local_search": {"keywords": ["near", "nearby"]}}}
+"select" is "auto" (offered when a keyword matches), "complex" (also offered to complex
+questions) or "always". Keywords are regular expressions matched at word starts.
+
+The filter runs in each tool's ``prepare`` hook, which sees the run's prompt, so plain,
+streamed and batch runs all get it.
+"""
+
+import json
+import logging
+import os
+import re
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+from src.services.metrics import TOOL_SCHEMA_TOKENS_TOTAL, TOOL_SELECTIONS_TOTAL
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+SELECT_MODES = ("auto", "complex", "always")
+
+# Defaults for the servers FinPal ships with, by server name without punctuation
+DEFAULT_PROFILES: Dict[str, Dict[str, Any]] = {
+    "bravesearch": {"select": "auto", "keywords": [
+        r"search", r"look up", r"latest", r"news", r"current(?:ly)?", r"today'?s", r"price[sd]?", r"cost",
+        r"cheap", r"deals?", r"offers?", r"discount", r"reviews?", r"reddit", r"opinions?", r"recommend",
+        r"best", r"inflation", r"econom", r"interest rate", r"exchange rate", r"market", r"alternatives?",
+        r"where (?:can|to|should) i"]},
+    "googlemaps": {"select": "auto", "keywords": [
+        r"near", r"nearby", r"closest", r"nearest", r"locations?", r"maps?", r"directions?", r"distance",
+        r"around me", r"open now", r"branch", r"address", r"rated", r"rating", r"where is"]},
+    "yfinance": {"select": "auto", "keywords": [
+        r"stocks?", r"shares?", r"ticker", r"invest", r"portfolio", r"market", r"tasi", r"tadawul",
+        r"aramco", r"dividend", r"index", r"etf", r"crypto", r"bitcoin", r"gold", r"econom", r"inflation"]},
+    "memory": {"select": "auto", "keywords": [
+        r"remember", r"recall", r"last time", r"earlier", r"previous(?:ly)?", r"forget", r"my preference",
+        r"i (?:like|prefer|told you|mentioned)", r"you (?:said|told|suggested)", r"about me"]},
+    "sequentialthinking": {"select": "complex", "keywords": []},
+}
+# Servers the system prompt used to make the model call on every query
+MANDATORY_SERVERS = ("sequentialthinking", "memory")
+
+_COMPLEX_RE = re.compile(
+    r"\b(?:compar\w*|versus|vs\b|plan\w*|budget\w*|analy[sz]\w*|forecast\w*|predict\w*|why|should i|"
+    r"strateg\w*|breakdown|trends?|advice|advise|optimi[sz]\w*|improve|reduce|cut down|save money|saving|"
+    r"afford|step by step|pros and cons|what if)\b", re.IGNORECASE)
+_GREETING_RE = re.compile(
+    r"^(?:hi|hello|hey|salam|assalam\w*|marhaba|ahlan|thanks?|thank you|shukran|ok(?:ay)?|good "
+    r"(?:morning|afternoon|evening|night)|bye|goodbye)\b", re.IGNORECASE)
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def prompt_text(prompt: Any) -> str:
+    """The text of a run's user prompt (a string, or a list of text and media parts)."""
+    if isinstance(prompt, str):
+        return prompt
+    if isinstance(prompt, (list, tuple)):
+        return " ".join(part for part in prompt if isinstance(part, str))
+    return ""
+
+
+def schema_tokens(name: str, description: str, parameters: Dict[str, Any]) -> int:
+    """Rough size of a tool declaration as sent to the model."""
+    declaration = {"name": name, "description": description, "parameters": parameters}
+    return len(json.dumps(declaration)) // CHARS_PER_TOKEN
+
+
+class ToolProfile:
+    """When one tool is worth offering."""
+
+    def __init__(self, name: str, server: str, select: str = "always", keywords: Iterable[str] = (),
+                 schema_tokens: int = 0) -> None:
+        if select not in SELECT_MODES:
+            logger.warning("Unknown select mode %r for tool %s, offering it always", select, name)
+            select = "always"
+        self.name = name
+        self.server = server
+        self.select = select
+        self.keywords = list(keywords)
+        self.pattern = re.compile(r"\b(?:" + "|".join(self.keywords) + ")", re.IGNORECASE) if self.keywords else None
+        self.schema_tokens = schema_tokens
+        self.mandatory = normalize_name(server) in MANDATORY_SERVERS
+
+    def matches(self, question: str, complex_query: bool) -> bool:
+        if self.select == "always":
+            return True
+        if self.select == "complex" and complex_query:
+            return True
+        return self.pattern is not None and self.pattern.search(question) is not None
+
+
+class ToolSelection:
+    """The tools offered to one run."""
+
+    def __init__(self, tools: FrozenSet[str], complex_query: bool, everything: bool,
+                 offered_tokens: int, withheld_tokens: int, mandatory_withheld: int) -> None:
+        self.tools = tools
+        self.complex_query = complex_query
+        self.everything = everything  # nothing was held back
+        self.offered_tokens = offered_tokens
+        self.withheld_tokens = withheld_tokens
+        self.mandatory_withheld = mandatory_withheld
+
+    @property
+    def mode(self) -> str:
+        return "all" if self.everything else "subset" if self.tools else "none"
+
+
+class ToolSelector:
+    """Picks the tools for each question and keeps count of what was held back."""
+
+    def __init__(self, enabled: bool = True, complex_words: int = 18, memo_size: int = 256) -> None:
+        self.enabled = enabled
+        self.complex_words = complex_words  # questions at least this long count as complex
+        self.memo_size = memo_size
+        self.profiles: Dict[str, ToolProfile] = {}
+        self._memo: "OrderedDict[str, ToolSelection]" = OrderedDict()
+        self.counts = {mode: 0 for mode in ("all", "subset", "none")}
+        self.offered_tokens = 0
+        self.withheld_tokens = 0
+        self.mandatory_withheld = 0
+        self.runs_without_mandatory = 0
+        self._recorded_runs: "weakref.WeakValueDictionary[int, Any]" = weakref.WeakValueDictionary()
+
+    def add_tool(self, name: str, server: str, server_config: Optional[Dict[str, Any]] = None,
+                 description: str = "", parameters: Optional[Dict[str, Any]] = None) -> ToolProfile:
+        """Profile a tool from its server's config entry (falling back to the built-in defaults)."""
+        server_config = server_config or {}
+        settings = dict(DEFAULT_PROFILES.get(normalize_name(server), {}))
+        settings.update({key: server_config[key] for key in ("select", "keywords") if key in server_config})
+        settings.update((server_config.get("toolOptions") or {}).get(name, {}))
+        profile = ToolProfile(
+            name, server,
+            # A tool we know nothing about can't be matched, so it is always offered
+            select=settings.get("select", "auto" if settings.get("keywords") else "always"),
+            keywords=settings.get("keywords", ()),
+            schema_tokens=schema_tokens(name, description, parameters or {}),
+        )
+        self.profiles[name] = profile
+        self._memo.clear()
+        return profile
+
+    def configure(self, client: Any) -> None:
+        """Profile every tool the MCP client loaded."""
+        self.profiles = {}
+        for server in client.servers:
+            for tool in getattr(server, "mcp_tools", []):
+                self.add_tool(tool.name, server.name, server.config, tool.description or "", tool.inputSchema)
+        logger.info("Tool selection %s for %d tools", "enabled" if self.enabled else "disabled", len(self.profiles))
+
+    def is_complex(self, question: str) -> bool:
+        return len(question.split()) >= self.complex_words or _COMPLEX_RE.search(question) is not None
+
+    def select(self, question: str) -> ToolSelection:
+        question = question.strip()
+        selection = self._memo.get(question)
+        if selection is not None:
+            self._memo.move_to_end(question)
+            return selection
+
+        complex_query = self.is_complex(question)
+        if not self.enabled or not question:
+            offered = list(self.profiles.values())
+        elif _GREETING_RE.match(question) and len(question.split()) <= 4:
+            offered = [profile for profile in self.profiles.values() if profile.select == "always"]
+        else:
+            offered = [profile for profile in self.profiles.values() if profile.matches(question, complex_query)]
+        withheld = [profile for profile in self.profiles.values() if profile not in offered]
+        selection = ToolSelection(
+            frozenset(profile.name for profile in offered), complex_query, not withheld,
+            sum(profile.schema_tokens for profile in offered), sum(profile.schema_tokens for profile in withheld),
+            sum(1 for profile in withheld if profile.mandatory),
+        )
+        self._memo[question] = selection
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return selection
+
+    def offers(self, question: str, tool_name: str) -> bool:
+        # Tools that weren't profiled (added outside the MCP client) are always offered
+        return tool_name not in self.profiles or tool_name in self.select(question).tools
+
+    def record(self, selection: ToolSelection, run: Any = None) -> None:
+        """Count one agent run's selection; ``run`` (its RunContext) makes repeat calls a no-op."""
+        if run is not None:
+            # A history can carry the dynamic system prompt more than once (two first turns of
+            # one session racing), and each copy is re-evaluated
+            if self._recorded_runs.get(id(run)) is run:
+                return
+            self._recorded_runs[id(run)] = run
+        self.counts[selection.mode] += 1
+        self.offered_tokens += selection.offered_tokens
+        self.withheld_tokens += selection.withheld_tokens
+        self.mandatory_withheld += selection.mandatory_withheld
+        if selection.mandatory_withheld and not any(self.profiles[name].mandatory for name in selection.tools):
+            self.runs_without_mandatory += 1
+        TOOL_SELECTIONS_TOTAL.inc(mode=selection.mode)
+        TOOL_SCHEMA_TOKENS_TOTAL.inc(selection.offered_tokens, offered="true")
+        TOOL_SCHEMA_TOKENS_TOTAL.inc(selection.withheld_tokens, offered="false")
+
+    def turn_note(self, selection: ToolSelection) -> str:
+        """What the per-turn prompt tells the model about the tools it has this time."""
+        if selection.everything:
+            return ""
+        if not selection.tools:
+            return ("Tools offered for this query: none. Answer directly from the receipt context; "
+                    "the mandatory tool rule does not apply.")
+        return (f"Tools offered for this query: {', '.join(sorted(selection.tools))}. "
+                "The mandatory tool rule only applies to tools in this list.")
+
+    def apply(self, tools: List[Any]) -> List[Any]:
+        """Wrap each pydantic-ai Tool's prepare hook so it drops out of runs it wasn't picked for."""
+        for tool in tools:
+            tool.prepare = self._selective_prepare(tool.prepare)
+        return tools
+
+    def _selective_prepare(self, prepare: Any) -> Any:
+        async def selective_prepare(ctx, tool_def):
+            if not self.offers(prompt_text(ctx.prompt), tool_def.name):
+                return None
+            return await prepare(ctx, tool_def) if prepare is not None else tool_def
+        return selective_prepare
+
+    def stats(self) -> Dict[str, Any]:
+        runs = sum(self.counts.values())
+        return {
+            "enabled": self.enabled,
+            "tools": len(self.profiles),
+            "runs": runs,
+            **{f"runs_{mode}": count for mode, count in self.counts.items()},
+            "schema_tokens_offered": self.offered_tokens,
+            "schema_tokens_withheld": self.withheld_tokens,
+            "withheld_share": round(self.withheld_tokens / max(self.offered_tokens + self.withheld_tokens, 1), 4),
+            # Each withheld mandatory tool is a call the old prompt forced; a run with none of them
+            # left also skips at least one model round trip
+            "mandatory_calls_avoided": self.mandatory_withheld,
+            "round_trips_avoided": self.runs_without_mandatory,
+        }
+
+
+tool_selector = ToolSelector(
+    enabled=os.environ.get("TOOL_SELECTION", "true").lower() not in ("0", "false", "no"),
+    complex_words=int(os.environ.get("TOOL_SELECTION_COMPLEX_WORDS", 18)),
+)
@@ -0,0 +1,190 @@
+"""
+Request Tracing
+
+Request-scoped spans, so a slow chat turn can be broken down into the receipt fetch,
+the system prompt, each Gemini round trip and each MCP tool call. The current span
+lives in a contextvar, which asyncio tasks and worker threads (asyncio.to_thread)
+inherit, so spans opened deep inside the agent nest under the request that caused
+them. Finished spans go to a pluggable exporter; a JSONL file exporter is included.
+"""
+
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes",
+                 "start_time", "end_time", "status", "error", "_start")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> None:
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self._start = time.perf_counter()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_time is None:
+            return None
+        return round((self.end_time - self.start_time) * 1000, 3)
+
+    def finish(self) -> None:
+        # Wall-clock end from a monotonic duration, so clock jumps don't give negative spans
+        self.end_time = self.start_time + (time.perf_counter() - self._start)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class SpanExporter:
+    """Receives every finished span. Subclass and override export()."""
+
+    def export(self, span: Span) -> None:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        pass
+
+
+class NoopSpanExporter(SpanExporter):
+    def export(self, span: Span) -> None:
+        pass
+
+
+class InMemorySpanExporter(SpanExporter):
+    """Keeps finished spans in a list (for tests and debugging)."""
+
+    def __init__(self) -> None:
+        self.spans: List[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+
+class JsonlSpanExporter(SpanExporter):
+    """Appends each finished span as one JSON line to a file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("finpal_current_span", default=None)
+_exporter: SpanExporter = NoopSpanExporter()
+
+
+def set_exporter(exporter: SpanExporter) -> SpanExporter:
+    """Send finished spans to ``exporter``, returns the previous one."""
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+
+def get_exporter() -> SpanExporter:
+    return _exporter
+
+
+def configure_from_env() -> SpanExporter:
+    """Pick the exporter from TRACE_EXPORTER (none or jsonl) and TRACE_FILE."""
+    kind = os.environ.get("TRACE_EXPORTER", "none").lower()
+    if kind == "jsonl":
+        path = os.environ.get("TRACE_FILE", "traces.jsonl")
+        logger.info(f"Writing trace spans to {path}")
+        set_exporter(JsonlSpanExporter(path))
+    elif kind not in ("", "none"):
+        logger.warning(f"Unknown TRACE_EXPORTER {kind!r}, tracing disabled")
+    return _exporter
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    active = _current_span.get()
+    return active.trace_id if active is not None else None
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """Time the block as a child of the current span (or as a new trace if there is none)."""
+    parent = _current_span.get()
+    trace_id = parent.trace_id if parent is not None else new_trace_id()
+    with _run(Span(name, trace_id, parent.span_id if parent is not None else None, attributes)) as active:
+        yield active
+
+
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+    """Open the root span of a request, reusing ``trace_id`` if the caller sent one."""
+    with _run(Span(name, trace_id or new_trace_id(), None, attributes)) as active:
+        yield active
+
+
+@contextmanager
+def _run(active: Span) -> Iterator[Span]:
+    token = _current_span.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.status = "error"
+        active.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        active.finish()
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Closed from another context (an async generator finalized elsewhere)
+            _current_span.set(None)
+        try:
+            _exporter.export(active)
+        except Exception as export_error:
+            logger.warning(f"Span exporter failed: {export_error}")
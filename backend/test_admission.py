@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+import sys
+import pathlib
+
+# Add the backend directory to the Python path to fix imports
+backend_dir = pathlib.Path(__file__).parent.resolve()
+sys.path.insert(0, str(backend_dir))
+
+from src.services.admission import AdmissionController, AdmissionRejected
+
+
+def test_queued_request_waits_for_slot():
+    async def scenario():
+        limiter = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1)
+        order = []
+
+        async def run(name):
+            async with limiter.slot():
+                order.append(name)
+                await asyncio.sleep(0.05)
+
+        await asyncio.gather(run("a"), run("b"))
+        return limiter, order
+
+    limiter, order = asyncio.run(scenario())
+    assert order == ["a", "b"]
+    stats = limiter.stats()
+    assert stats["admitted"] == 2 and stats["active"] == 0 and stats["queued"] == 0
+    assert stats["peak_queued"] == 1
+    assert stats["max_wait_ms"] > 0
+
+
+def test_queue_timeout_rejects_with_503():
+    async def scenario():
+        limiter = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        await limiter.acquire()
+        try:
+            with pytest.raises(AdmissionRejected) as rejected:
+                await limiter.acquire()
+        finally:
+            limiter.release()
+        return limiter, rejected.value
+
+    limiter, rejection = asyncio.run(scenario())
+    assert rejection.status_code == 503
+    assert rejection.retry_after >= 1
+    assert limiter.stats()["rejected_timeout"] == 1
+    assert limiter.stats()["queued"] == 0
@@ -67,4 +67,367 @@ def test_chat_endpoint_error_handling():
         )
         assert response.status_code == 500
         data = response.json()
-        assert "detail" in data 
\ No newline at end of file
+        assert "detail" in data 
+# Helper: parse a server-sent events body into (event, data) pairs
+def parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = block.split("\n")
+        event = lines[0].replace("event: ", "", 1)
+        data = json.loads(lines[1].replace("data: ", "", 1))
+        events.append((event, data))
+    return events
+
+from pydantic_ai.messages import ModelResponse, TextPart
+
+# Create a real agent backed by a scripted streaming model
+@pytest.fixture
+def streaming_agent():
+    from pydantic_ai import Agent
+    from pydantic_ai.models.function import FunctionModel
+
+    async def stream_reply(messages, info):
+        for chunk in ["``", "`html\n<div>", "Hello ", "there</div>\n`", "``"]:
+            yield chunk
+
+    def reply(messages, info):
+        reply.calls += 1
+        return ModelResponse(parts=[TextPart(content="<div>Hello there</div>")])
+    reply.calls = 0
+
+    agent = Agent(FunctionModel(reply, stream_function=stream_reply))
+    agent.reply = reply
+    return agent
+
+# Keep the tests away from Firestore: use a fixed receipt fingerprint
+@pytest.fixture(autouse=True)
+def fixed_receipt_fingerprint():
+    with patch("api.get_receipt_fingerprint", return_value="receipts-v1"):
+        yield
+
+# Test the streaming chat endpoint
+def test_chat_stream_endpoint(streaming_agent):
+    with patch("api.get_or_create_agent", return_value=streaming_agent):
+        response = client.post("/api/chat/stream", json={"message": "Say hello"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_sse(response.text)
+        deltas = "".join(data["text"] for event, data in events if event == "delta")
+        assert "```" not in deltas
+        assert deltas.strip() == "<div>Hello there</div>"
+        assert events[-1][0] == "done"
+        assert events[-1][1]["response"] == "<div>Hello there</div>"
+
+# A repeated question is answered from the cache until the receipts change
+def test_chat_answer_cache(streaming_agent):
+    import api
+    api.answer_cache.clear()
+    with patch("api.get_or_create_agent", return_value=streaming_agent):
+        # Each question opens a new conversation (turns with history aren't cached)
+        first = client.post("/api/chat", json={"message": "What did I spend most on?", "user_id": "u1",
+                                               "session_id": "cache-1"}).json()
+        second = client.post("/api/chat", json={"message": "what did i spend most on", "user_id": "u1",
+                                                "session_id": "cache-2"}).json()
+        assert "cached" not in first
+        assert second["cached"] is True
+        assert second["response"] == first["response"]
+        assert streaming_agent.reply.calls == 1
+
+        # Another user, or new receipt data, misses the cache
+        client.post("/api/chat", json={"message": "What did I spend most on?", "user_id": "u2",
+                                       "session_id": "cache-3"})
+        with patch("api.get_receipt_fingerprint", return_value="receipts-v2"):
+            client.post("/api/chat", json={"message": "What did I spend most on?", "user_id": "u1",
+                                           "session_id": "cache-4"})
+        assert streaming_agent.reply.calls == 3
+        assert client.get("/api/cache/stats").json()["hits"] == 1
+
+# A follow-up question depends on the conversation so far, so it is never answered from the cache
+def test_chat_answer_cache_skips_follow_ups():
+    from pydantic_ai import Agent
+    from pydantic_ai.models.function import FunctionModel
+    import api
+    api.answer_cache.clear()
+
+    def reply(messages, info):
+        # Answer about the first question of the conversation
+        topic = messages[0].parts[-1].content
+        return ModelResponse(parts=[TextPart(content=f"<div>{topic}: last month</div>")])
+
+    agent = Agent(FunctionModel(reply))
+    with patch("api.get_or_create_agent", return_value=agent), patch("api.get_receipt_records", return_value=None):
+        for session_id, topic in (("follow-up-a", "Groceries"), ("follow-up-b", "Dining")):
+            client.post("/api/chat", json={"message": topic, "session_id": session_id})
+        answers = [client.post("/api/chat", json={"message": "and last month?", "session_id": session_id}).json()
+                   for session_id in ("follow-up-a", "follow-up-b")]
+    assert answers[0] == {"response": "<div>Groceries: last month</div>"}
+    assert answers[1] == {"response": "<div>Dining: last month</div>"}
+
+# A conversation that starts with a cached answer keeps it (and the system prompt) for follow-ups
+def test_cached_first_turn_starts_the_history():
+    from pydantic_ai import Agent
+    from pydantic_ai.messages import SystemPromptPart, UserPromptPart
+    from pydantic_ai.models.function import FunctionModel
+    import api
+    api.answer_cache.clear()
+    seen = []
+
+    def reply(messages, info):
+        seen.append(messages)
+        return ModelResponse(parts=[TextPart(content=f"<div>answer {len(seen)}</div>")])
+
+    agent = Agent(FunctionModel(reply))
+
+    @agent.system_prompt(dynamic=True)
+    def finpal_prompt():
+        return "You are FinPal."
+
+    agent.system_prompt_refs = (finpal_prompt.__qualname__,)
+    with patch("api.get_or_create_agent", return_value=agent), patch("api.get_receipt_records", return_value=None):
+        client.post("/api/chat", json={"message": "What did I spend most on?", "session_id": "seed-a"})
+        cached = client.post("/api/chat", json={"message": "What did I spend most on?", "session_id": "seed-b"}).json()
+        client.post("/api/chat", json={"message": "and last month?", "session_id": "seed-b"})
+    assert cached == {"response": "<div>answer 1</div>", "cached": True}
+    assert len(seen) == 2
+    parts = [part for message in seen[1] for part in message.parts]
+    assert [part.content for part in parts if isinstance(part, SystemPromptPart)] == ["You are FinPal."]
+    assert [part.content for part in parts if isinstance(part, UserPromptPart)] == [
+        "What did I spend most on?", "and last month?"]
+    assert "<div>answer 1</div>" in [part.content for part in parts if isinstance(part, TextPart)]
+
+# A client can shorten or lengthen its deadline, but not turn it off
+def test_chat_rejects_non_positive_deadline():
+    for seconds in (-1, 0):
+        for endpoint in ("/api/chat", "/api/chat/stream"):
+            response = client.post(endpoint, json={"message": "Say hello", "deadline_seconds": seconds})
+            assert response.status_code == 422
+
+# Concurrent identical requests share one agent run
+def test_chat_single_flight():
+    import asyncio
+    import httpx
+    from pydantic_ai import Agent
+    from pydantic_ai.models.function import FunctionModel
+    import api
+
+    calls = []
+
+    async def slow_reply(messages, info):
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return ModelResponse(parts=[TextPart(content="<div>Done</div>")])
+
+    agent = Agent(FunctionModel(slow_reply))
+    payload = {"message": "Show me my receipts", "session_id": "flight-test", "no_cache": True}
+
+    async def send_twice():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(
+                async_client.post("/api/chat", json=payload),
+                async_client.post("/api/chat", json=payload),
+            )
+
+    with patch("api.get_or_create_agent", return_value=agent):
+        first, second = asyncio.run(send_twice())
+    assert first.json() == second.json() == {"response": "<div>Done</div>"}
+    assert len(calls) == 1
+
+
+def test_chat_admission_rejects_when_full():
+    import asyncio
+    import httpx
+    from pydantic_ai import Agent
+    from pydantic_ai.models.function import FunctionModel
+    from src.services.admission import AdmissionController
+    import api
+
+    async def slow_reply(messages, info):
+        await asyncio.sleep(0.2)
+        return ModelResponse(parts=[TextPart(content="<div>Done</div>")])
+
+    agent = Agent(FunctionModel(slow_reply))
+
+    async def send_two():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(
+                async_client.post("/api/chat", json={"message": "First", "no_cache": True}),
+                async_client.post("/api/chat", json={"message": "Second", "no_cache": True}),
+            )
+
+    limiter = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=5)
+    with patch("api.get_or_create_agent", return_value=agent), patch("api.admission", limiter):
+        responses = asyncio.run(send_two())
+    codes = sorted(r.status_code for r in responses)
+    assert codes == [200, 429]
+    rejected = next(r for r in responses if r.status_code == 429)
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert limiter.stats()["rejected_queue_full"] == 1
+
+
+def test_live_and_ready_probes():
+    import api
+
+    class FakeClient:
+        def server_status(self):
+            return [{"name": "receipts", "status": "starting", "tools": 0, "startup_seconds": None, "error": None}]
+
+    with patch("api.get_or_create_agent", side_effect=AssertionError("probe must not build the agent")), \
+            patch("api.global_agent", None), patch("api.global_mcp_client", None), \
+            patch("api.warmup_client", FakeClient()):
+        assert client.get("/api/live").json()["status"] == "alive"
+        response = client.get("/api/ready")
+    assert response.status_code == 503
+    data = response.json()
+    assert data["ready"] is False
+    assert data["servers"][0]["name"] == "receipts"
+
+
+def test_agent_built_once_under_concurrent_requests():
+    import asyncio
+    import api
+
+    builds = []
+
+    async def slow_build(on_client=None):
+        builds.append(1)
+        await asyncio.sleep(0.05)
+        return None, MagicMock()
+
+    async def first_requests():
+        return await asyncio.gather(*(api.get_or_create_agent() for _ in range(5)))
+
+    with patch("api.get_pydantic_ai_agent", slow_build), patch("api.global_agent", None), \
+            patch("api.global_mcp_client", None), patch("api.agent_lock", asyncio.Lock()), \
+            patch.dict("api.warmup_state", {}):
+        agents = asyncio.run(first_requests())
+        assert api.warmup_state["status"] == "ready"
+    assert len(builds) == 1
+    assert all(agent is agents[0] for agent in agents)
+
+
+def test_chat_batch_runs_concurrently():
+    import asyncio
+    import time as time_module
+    from pydantic_ai import Agent
+    from pydantic_ai.models.function import FunctionModel
+
+    async def slow_echo(messages, info):
+        question = messages[-1].parts[-1].content
+        if question == "boom":
+            raise ValueError("model failed")
+        await asyncio.sleep(0.2)
+        return ModelResponse(parts=[TextPart(content=f"<div>{question}</div>")])
+
+    agent = Agent(FunctionModel(slow_echo))
+    questions = ["Total spend", "Top merchant", "boom", "Average receipt"]
+    with patch("api.get_or_create_agent", return_value=agent), patch("api.CHAT_BATCH_PARALLELISM", 4):
+        start = time_module.time()
+        response = client.post("/api/chat/batch", json={"messages": questions, "no_cache": True})
+        elapsed = time_module.time() - start
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["index"] for item in data["results"]] == [0, 1, 2, 3]
+    assert data["results"][0]["response"] == "<div>Total spend</div>"
+    assert data["results"][2]["error"] == "model failed"
+    assert data["succeeded"] == 3 and data["failed"] == 1
+    # Four 0.2s turns in parallel, not one after the other
+    assert elapsed < 0.6
+
+
+def test_metrics_endpoint(streaming_agent):
+    with patch("api.get_or_create_agent", return_value=streaming_agent):
+        client.post("/api/chat", json={"message": "Metrics please", "no_cache": True})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'finpal_requests_total{endpoint="chat",outcome="ok"}' in text
+    assert 'finpal_request_seconds_count{endpoint="chat"}' in text
+    assert "finpal_postprocess_seconds_count" in text
+    assert 'finpal_admission{stat="queued"}' in text
+
+
+def test_chat_trace_spans(streaming_agent):
+    from src.services import tracing
+
+    exporter = tracing.InMemorySpanExporter()
+    previous = tracing.set_exporter(exporter)
+    try:
+        with patch("api.get_or_create_agent", return_value=streaming_agent):
+            response = client.post(
+                "/api/chat",
+                json={"message": "Trace me", "no_cache": True},
+                headers={"X-Trace-ID": "trace-from-frontend"},
+            )
+    finally:
+        tracing.set_exporter(previous)
+    assert response.headers["X-Trace-ID"] == "trace-from-frontend"
+    spans = {span.name: span for span in exporter.spans}
+    assert spans["chat"].attributes["outcome"] == "ok"
+    assert spans["agent.run"].trace_id == "trace-from-frontend"
+    assert spans["agent.run"].parent_id == spans["chat"].span_id
+
+
+# A client that disconnects mid-run cancels the agent run and its in-flight tool calls
+def test_chat_cancelled_on_disconnect():
+    import asyncio
+    from pydantic_ai import Agent
+    from pydantic_ai.messages import ToolCallPart
+    from pydantic_ai.models.function import FunctionModel
+    from src.services.cancellation import track_current_task
+    import api
+
+    tool_state = {}
+
+    async def call_slow_tool(messages, info):
+        return ModelResponse(parts=[ToolCallPart(tool_name="slow_search", args={})])
+
+    agent = Agent(FunctionModel(call_slow_tool))
+
+    @agent.tool_plain
+    async def slow_search() -> str:
+        # Like MCPServer.execute_tool: registered with the run so it gets cancelled too
+        with track_current_task():
+            tool_state["started"] = True
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                tool_state["cancelled"] = True
+                raise
+        return "done"
+
+    async def disconnecting_client():
+        body = json.dumps({"message": "Search the news", "session_id": "disconnect-test", "no_cache": True}).encode()
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(0.2)  # the client goes away while the tool runs
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/api/chat", "raw_path": b"/api/chat", "query_string": b"",
+            "root_path": "", "headers": [(b"content-type", b"application/json")],
+            "client": ("test", 1), "server": ("test", 80),
+        }
+        await asyncio.wait_for(api.app(scope, receive, send), timeout=5)
+        await asyncio.sleep(0.05)
+        # Checked before asyncio.run() cancels leftover tasks itself
+        return sent, dict(tool_state)
+
+    cancelled_before = api.metrics.AGENT_RUNS_CANCELLED_TOTAL.value()
+    with patch("api.get_or_create_agent", return_value=agent):
+        sent, tool_state_at_disconnect = asyncio.run(disconnecting_client())
+    assert sent[0]["status"] == 499
+    assert tool_state_at_disconnect == {"started": True, "cancelled": True}
+    assert api.metrics.AGENT_RUNS_CANCELLED_TOTAL.value() == cancelled_before + 1
+    assert api.chat_flights.stats()["in_flight"] == 0
+    assert api.admission.stats()["active"] == 0
@@ -0,0 +1,112 @@
+import pytest
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, ToolReturnPart, UserPromptPart
+from src.services.conversation_store import ConversationStore
+
+# Helper: build the messages of one simple chat turn
+def make_turn(question, answer):
+    return [
+        ModelRequest(parts=[UserPromptPart(content=question)]),
+        ModelResponse(parts=[TextPart(content=answer)]),
+    ]
+
+# Sessions keep separate histories
+def test_sessions_are_isolated():
+    store = ConversationStore()
+    store.append("alice", make_turn("hi", "hello alice"))
+    store.append("bob", make_turn("hey", "hello bob"))
+    assert len(store.get("alice")) == 2
+    assert store.get("alice")[1].parts[0].content == "hello alice"
+    assert store.get("bob")[1].parts[0].content == "hello bob"
+    assert store.get("carol") == []
+
+# Per-session message cap trims the oldest turns first
+def test_session_trimmed_at_turn_boundary():
+    store = ConversationStore(max_session_messages=3)
+    store.append("s", make_turn("q1", "a1"))
+    store.append("s", make_turn("q2", "a2"))
+    history = store.get("s")
+    # Dropping one message would start mid-turn, so the whole first turn goes
+    assert len(history) == 2
+    assert history[0].parts[0].content == "q2"
+
+# A tool return left over from a trimmed turn is never the first message
+def test_trim_skips_orphaned_tool_returns():
+    store = ConversationStore(max_session_messages=4)
+    store.append("s", [
+        ModelRequest(parts=[UserPromptPart(content="q1")]),
+        ModelRequest(parts=[ToolReturnPart(tool_name="brave_web_search", content="x" * 100, tool_call_id="1")]),
+        ModelResponse(parts=[TextPart(content="a1")]),
+    ])
+    store.append("s", make_turn("q2", "a2"))
+    assert store.get("s")[0].parts[0].content == "q2"
+
+# Least recently used sessions are evicted by the global caps
+def test_lru_eviction_and_stats():
+    store = ConversationStore(max_sessions=2)
+    store.append("a", make_turn("q", "a"))
+    store.append("b", make_turn("q", "b"))
+    store.get("a")  # "a" is now the most recently used
+    store.append("c", make_turn("q", "c"))
+    assert store.get("b") == []
+    assert len(store.get("a")) == 2
+    stats = store.stats()
+    assert stats["sessions"] == 2
+    assert stats["evicted_sessions"] == 1
+    assert stats["total_bytes"] > 0
+    assert store.reset("a") == 2
+    assert store.stats()["sessions"] == 1
+
+# The global memory cap evicts sessions until we fit again
+def test_global_memory_cap():
+    store = ConversationStore(max_total_bytes=2000)
+    store.append("a", make_turn("q", "x" * 1000))
+    store.append("b", make_turn("q", "y" * 1000))
+    assert store.get("a") == []
+    assert store.stats()["total_bytes"] <= 2000
+
+# Trimming keeps the system prompt, pydantic-ai only re-adds it for an empty history
+def test_trim_keeps_system_prompt():
+    from pydantic_ai.messages import SystemPromptPart
+    store = ConversationStore(max_session_messages=2)
+    first = make_turn("q1", "a1")
+    first[0].parts.insert(0, SystemPromptPart(content="You are FinPal", dynamic_ref="finpal_system_prompt"))
+    store.append("s", first)
+    store.append("s", make_turn("q2", "a2"))
+    history = store.get("s")
+    assert [p.part_kind for p in history[0].parts] == ["system-prompt", "user-prompt"]
+    assert history[0].parts[1].content == "q2"
+
+# The shared store keeps sessions across store instances (workers) and trims the same way
+def test_shared_store_round_trip(tmp_path):
+    from src.services.conversation_store import SharedConversationStore
+    from src.services.state_store import SqliteStateStore
+    path = str(tmp_path / "state.db")
+    worker_a = SharedConversationStore(SqliteStateStore(path), max_session_messages=3)
+    worker_b = SharedConversationStore(SqliteStateStore(path), max_session_messages=3)
+    worker_a.append("s", make_turn("q1", "a1"))
+    worker_b.append("s", make_turn("q2", "a2"))
+    history = worker_a.get("s")
+    assert len(history) == 2
+    assert history[0].parts[0].content == "q2"
+    assert worker_b.stats()["sessions"] == 1
+    assert worker_b.reset("s") == 2
+    assert worker_a.get("s") == []
+
+# The shared store only pays for eviction every few writes, then catches up on the caps
+def test_shared_store_evicts_every_n_writes(tmp_path):
+    from src.services.conversation_store import SharedConversationStore
+    from src.services.state_store import SqliteStateStore
+    store = SharedConversationStore(SqliteStateStore(str(tmp_path / "state.db")), max_sessions=1, evict_every=3)
+    store.append("s1", make_turn("q1", "a1"))
+    store.append("s2", make_turn("q2", "a2"))
+    assert store.stats()["sessions"] == 2
+    store.append("s3", make_turn("q3", "a3"))
+    stats = store.stats()
+    assert stats["sessions"] == 1 and stats["evicted_sessions"] == 2
+    assert store.get("s3") != []
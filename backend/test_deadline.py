@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+import anyio
+from mcp import ClientSession
+from mcp.types import CallToolResult, JSONRPCMessage, JSONRPCRequest, TextContent, Tool as MCPTool
+from mcp.shared.message import SessionMessage
+from pydantic_ai.messages import ModelRequest, ToolReturnPart, UserPromptPart
+from pydantic_ai.models import ModelRequestParameters
+from pydantic_ai.tools import ToolDefinition
+from src.services.deadline import ANSWER_NOW_INSTRUCTION, deadline_scope
+from src.services.mcp_client import MCPServer, RequestIdTap
+from src.services.pydantic_mcp_agent import answer_now_if_out_of_time
+
+
+class SentMessages:
+    """Stands in for the write stream to an MCP server, keeping what is sent."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append(message)
+
+
+class SlowSession:
+    """Stands in for an MCP ClientSession whose server takes `delay` seconds per call."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.write = RequestIdTap(SentMessages())
+        self.notifications = []
+
+    async def call_tool(self, name, arguments=None):
+        request = JSONRPCRequest(jsonrpc="2.0", id=7, method="tools/call", params={"name": name})
+        await self.write.send(SessionMessage(message=JSONRPCMessage(request)))
+        await asyncio.sleep(self.delay)
+        return CallToolResult(content=[TextContent(type="text", text="result")])
+
+    async def send_notification(self, notification):
+        self.notifications.append(notification)
+
+
+def make_tool(delay):
+    server = MCPServer("slow", {})
+    server.session = SlowSession(delay)
+    tool = server.create_tool_instance(MCPTool(name="search", inputSchema={"type": "object"}))
+    return server, tool
+
+
+# A tool call that would run past the deadline is cut short, and the server told to stop
+def test_tool_call_cut_short_at_deadline():
+    server, tool = make_tool(delay=5)
+
+    async def call():
+        with deadline_scope(0.4, answer_reserve=0.2) as deadline:
+            deadline.min_tool_seconds = 0.05
+            result = await tool.function(None)
+            await asyncio.sleep(0)
+            return result, deadline
+
+    result, deadline = asyncio.run(call())
+    assert "did not finish" in result
+    assert deadline.events == {"tool_timeout": 1}
+    assert deadline.partial
+    assert server.session.notifications[0].root.params.requestId == 7
+
+
+# The cancel notification names the request that was sent, with other calls on the same session
+def test_cancel_notification_names_the_sent_request():
+    async def scenario():
+        to_server, server_reads = anyio.create_memory_object_stream(10)
+        server_writes, from_server = anyio.create_memory_object_stream(10)
+        server = MCPServer("silent", {"maxConcurrentCalls": 2})
+        tool = server.create_tool_instance(MCPTool(name="search", inputSchema={"type": "object"}))
+        async with ClientSession(from_server, RequestIdTap(to_server)) as session, server_writes, server_reads:
+            server.session = session
+            # The server never answers: two calls in flight, then the second is given up on
+            calls = [asyncio.create_task(tool.function(None, query=query)) for query in ("first", "second")]
+            requests = {}
+            while len(requests) < 2:
+                request = (await server_reads.receive()).message.root
+                requests[request.params["arguments"]["query"]] = request.id
+            calls[1].cancel()
+            notification = (await server_reads.receive()).message.root
+            calls[0].cancel()
+            await asyncio.gather(*calls, return_exceptions=True)
+        return requests, notification
+
+    requests, notification = asyncio.run(scenario())
+    assert requests["first"] != requests["second"]
+    assert notification.method == "notifications/cancelled"
+    assert notification.params["requestId"] == requests["second"]
+
+
+# Once only the answer reserve is left, tools are skipped and the model must answer
+def test_out_of_time_skips_tools_and_forces_answer():
+    server, tool = make_tool(delay=0)
+    tool_def = ToolDefinition(name="search", description="", parameters_json_schema={"type": "object"})
+    parameters = ModelRequestParameters(function_tools=[tool_def], allow_text_output=True, output_tools=[])
+    messages = [ModelRequest(parts=[ToolReturnPart(tool_name="search", content="r", tool_call_id="1")])]
+
+    async def call():
+        with deadline_scope(1, answer_reserve=5) as deadline:
+            return await tool.function(None), answer_now_if_out_of_time(messages, parameters), deadline
+
+    result, (new_messages, new_parameters), deadline = asyncio.run(call())
+    assert "was not run" in result
+    assert new_parameters.function_tools == []
+    assert isinstance(new_messages[-1].parts[-1], UserPromptPart)
+    assert new_messages[-1].parts[-1].content == ANSWER_NOW_INSTRUCTION
+    assert len(messages[-1].parts) == 1  # the history itself isn't changed
+    assert deadline.events == {"tool_skipped": 1, "answer_forced": 1}
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+import uvicorn
+from pydantic_ai import Agent
+
+from benchmarks.gemini_stub_server import create_app, parse_args
+from src.services import pydantic_mcp_agent
+
+
+@asynccontextmanager
+async def stub_model(monkeypatch, *stub_args):
+    """get_model() pointed at the stand-in, served over HTTP on a free local port."""
+    app = create_app(parse_args(["--latency", "0", "--tokens-per-second", "5000", *stub_args]))
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    monkeypatch.setenv("GEMINI_BASE_URL", f"http://127.0.0.1:{port}/v1beta/models/")
+    monkeypatch.setenv("MODEL_CHOICE", "gemini-stub")
+    try:
+        yield pydantic_mcp_agent.get_model(), app.state.stub
+    finally:
+        server.should_exit = True
+        await serving
+
+
+def make_agent(model, calls):
+    agent = Agent(model=model, system_prompt="You are FinPal.")
+
+    @agent.tool_plain
+    def lookup_prices(item: str = "coffee") -> str:
+        """Look up prices."""
+        calls.append(item)
+        return "Coffee costs 12 SAR"
+
+    return agent
+
+
+def test_agent_runs_against_stub(monkeypatch):
+    """The real GeminiModel calls the stand-in's tool, then gets its answer (plain and streamed)."""
+    calls = []
+
+    async def scenario():
+        async with stub_model(monkeypatch) as (model, stub):
+            agent = make_agent(model, calls)
+            result = await agent.run("How much did I spend on coffee?")
+            async with agent.run_stream("And on groceries?") as streamed:
+                chunks = [chunk async for chunk in streamed.stream_text(delta=True)]
+            return result, chunks, stub
+
+    result, chunks, stub = asyncio.run(scenario())
+    assert calls == ["coffee", "coffee"]
+    assert "How much did I spend on coffee?" in result.output
+    assert len(chunks) > 1 and "groceries" in "".join(chunks)
+    assert stub.requests == 4
+
+
+def test_scripted_replies(monkeypatch, tmp_path):
+    """Script rules pick replies by question and step; undeclared tool calls are dropped."""
+    script = tmp_path / "script.json"
+    script.write_text("""[
+        {"match": "rent", "steps": [
+            [{"functionCall": {"name": "unknown_tool", "args": {}}},
+             {"functionCall": {"name": "lookup_prices", "args": {"item": "rent"}}}],
+            [{"text": "<div>Rent is due.</div>"}]]},
+        {"steps": [{"candidates": [{"content": {"role": "model", "parts": [{"text": "<p>recorded</p>"}]},
+                                    "finishReason": "STOP", "index": 0}]}]}
+    ]""")
+    calls = []
+
+    async def scenario():
+        async with stub_model(monkeypatch, "--script", str(script)) as (model, _):
+            agent = make_agent(model, calls)
+            return await agent.run("When is rent due?"), await agent.run("Hello")
+
+    rent, hello = asyncio.run(scenario())
+    assert calls == ["rent"]
+    assert rent.output == "<div>Rent is due.</div>"
+    assert hello.output == "<p>recorded</p>"
+
+
+def test_example_script(monkeypatch):
+    """The example script in benchmarks/ loads and drives a tool call, then its answer."""
+    script = os.path.join(os.path.dirname(__file__), "benchmarks", "gemini_script.example.json")
+    searches = []
+
+    async def scenario():
+        async with stub_model(monkeypatch, "--script", script) as (model, _):
+            agent = Agent(model=model, system_prompt="You are FinPal.")
+
+            @agent.tool_plain
+            def brave_web_search(query: str, count: int = 10) -> str:
+                """Search the web."""
+                searches.append(query)
+                return "Flat white: SAR 12"
+
+            return await agent.run("How much do I spend on coffee?"), await agent.run("How am I doing?")
+
+    coffee, other = asyncio.run(scenario())
+    assert searches == ["coffee prices Riyadh"]
+    assert "SAR 40.50" in coffee.output
+    assert "groceries went up" in other.output
+
+
+def test_errors_use_gemini_envelope():
+    """Errors come back as {"error": {"code", "message", "status"}}, like Gemini's."""
+    import httpx
+
+    app = create_app(parse_args(["--latency", "0"]))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gemini-stub/v1beta/") as client:
+            missing = await client.post("models/gemini-stub:generateContent", json={
+                "contents": [{"role": "user", "parts": [{"text": "hi"}]}], "cachedContent": "cachedContents/gone"})
+            small = await client.post("cachedContents", json={"model": "models/gemini-stub", "contents": []})
+            return missing, small
+
+    missing, small = asyncio.run(scenario())
+    assert missing.status_code == 403
+    assert missing.json() == {"error": {"code": 403, "status": "PERMISSION_DENIED",
+                                        "message": "CachedContent not found (or permission denied): cachedContents/gone"}}
+    assert small.status_code == 400 and small.json()["error"]["status"] == "INVALID_ARGUMENT"
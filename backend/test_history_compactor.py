@@ -0,0 +1,75 @@
+import pytest
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+from src.services.history_compactor import SUMMARY_HEADER, STUB_PREFIX, compact_history
+
+# Helper: build one chat turn that used a tool with a big result
+def make_turn(question, answer, tool_output="", system_prompt=None):
+    first_parts = [UserPromptPart(content=question)]
+    if system_prompt:
+        first_parts.insert(0, SystemPromptPart(content=system_prompt, dynamic_ref="finpal_system_prompt"))
+    messages = [ModelRequest(parts=first_parts)]
+    if tool_output:
+        messages += [
+            ModelResponse(parts=[ToolCallPart(tool_name="brave_web_search", args={"query": question}, tool_call_id="t1")]),
+            ModelRequest(parts=[ToolReturnPart(tool_name="brave_web_search", content=tool_output, tool_call_id="t1")]),
+        ]
+    messages.append(ModelResponse(parts=[TextPart(content=answer)]))
+    return messages
+
+def all_parts(messages):
+    return [part for message in messages for part in message.parts]
+
+# Small histories are left alone apart from stale tool outputs
+def test_stale_tool_outputs_are_stubbed():
+    history = make_turn("q1", "a1", tool_output="x" * 4000, system_prompt="You are FinPal")
+    history += make_turn("q2", "a2", tool_output="y" * 4000)
+    compacted, stats = compact_history(history, token_budget=100000)
+    returns = [p for p in all_parts(compacted) if p.part_kind == "tool-return"]
+    assert returns[0].content.startswith(STUB_PREFIX)
+    assert returns[1].content == "y" * 4000  # the latest turn keeps its tool output
+    assert stats["stubbed_tool_returns"] == 1
+    assert stats["folded_turns"] == 0
+    # The stored history is not modified in place
+    assert history[2].parts[0].content == "x" * 4000
+
+# Old turns fold into a summary that keeps the system prompt first
+def test_old_turns_fold_into_summary():
+    history = make_turn("first question", "<p>" + "a" * 2000 + "</p>", system_prompt="You are FinPal")
+    for i in range(2, 6):
+        history += make_turn(f"question {i}", "b" * 2000)
+    compacted, stats = compact_history(history, token_budget=1500)
+    assert stats["tokens_after"] <= 1500
+    assert stats["folded_turns"] == 3
+    first_parts = compacted[0].parts
+    assert first_parts[0].content == "You are FinPal"
+    assert first_parts[0].dynamic_ref == "finpal_system_prompt"
+    assert first_parts[1].content.startswith(SUMMARY_HEADER)
+    assert "first question" in first_parts[1].content
+    assert "<p>" not in first_parts[1].content
+    assert first_parts[2].content == "question 4"
+
+# Compacting an already compacted history extends the running summary
+def test_running_summary_carries_over():
+    history = make_turn("q1", "a" * 2000, system_prompt="You are FinPal")
+    for i in range(2, 5):
+        history += make_turn(f"q{i}", "b" * 2000)
+    compacted, _ = compact_history(history, token_budget=1200)
+    compacted += make_turn("q5", "c" * 2000)
+    compacted, _ = compact_history(compacted, token_budget=1200)
+    summaries = [p for p in all_parts(compacted) if p.part_kind == "system-prompt" and p.content.startswith(SUMMARY_HEADER)]
+    assert len(summaries) == 1
+    assert "q1" in summaries[0].content and "q3" in summaries[0].content
@@ -0,0 +1,87 @@
+import os
+import sys
+from datetime import date, datetime
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from src.services.intent_router import parse_amount, route
+
+TODAY = date(2025, 3, 20)
+
+RECEIPTS = [
+    {"merchantName": "Starbucks", "total": "SAR 18.50", "category": "Coffee Shops", "date": "2025-03-02"},
+    {"merchantName": {"content": "Starbucks", "confidence": 0.9}, "total": 22, "category": "Coffee Shops",
+     "createdTime": datetime(2025, 2, 11, 9, 30)},
+    {"vendor": {"name": "Panda"}, "total": "1,245.75", "currency": "SAR", "category": "Groceries", "date": "14/03/2025"},
+    {"merchantName": "Jarir Bookstore", "total": 310, "category": "Shopping", "date": "2024-12-24"},
+    {"merchantName": "Broken", "total": "n/a"},
+]
+
+
+def test_lookups_are_answered_from_receipts():
+    listing = route("List my receipts", RECEIPTS, today=TODAY)
+    assert listing.intent == "receipt_list"
+    assert "RECEIPT LIST" in listing.html and listing.html.count("<tr class=") == 4
+    assert "SAR 1,596.25" in listing.html  # total row
+
+    starbucks = route("How much did I spend at Starbucks?", RECEIPTS, today=TODAY)
+    assert starbucks.intent == "total_spent" and "SAR 40.50" in starbucks.html
+
+    this_month = route("total spent at starbucks this month", RECEIPTS, today=TODAY)
+    assert "SAR 18.50" in this_month.html and "March 2025" in this_month.html
+
+    category = route("How much have I spent on groceries last month?", RECEIPTS, today=TODAY)
+    assert "couldn't find any receipts" in category.html
+
+    largest = route("What's my largest transaction this year?", RECEIPTS, today=TODAY)
+    assert largest.intent == "largest_transaction"
+    assert "SAR 1,245.75" in largest.html and "Panda" in largest.html and "14 Mar 2025" in largest.html
+
+    count = route("how many receipts do I have", RECEIPTS, today=TODAY)
+    assert count.intent == "receipt_count" and "<b>4</b>" in count.html
+
+
+def test_open_ended_questions_go_to_the_model():
+    for question in [
+        "How can I save money on groceries?",
+        "Compare my spending at Starbucks and Panda",
+        "How much did I spend on coffee beans?",  # not a merchant or category we know
+        "How much did I spend at Starbucks per week on average?",
+        "Show me a chart of my receipts",
+        "What's the inflation rate in Saudi Arabia?",
+    ]:
+        assert route(question, RECEIPTS, today=TODAY) is None, question
+
+
+def test_parse_amount():
+    assert parse_amount("SAR 1,245.75") == 1245.75
+    assert parse_amount({"content": "12,50", "confidence": 0.8}) == 12.5
+    assert parse_amount(None) is None
+
+
+def test_entities_match_whole_words_only():
+    jarir = route("How much did I spend at Jarir?", RECEIPTS, today=TODAY)
+    assert jarir is not None and "SAR 310.00" in jarir.html
+
+    # Part of a word is not a match ("bucks" in Starbucks, "pan" in Panda)
+    for question in ["How much did I spend at Bucks?", "How much did I spend at Pan?"]:
+        assert route(question, RECEIPTS, today=TODAY) is None, question
+
+    # Nor is a name that fits more than one merchant or category
+    receipts = RECEIPTS + [{"merchantName": "Coffee Corner", "total": 12, "category": "Cafes", "date": "2025-03-05"}]
+    assert route("How much did I spend on coffee?", receipts, today=TODAY) is None
+
+
+def test_answers_need_every_receipt_they_cover():
+    # Only the latest 3 receipts were fetched (back to February): March is covered, 2025 isn't
+    fetched = RECEIPTS[:3]
+    assert route("How much did I spend this month?", fetched, today=TODAY, limit=3) is not None
+    for question in ["How much did I spend this year?", "How many receipts do I have", "List my receipts"]:
+        assert route(question, fetched, today=TODAY, limit=3) is None, question
+    assert route("How many receipts do I have", fetched, today=TODAY, limit=10) is not None
+
+    # A receipt without a readable date might belong to the period
+    undated = RECEIPTS + [{"merchantName": "Starbucks", "total": 15, "category": "Coffee Shops", "date": "soon"}]
+    assert route("total spent at starbucks this month", undated, today=TODAY) is None
+    assert route("How much did I spend at Starbucks?", undated, today=TODAY) is not None
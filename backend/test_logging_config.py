@@ -0,0 +1,55 @@
+import logging
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from src.services.logging_config import SamplingFilter, lazy, parse_levels, truncate
+
+
+# Helper: a logger that writes formatted messages into a list
+def make_logger(name, level):
+    records = []
+
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            records.append(self.format(record))
+
+    test_logger = logging.getLogger(name)
+    test_logger.handlers = [ListHandler()]
+    test_logger.handlers[0].addFilter(SamplingFilter())
+    test_logger.propagate = False
+    test_logger.setLevel(level)
+    return test_logger, records
+
+
+def test_lazy_arguments_only_built_when_enabled():
+    calls = []
+
+    def expensive_dump():
+        calls.append(1)
+        return "{...}"
+
+    test_logger, records = make_logger("test.lazy", logging.INFO)
+    test_logger.debug("Response data: %s", lazy(expensive_dump))
+    assert calls == [] and records == []
+    test_logger.info("Response data: %s", lazy(expensive_dump))
+    assert calls == [1] and records == ["Response data: {...}"]
+
+
+def test_sampling_keeps_one_in_n():
+    test_logger, records = make_logger("test.sampling", logging.INFO)
+    for i in range(25):
+        test_logger.info("Cache hit %d", i, extra={"sample_every": 10})
+    test_logger.info("Not sampled")
+    assert records == ["Cache hit 0", "Cache hit 10", "Cache hit 20", "Not sampled"]
+
+
+def test_parse_levels_and_truncate():
+    assert parse_levels("api=DEBUG, src.services.mcp_client=warning,bad=LOUD,") == {
+        "api": logging.DEBUG,
+        "src.services.mcp_client": logging.WARNING,
+    }
+    assert truncate("short") == "short"
+    assert truncate("x" * 100, limit=10) == "xxxxxxxxxx... (100 chars)"
@@ -0,0 +1,36 @@
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from src.services.metrics import Counter, Histogram, Registry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.register(Histogram("demo_seconds", "Demo latency", ["tool"], buckets=(0.1, 1)))
+    latency.observe(0.05, tool="read")
+    latency.observe(0.5, tool="read")
+    latency.observe(3, tool="read")
+    text = registry.render()
+    assert "# TYPE demo_seconds histogram" in text
+    assert 'demo_seconds_bucket{tool="read",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{tool="read",le="1"} 2' in text
+    assert 'demo_seconds_bucket{tool="read",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{tool="read"} 3' in text
+    assert 'demo_seconds_sum{tool="read"} 3.55' in text
+
+
+def test_counter_labels_and_collectors():
+    registry = Registry()
+    calls = registry.register(Counter("demo_calls_total", "Demo calls", ["server", "outcome"]))
+    calls.inc(server='say "hi"', outcome="ok")
+    calls.inc(2, server='say "hi"', outcome="ok")
+    collected = []
+    registry.add_collector(lambda: collected.append(True))
+    text = registry.render()
+    assert 'demo_calls_total{server="say \\"hi\\"",outcome="ok"} 3' in text
+    assert collected == [True]
+    # Registering the same metric again returns the existing one
+    assert registry.register(Counter("demo_calls_total", "Demo calls", ["server", "outcome"])) is calls
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+import pytest
+from pydantic_ai import Agent
+from pydantic_ai.exceptions import UnexpectedModelBehavior
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+from src.services.model_router import ModelRouter, answer_problem
+from src.services.tool_selection import ToolSelector
+
+TIERS = {"flash": "gemini-2.5-flash", "pro": "gemini-2.5-pro-preview-03-25"}
+
+
+def make_router(**kwargs):
+    selector = ToolSelector()
+    for server, tool in [("brave-search", "brave_web_search"), ("yfinance", "get_stock_info"),
+                         ("receipt-tools", "export_csv")]:
+        selector.add_tool(tool, server, None, "A tool.", {"type": "object"})
+    return ModelRouter(TIERS, selector=selector, **kwargs)
+
+
+def test_questions_are_routed_by_difficulty():
+    router = make_router()
+    assert router.choose("hi").tier == "flash"
+    route = router.choose("How much did I spend at Starbucks and Panda?")
+    assert (route.tier, route.reason) == ("flash", "intent")
+    assert router.choose("Should I cut down on eating out?").reason == "complex"
+    # Needs both web search and market data
+    assert router.choose("Latest news on Aramco stock").reason == "tools"
+    assert router.choose("Latest news on coffee prices").tier == "flash"
+
+    assert not ModelRouter({"flash": "", "pro": TIERS["pro"]}).enabled
+    assert answer_problem("") == "empty"
+    assert answer_problem("tool_code\nbrave_search.search('x')") == "tool_code"
+    assert answer_problem("Sure, here you go") == "unformatted"
+    assert answer_problem("```html\n<div>ok</div>\n```") is None
+
+
+def test_failed_flash_answer_is_escalated_to_pro():
+    router = make_router()
+    replies = {
+        TIERS["flash"]: "tool_code\nbrave_search.search('coffee')",
+        TIERS["pro"]: "<div>Coffee is cheapest at Dose.</div>",
+    }
+    asked = []
+
+    def build(model_name):
+        def reply(messages, info):
+            asked.append(model_name)
+            return ModelResponse(parts=[TextPart(content=replies[model_name])])
+        return FunctionModel(reply)
+
+    router.configure(build)
+    agent = Agent(build("default"))
+    result = asyncio.run(router.run(agent, "Where is coffee cheapest?"))
+    assert result.output == replies[TIERS["pro"]]
+    assert asked == [TIERS["flash"], TIERS["pro"]]
+
+    stats = router.stats()
+    assert stats["routes"] == {"flash": 1} and stats["escalations"] == {"tool_code": 1}
+    flash, pro = stats["models"][TIERS["flash"]], stats["models"][TIERS["pro"]]
+    assert flash["runs"] == flash["failed"] == 1 and pro["runs"] == 1 and pro["failed"] == 0
+    # Same tokens, pro's prices are higher
+    assert 0 < flash["cost_usd"] < pro["cost_usd"] and stats["cost_usd"] > 0
+
+    # Without escalation the flash answer is returned as it is
+    router = make_router(escalate=False)
+    router.configure(build)
+    assert asyncio.run(router.run(agent, "Where is coffee cheapest?")).output == replies[TIERS["flash"]]
+
+
+def test_only_model_misbehaviour_is_retried_on_pro():
+    """A failing tool or a network error is raised as it is; a confused model gets another go on pro."""
+    asked = []
+
+    def build(model_name):
+        def reply(messages, info):
+            asked.append(model_name)
+            if model_name == TIERS["pro"]:
+                return ModelResponse(parts=[TextPart(content="<div>ok</div>")])
+            raise build.error
+        return FunctionModel(reply)
+
+    router = make_router()
+    router.configure(build)
+    agent = Agent(build("default"))
+
+    build.error = ConnectionError("tool server went away")
+    with pytest.raises(ConnectionError):
+        asyncio.run(router.run(agent, "Where is coffee cheapest?"))
+    assert asked == [TIERS["flash"]]
+    assert router.stats()["models"][TIERS["flash"]]["failed"] == 1
+
+    build.error = UnexpectedModelBehavior("Received empty model response")
+    assert asyncio.run(router.run(agent, "Where is coffee cheapest?")).output == "<div>ok</div>"
+    assert asked == [TIERS["flash"], TIERS["flash"], TIERS["pro"]]
+    assert router.stats()["escalations"] == {"error": 1}
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+import httpx
+
+from benchmarks.gemini_stub_server import create_app, parse_args
+from src.services.prompt_cache import ContextCache, ContextCacheTransport
+
+PREFIX = "You are FinPal. " * 300 + "USER RECEIPT CONTEXT (snapshot {}):\nCoffee 12 SAR"
+
+
+def request_body(snapshot="a1", question="What did I spend?"):
+    return {
+        "contents": [{"role": "user", "parts": [{"text": question}]}],
+        "systemInstruction": {"role": "user", "parts": [{"text": PREFIX.format(snapshot)}, {"text": "CURRENT TURN: today"}]},
+        "tools": {"functionDeclarations": [{"name": "lookup_prices", "description": "Look up prices."}]},
+    }
+
+
+def make_client(cache, *stub_args):
+    app = create_app(parse_args(["--latency", "0", "--tokens-per-second", "0", "--tool-calls", "0", *stub_args]))
+    transport = ContextCacheTransport(cache, inner=httpx.ASGITransport(app=app))
+    return httpx.AsyncClient(transport=transport, base_url="http://gemini-stub/v1beta/models/"), app.state.stub
+
+
+async def generate(client, body):
+    response = await client.post("/gemini-stub:generateContent", content=json.dumps(body))
+    assert response.status_code == 200, response.text
+    return response.json()["candidates"][0]["content"]["parts"][0]["text"]
+
+
+async def settle(cache):
+    while cache._creating:
+        await asyncio.sleep(0.01)
+
+
+def test_prefix_is_cached_and_replaced():
+    """First call sends the prefix and caches it; later calls reference it until the snapshot changes."""
+    cache = ContextCache(min_tokens=100)
+
+    async def scenario():
+        client, stub = make_client(cache)
+        await generate(client, request_body())
+        await settle(cache)
+        assert stub.cache_creates == 1 and stub.cached_requests == 0
+
+        # The stand-in rejects cachedContent sent together with systemInstruction or tools,
+        # and the per-turn suffix still reaches the model
+        answer = await generate(client, request_body(question="And on coffee?"))
+        assert stub.cached_requests == 1
+        assert "CURRENT TURN: today" in answer and "And on coffee?" in answer
+
+        # New receipt snapshot: sent in full once, cached again, old cached content deleted
+        await generate(client, request_body(snapshot="b2"))
+        await settle(cache)
+        assert stub.cache_creates == 2 and len(stub.cached_contents) == 1
+        await generate(client, request_body(snapshot="b2"))
+        assert stub.cached_requests == 2
+
+        # Cached content gone on the server: retried without it
+        stub.cached_contents.clear()
+        await generate(client, request_body(snapshot="b2"))
+        await client.aclose()
+
+    asyncio.run(scenario())
+    stats = cache.stats()
+    assert (stats["hit"], stats["miss"], stats["created"], stats["invalidated"]) == (3, 2, 2, 1)
+    assert stats["hit_rate"] == 0.6
+    assert stats["entries"] == 0
+
+
+class PlainErrorTransport(httpx.AsyncBaseTransport):
+    """Stands in for Gemini answering generate calls with a 400 unrelated to the cache while `fail` is set."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.fail = False
+        self.failed = 0
+
+    async def handle_async_request(self, request):
+        if self.fail and request.url.path.endswith(":generateContent"):
+            self.failed += 1
+            return httpx.Response(400, json={"error": {"code": 400, "status": "INVALID_ARGUMENT",
+                                                       "message": "Request contains an invalid argument."}})
+        return await self.inner.handle_async_request(request)
+
+
+def test_unrelated_error_keeps_the_cached_content():
+    """A 400 that doesn't name the cached content is returned as it is, without a retry."""
+    cache = ContextCache(min_tokens=100)
+    app = create_app(parse_args(["--latency", "0", "--tokens-per-second", "0", "--tool-calls", "0"]))
+    gemini = PlainErrorTransport(httpx.ASGITransport(app=app))
+    client = httpx.AsyncClient(transport=ContextCacheTransport(cache, inner=gemini),
+                               base_url="http://gemini-stub/v1beta/models/")
+
+    async def scenario():
+        await generate(client, request_body())
+        await settle(cache)
+        gemini.fail = True
+        response = await client.post("/gemini-stub:generateContent", content=json.dumps(request_body()))
+        assert response.status_code == 400
+        assert response.json()["error"]["status"] == "INVALID_ARGUMENT"
+        gemini.fail = False
+        await generate(client, request_body())
+        await client.aclose()
+
+    asyncio.run(scenario())
+    assert gemini.failed == 1
+    assert app.state.stub.cached_requests == 1
+    stats = cache.stats()
+    assert stats["invalidated"] == 0 and stats["entries"] == 1
+
+
+def test_small_or_refused_prefix_is_sent_in_full():
+    """Prefixes below the minimum are not cached, and a refused one isn't retried right away."""
+    small = ContextCache(min_tokens=100_000)
+    refused = ContextCache(min_tokens=100)
+
+    async def scenario():
+        client, stub = make_client(small)
+        await generate(client, request_body())
+        assert stub.cache_creates == 0
+        await client.aclose()
+
+        client, stub = make_client(refused, "--cache-min-tokens", "100000")
+        await generate(client, request_body())
+        await settle(refused)
+        await generate(client, request_body())
+        await settle(refused)
+        await client.aclose()
+
+    asyncio.run(scenario())
+    assert small.stats()["bypass"] == 1
+    assert refused.stats()["create_failed"] == 1
+    assert refused.stats()["miss"] == 2
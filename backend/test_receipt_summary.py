@@ -0,0 +1,71 @@
+import os
+import random
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from src.services.direct_context import format_receipt_dump
+from src.services.history_compactor import estimate_tokens
+from src.services.receipt_summary import build_receipt_summary
+
+
+class Document:
+    """Stands in for a Firestore document snapshot."""
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+def make_receipts(count=150):
+    rng = random.Random(7)
+    receipts = []
+    for i in range(count):
+        items = [{"description": f"Item {j}", "price": round(rng.uniform(2, 80), 2)} for j in range(rng.randint(1, 8))]
+        total = round(sum(item["price"] for item in items), 2)
+        day = f"2025-{rng.randint(1, 6):02d}-{rng.randint(1, 28):02d}"
+        receipts.append({
+            "vendor": {"name": rng.choice(["Panda", "Starbucks", "Jarir", "Tamimi", "Aldrees"])},
+            "category": rng.choice(["Groceries", "Coffee", "Books", "Fuel"]),
+            "total": total,
+            "subtotal": round(total / 1.15, 2),
+            "tax": round(total - total / 1.15, 2),
+            "currency": "SAR",
+            "paymentMethod": rng.choice(["mada", "cash", "visa"]),
+            "date": day,
+            "createdTime": f"{day}T12:00:00Z",
+            "user_id": "user-1",
+            "imageUrl": f"https://storage.example.com/receipts/{i:05d}.jpg",
+            "items": items,
+        })
+    return receipts
+
+
+def test_summary_has_precomputed_totals_and_is_much_smaller():
+    receipts = make_receipts()
+    summary = build_receipt_summary(receipts, token_budget=2000)
+    dump = format_receipt_dump([Document(f"receipt-{i:05d}", data) for i, data in enumerate(receipts)])
+
+    assert estimate_tokens(summary) <= 2000
+    assert estimate_tokens(dump) > 3 * estimate_tokens(summary)
+    assert "receipt-0" not in summary
+    coffee = sum(receipt["total"] for receipt in receipts if receipt["category"] == "Coffee")
+    assert f"Coffee | SAR {coffee:,.2f} |" in summary
+    june = [receipt for receipt in receipts if receipt["date"].startswith("2025-06")]
+    assert f"2025-06 | SAR {sum(r['total'] for r in june):,.2f} | {len(june)}" in summary
+    for section in ("SPENDING BY CATEGORY", "SPENDING BY MONTH", "SPENDING BY MERCHANT",
+                    "LARGEST TRANSACTIONS", "RECENT RECEIPTS"):
+        assert section in summary
+    assert "more not shown" in summary  # not all 150 receipts fit
+
+
+def test_small_budget_keeps_aggregates_and_drops_raw_rows():
+    summary = build_receipt_summary(make_receipts(), token_budget=300)
+    assert estimate_tokens(summary) <= 300
+    assert "SPENDING BY CATEGORY" in summary and "RECENT RECEIPTS" not in summary
+
+    assert "No receipts yet" in build_receipt_summary([{"total": None}])
@@ -0,0 +1,51 @@
+import pytest
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from src.services.response_processor import FALLBACK_ANSWER, StreamProcessor, process_response
+
+# Code fences are removed and whitespace trimmed
+def test_fences_removed():
+    assert process_response("```html\n<div>Hi</div>\n```") == "<div>Hi</div>"
+    assert process_response("  text with ``` inside ```  ") == "text with  inside"
+    assert process_response(None) is None
+
+# A sequential_thinking result is turned into an HTML answer after the tool code
+def test_tool_code_with_thinking_result():
+    reply = 'tool_code\nsequential_thinking.think(thought="x")\n{"result": "You spent most\\non food"}'
+    cleaned = process_response(reply)
+    assert cleaned.startswith("tool_code")
+    assert cleaned.endswith('<p class="text-lg">You spent most\non food</p></div>')
+
+# Text after the tool call is used when there is no thinking result
+def test_tool_code_with_trailing_text():
+    cleaned = process_response("brave_search.search(query='gold')\n\nGold is up 2% today.")
+    assert cleaned.endswith('<p class="text-lg">Gold is up 2% today.</p></div>')
+
+# Tool code with nothing useful gets the generic answer, HTML replies are left alone
+def test_tool_code_fallback_and_html_untouched():
+    assert process_response("yfinance.get_quote").endswith(FALLBACK_ANSWER)
+    html = "memory_tool.recall()\n<div>Answer</div>"
+    assert process_response(html) == html
+
+# Streaming gives the same text as processing the whole reply at once
+def test_stream_matches_full_processing():
+    reply = "```html\n<div class=\"p-4\">Your top category is ``food``</div>\n```"
+    processor = StreamProcessor()
+    streamed = "".join(processor.feed(reply[i:i + 3]) for i in range(0, len(reply), 3)) + processor.finish()
+    assert streamed.strip() == process_response(reply)
+    assert processor.thinking is False
+
+# Leading tool code is detected from the first chunks
+def test_stream_detects_tool_code():
+    processor = StreamProcessor()
+    assert processor.feed("sequential_") == ""
+    assert processor.feed("thinking.think(x)") == "sequential_thinking.think(x)"
+    assert processor.thinking is True
+    processor = StreamProcessor()
+    assert processor.feed("`") == ""  # could still be ```html
+    assert processor.feed("Hi there") == "`Hi there"
+    assert processor.thinking is False
@@ -0,0 +1,48 @@
+import pytest
+import os
+import sys
+import time
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from src.services.state_store import MemoryStateStore, SqliteStateStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStateStore()
+    return SqliteStateStore(str(tmp_path / "state.db"))
+
+# Least recently used values are evicted first, and reads count as use
+def test_evicts_least_recently_used(store):
+    for key in ("a", "b", "c"):
+        store.set("ns", key, key.encode())
+        time.sleep(0.001)
+    store.get("ns", "a")
+    assert store.evict("ns", max_items=2) == 1
+    assert store.get("ns", "b") is None
+    assert store.get("ns", "a") == b"a"
+    assert store.evict("ns", max_bytes=1) == 1
+    assert store.count("ns") == 1
+    assert store.total_size("ns") == 1
+
+# Expired values are gone, and namespaces don't see each other
+def test_ttl_and_namespaces(store):
+    store.set("ns", "old", b"x", ttl=0.01)
+    store.set("other", "old", b"y")
+    time.sleep(0.02)
+    assert store.get("ns", "old") is None
+    assert store.get("other", "old") == b"y"
+    assert store.clear("other") == 1
+    assert store.count("other") == 0
+
+# Two SQLite stores on the same file see each other's writes (one per worker)
+def test_sqlite_shared_between_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SqliteStateStore(path), SqliteStateStore(path)
+    first.set("answers", "k", b"v")
+    assert second.get("answers", "k") == b"v"
+    assert second.delete("answers", "k")
+    assert first.get("answers", "k") is None
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import sys
+import time
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from mcp.types import CallToolResult, TextContent, Tool as MCPTool
+from src.services.mcp_client import MCPServer
+from src.services.tool_cache import ToolResultCache, make_tool_key, tool_cache, tool_ttl
+
+
+class CountingSession:
+    """Stands in for an MCP ClientSession, counting the calls that reach the server."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def call_tool(self, name, arguments=None):
+        self.calls.append(arguments)
+        await asyncio.sleep(self.delay)
+        is_error = arguments.get("symbol") == "BAD"
+        return CallToolResult(content=[TextContent(type="text", text=f"{name} {arguments}")], isError=is_error)
+
+
+def make_tool(server_name, tool_name, config=None, delay=0.0):
+    server = MCPServer(server_name, config or {})
+    server.session = CountingSession(delay)
+    return server, server.create_tool_instance(MCPTool(name=tool_name, inputSchema={"type": "object"}))
+
+
+def test_repeated_calls_are_served_from_cache():
+    tool_cache.clear()
+    server, tool = make_tool("yfinance", "get_stock_info", delay=0.2)
+
+    async def scenario():
+        first = await tool.function(None, symbol="2222.SR", period=None)
+        # Same arguments in another order and spacing
+        again = await tool.function(None, **{"period": None, "symbol": " 2222.SR"})
+        # Identical calls in flight at the same time share one
+        joined = await asyncio.gather(*(tool.function(None, symbol="AAPL") for _ in range(3)))
+        errors = [await tool.function(None, symbol="BAD") for _ in range(2)]
+        return first, again, joined, errors
+
+    start = time.perf_counter()
+    first, again, joined, errors = asyncio.run(scenario())
+    assert again is first
+    assert joined[0] is joined[1] is joined[2]
+    assert all(error.isError for error in errors)
+    # 2222.SR once, AAPL once, and the error both times (errors aren't cached)
+    assert [call["symbol"] for call in server.session.calls] == ["2222.SR", "AAPL", "BAD", "BAD"]
+    assert time.perf_counter() - start < 1.1
+    stats = tool_cache.stats()
+    assert stats["hit"] == 1 and stats["shared"] == 2 and stats["uncacheable"] == 2
+
+
+def test_tools_without_a_ttl_always_call_the_server():
+    server, tool = make_tool("memory", "read_graph")
+
+    async def scenario():
+        for _ in range(2):
+            await tool.function(None)
+
+    asyncio.run(scenario())
+    assert len(server.session.calls) == 2
+
+    # Per-tool options beat the server's entry, which beats the default
+    config = {"cacheTtl": 600, "toolOptions": {"get_stock_history": {"cacheTtl": 3600}}}
+    assert tool_ttl("yfinance", config, "get_stock_history") == 3600
+    assert tool_ttl("yfinance", config, "get_stock_info") == 600
+    assert tool_ttl("yfinance", {}, "get_stock_info") == 60
+    assert tool_ttl("brave-search", {}, "brave_web_search") == 3600
+    assert tool_ttl("receipt-tools", {}, "export_csv") == 0
+
+
+def test_entries_expire_and_are_evicted_least_recently_used():
+    cache = ToolResultCache(max_entries=2)
+    keys = [make_tool_key("yfinance", "get_stock_info", {"symbol": symbol}) for symbol in "ABC"]
+    cache.put(keys[0], "a", ttl=60)
+    cache.put(keys[1], "b", ttl=60)
+    assert cache.get(keys[0]) == "a"  # now the most recently used
+    cache.put(keys[2], "c", ttl=60)
+    assert cache.get(keys[1]) is None and cache.get(keys[0]) == "a"
+    assert cache.stats()["evicted"] == 1
+
+    cache.put(keys[2], "c", ttl=-1)
+    assert cache.get(keys[2]) is None and cache.stats()["expired"] == 1
+
+    small = ToolResultCache(max_bytes=10)
+    small.put(keys[0], "x" * 11, ttl=60)
+    assert small.get(keys[0]) is None and small.stats()["uncacheable"] == 1
@@ -0,0 +1,64 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, ToolCallPart, ToolReturnPart
+from pydantic_ai.models.function import FunctionModel
+
+from src.services.mcp_client import MCPClient
+from src.services.tool_dispatch import tool_steps
+
+STUB_SERVER = os.path.join(os.path.dirname(__file__), "benchmarks", "stub_mcp_server.py")
+
+
+def three_searches_then_answer(messages, info):
+    if not any(isinstance(part, ToolReturnPart) for message in messages if isinstance(message, ModelRequest)
+               for part in message.parts):
+        return ModelResponse(parts=[
+            ToolCallPart(tool_name="brave_web_search", args={"query": query, "count": 1}, tool_call_id=query)
+            for query in ("coffee", "dates", "fuel")
+        ])
+    return ModelResponse(parts=[TextPart(content="done")])
+
+
+async def run_step(tmp_path, max_concurrent_calls):
+    config = tmp_path / f"mcp_config_{max_concurrent_calls}.json"
+    config.write_text(json.dumps({"mcpServers": {"brave-search": {
+        "command": sys.executable,
+        "args": [STUB_SERVER, "--role", "brave_search", "--latency", "0.3", "--jitter", "0"],
+        "priority": "essential",
+        "maxConcurrentCalls": max_concurrent_calls,
+        "cacheTtl": 0,  # every run has to reach the server
+    }}}))
+    client = MCPClient()
+    client.load_servers(str(config))
+    try:
+        tools = await client.start()
+        agent = Agent(FunctionModel(three_searches_then_answer), tools=tools)
+        steps_before = tool_steps.stats()["steps"]
+        start = time.perf_counter()
+        result = await agent.run("Compare prices")
+        elapsed = time.perf_counter() - start
+        assert result.output == "done"
+        assert tool_steps.stats()["steps"] == steps_before + 1
+        return elapsed, client.dispatch_stats()["servers"]["brave-search"]
+    finally:
+        await client.cleanup()
+
+
+def test_calls_of_one_step_overlap_on_one_session(tmp_path):
+    """Three 0.3s calls to one server take about 0.3s, unless the server only allows one at a time."""
+    elapsed, server = asyncio.run(run_step(tmp_path, 4))
+    assert elapsed < 0.75
+    assert server["peak_in_flight"] == 3 and server["queued_calls"] == 0
+
+    elapsed, server = asyncio.run(run_step(tmp_path, 1))
+    assert elapsed >= 0.85
+    assert server["peak_in_flight"] == 1 and server["queued_calls"] == 2
+    assert tool_steps.stats()["speedup"] > 1
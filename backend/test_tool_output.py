@@ -0,0 +1,56 @@
+import asyncio
+import json
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from mcp.types import CallToolResult, TextContent, Tool as MCPTool
+from src.services.mcp_client import MCPServer
+from src.services.tool_output import OutputShape, output_stats
+
+QUOTES = {"quotes": [{"symbol": f"S{i}", "price": 10 + i, "quote": {"bid": 9, "ask": 11, "volume": 1000},
+                      "longBusinessSummary": "A very long company description. " * 20} for i in range(10)],
+          "source": "yfinance"}
+
+
+class FixedSession:
+    """Stands in for an MCP ClientSession that always returns the same result."""
+
+    def __init__(self, result):
+        self.result = result
+
+    async def call_tool(self, name, arguments=None):
+        return self.result
+
+
+def test_json_is_projected_and_limited():
+    shape = OutputShape.from_config(
+        {"toolOptions": {"get_quotes": {"fields": ["symbol", "quote.ask"], "topK": 3}}}, "get_quotes")
+    shaped = json.loads(shape.shape_text(json.dumps(QUOTES, indent=2)))
+    assert shaped == {"quotes": [{"symbol": f"S{i}", "quote": {"ask": 11}} for i in range(3)], "source": "yfinance"}
+    assert json.loads(shape.shape_text(json.dumps(QUOTES["quotes"][0]))) == {"symbol": "S0", "quote": {"ask": 11}}
+
+    results = "\n\n".join(f"Title: Result {i}\nURL: https://example.com/{i}" for i in range(10))
+    assert OutputShape(top_k=2).shape_text(results).count("Title:") == 2
+    # Nothing configured: only the default token cap applies
+    assert OutputShape.from_config({}, "brave_web_search").shape_text(results) == results
+
+
+def test_oversized_output_is_cut_and_savings_recorded():
+    text = json.dumps(QUOTES)
+    server = MCPServer("yfinance-shaped", {"cacheTtl": 0, "maxTokens": 100})
+    server.session = FixedSession(CallToolResult(content=[TextContent(type="text", text=text)]))
+    tool = server.create_tool_instance(MCPTool(name="get_quotes_capped", inputSchema={"type": "object"}))
+
+    result = asyncio.run(tool.function(None))
+    shaped = result.content[0].text
+    assert len(shaped.encode("utf-8")) < 500 and "more bytes of this result were cut" in shaped
+    counts = output_stats.stats()["tools"]["get_quotes_capped"]
+    assert counts["shaped"] == 1 and counts["bytes_saved"] == len(text) - len(shaped)
+
+    # Errors are passed on whole
+    error = CallToolResult(content=[TextContent(type="text", text=text)], isError=True)
+    server.session = FixedSession(error)
+    assert asyncio.run(tool.function(None)) is error
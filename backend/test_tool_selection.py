@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from pydantic_ai import Agent, Tool
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+from src.services.tool_selection import ToolSelector
+
+SCHEMA = {"type": "object", "properties": {"query": {"type": "string", "description": "What to look up " * 10}}}
+
+
+class RunStandIn:
+    """Something weak-referenceable standing in for a RunContext."""
+
+
+def make_selector(**server_configs):
+    selector = ToolSelector()
+    for server, tool in [("brave-search", "brave_web_search"), ("brave-search", "brave_local_search"),
+                         ("memory", "read_graph"), ("sequential-thinking", "sequentialthinking"),
+                         ("yfinance", "get_stock_info"), ("receipt-tools", "export_csv")]:
+        selector.add_tool(tool, server, server_configs.get(server.replace("-", "_")), "A tool.", SCHEMA)
+    return selector
+
+
+def test_questions_get_the_tools_they_need():
+    selector = make_selector()
+    # A server without keywords in the config or the defaults is always offered
+    assert selector.select("hi there").tools == {"export_csv"}
+    assert selector.select("How much did I spend on groceries this month?").tools == {"export_csv"}
+    assert selector.select("What's the latest news on Aramco stock?").tools == {
+        "brave_web_search", "brave_local_search", "get_stock_info", "export_csv"}
+    assert selector.select("Should I cut my restaurant spending?").tools == {"sequentialthinking", "export_csv"}
+    assert "read_graph" in selector.select("What did I tell you about my budget last time?").tools
+
+    selection = selector.select("thanks!")
+    assert selection.mode == "subset" and selection.withheld_tokens > selection.offered_tokens > 0
+    assert selection.mandatory_withheld == 2
+    note = selector.turn_note(selection)
+    assert "export_csv" in note and "mandatory tool rule" in note
+
+    selector.enabled = False
+    selector._memo.clear()
+    assert selector.select("hi there").everything and selector.turn_note(selector.select("hi")) == ""
+
+
+def test_config_overrides_defaults():
+    selector = make_selector(
+        memory={"select": "always"},
+        brave_search={"keywords": ["coffee"], "toolOptions": {"brave_local_search": {"keywords": ["near"]}}},
+        receipt_tools={"keywords": ["export"]},
+    )
+    assert selector.select("hello").tools == {"read_graph"}
+    assert selector.select("cheapest coffee near me").tools == {"read_graph", "brave_web_search", "brave_local_search"}
+    assert selector.select("export my receipts").tools == {"read_graph", "export_csv"}
+
+
+def test_agent_is_only_offered_selected_tools():
+    selector = make_selector()
+    offered = []
+
+    async def reply(messages, info):
+        offered.append(sorted(tool.name for tool in info.function_tools))
+        return ModelResponse(parts=[TextPart(content="ok")])
+
+    def lookup(query: str = "") -> str:
+        return query
+
+    tools = [Tool(lookup, name=name, takes_ctx=False) for name in
+             ["brave_web_search", "read_graph", "sequentialthinking", "unprofiled_tool"]]
+    agent = Agent(FunctionModel(reply), tools=selector.apply(tools))
+
+    async def scenario():
+        await agent.run("hello")
+        await agent.run("Search the news about inflation in Saudi Arabia")
+
+    asyncio.run(scenario())
+    assert offered == [["unprofiled_tool"], ["brave_web_search", "unprofiled_tool"]]
+
+    # Counted once per run, however often its prompt is evaluated
+    selection = selector.select("hello")
+    run = RunStandIn()
+    selector.record(selection, run)
+    selector.record(selection, run)
+    stats = selector.stats()
+    assert stats["runs"] == 1 and stats["runs_subset"] == 1
+    assert stats["mandatory_calls_avoided"] == 2 and stats["round_trips_avoided"] == 1
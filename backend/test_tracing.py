@@ -0,0 +1,61 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+# Add the backend directory to the path so we can import the services
+sys.path.append(os.path.dirname(__file__))
+
+from src.services import tracing
+
+
+@pytest.fixture
+def exporter():
+    memory = tracing.InMemorySpanExporter()
+    previous = tracing.set_exporter(memory)
+    yield memory
+    tracing.set_exporter(previous)
+
+
+def test_spans_nest_across_tasks_and_threads(exporter):
+    def fetch_receipts():
+        with tracing.span("firestore.query"):
+            return "receipts"
+
+    async def call_tool():
+        with tracing.span("mcp.call_tool", tool="brave_search"):
+            await asyncio.sleep(0)
+
+    async def handle_request():
+        with tracing.start_trace("chat", trace_id="abc123") as root:
+            await asyncio.to_thread(fetch_receipts)
+            await asyncio.gather(asyncio.create_task(call_tool()), asyncio.create_task(call_tool()))
+            return root
+
+    root = asyncio.run(handle_request())
+    spans = {span.name: span for span in exporter.spans}
+    assert len(exporter.spans) == 4
+    assert all(span.trace_id == "abc123" for span in exporter.spans)
+    assert spans["firestore.query"].parent_id == root.span_id
+    assert spans["mcp.call_tool"].parent_id == root.span_id
+    assert spans["mcp.call_tool"].attributes == {"tool": "brave_search"}
+    assert tracing.current_span() is None
+
+
+def test_failed_span_and_jsonl_export(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    previous = tracing.set_exporter(tracing.JsonlSpanExporter(str(path)))
+    try:
+        with pytest.raises(ValueError):
+            with tracing.span("llm.request", model="gemini"):
+                raise ValueError("quota exceeded")
+    finally:
+        tracing.set_exporter(previous).shutdown()
+    [line] = path.read_text().splitlines()
+    record = json.loads(line)
+    assert record["name"] == "llm.request"
+    assert record["status"] == "error"
+    assert "quota exceeded" in record["error"]
+    assert record["duration_ms"] >= 0
@@ -1,3 +1,5 @@
+import { generateUniqueId } from '../utils/idGenerator';
+
 /**
  * MCPClient - API client to connect to our Python backend with MCP tool support
  * This service handles all communication with the AI backend server.
@@ -7,6 +9,8 @@ export class MCPClient {
   private remoteApiUrl?: string;
   private isConnected: boolean = false;
   private tools: any[] = [];
+  // Each client keeps its own conversation history on the backend
+  private sessionId: string = generateUniqueId();
 
   constructor() {
     // Prioritize local backend over remote server
@@ -133,7 +137,7 @@ export class MCPClient {
         headers: {
           'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ message: query })
+        body: JSON.stringify({ message: query, session_id: this.sessionId })
       });
 
       if (!response.ok) {
@@ -212,7 +216,8 @@ export class MCPClient {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json'
-        }
+        },
+        body: JSON.stringify({ session_id: this.sessionId })
       });
 
       if (!response.ok) {